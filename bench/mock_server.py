@@ -0,0 +1,222 @@
+"""
+Local stand-in for the K3Cloud WebAPI, for benchmarking the CLI.
+
+Implements the ExecuteBillQuery endpoint the k3cloud_webapi_sdk posts to
+and answers with synthetic rows for whatever FieldKeys are requested.
+Rows are deterministic per row index, so paging is stable across requests.
+FilterString and OrderString are ignored, so --seek-key cannot be measured here.
+
+    python bench/mock_server.py --port 8090 --rows 200000 --latency-ms 50
+"""
+import argparse
+import datetime
+import json
+import random
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+
+SERVICE_PREFIX = "Kingdee.BOS.WebApi.ServicesStub.DynamicFormService."
+SESSION_ID = "mock-session-0001"
+
+# Row counts per registered form when not overridden
+DEFAULT_FORM_ROWS = {
+    "STK_Inventory": 50000,
+    "PUR_PurchaseOrder": 50000,
+    "STK_InStock": 50000,
+    "SAL_SaleOrder": 50000,
+    "SAL_OUTSTOCK": 50000,
+}
+
+_BASE_DATE = datetime.datetime(2024, 1, 1)
+
+
+def _column_generator(field: str, text_width: int, cardinality: int) -> Callable[[int], Any]:
+    """Pick a cheap value generator from the field key name."""
+    name = field.lower().split(".")[-1]
+    if any(k in name for k in ("qty", "price", "amount", "rate")):
+        return lambda i: round((i * 7919 % 100000) / 100, 2)
+    if name.endswith("date") or "time" in name:
+        return lambda i: (_BASE_DATE + datetime.timedelta(minutes=i)).strftime("%Y-%m-%dT%H:%M:%S")
+    if name == "fid":
+        # Roughly three entry rows per bill
+        return lambda i: i // 3 + 1
+    if name.endswith("entryid"):
+        return lambda i: i + 1
+    if name == "fbillno":
+        return lambda i: f"BILL{i // 3 + 1:08d}"
+    if "status" in name:
+        return lambda i: "ABCD"[i % 4]
+    prefix = field.strip("F")[:6]
+    return lambda i: f"{prefix}{i % cardinality:06d}".ljust(text_width, "x")
+
+
+class MockK3CloudServer:
+    """
+    Threaded HTTP server answering ExecuteBillQuery with synthetic data.
+
+    latency_ms / latency_per_row_us add a fixed and a per-row delay to every
+    response; error_rate returns a K3Cloud-style IsSuccess=false payload and
+    http_error_rate an HTTP 500 for that fraction of requests.
+    """
+
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        rows: Optional[Dict[str, int]] = None,
+        latency_ms: float = 0.0,
+        latency_per_row_us: float = 0.0,
+        text_width: int = 12,
+        cardinality: int = 200,
+        error_rate: float = 0.0,
+        http_error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.rows = dict(DEFAULT_FORM_ROWS)
+        self.rows.update(rows or {})
+        self.latency_ms = latency_ms
+        self.latency_per_row_us = latency_per_row_us
+        self.text_width = text_width
+        self.cardinality = cardinality
+        self.error_rate = error_rate
+        self.http_error_rate = http_error_rate
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pages: "OrderedDict[tuple, bytes]" = OrderedDict()
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/K3Cloud/"
+
+    def start(self) -> "MockK3CloudServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self) -> None:
+        self._httpd.serve_forever()
+
+    def _page(self, data: Dict[str, Any]) -> bytes:
+        form_id = data.get("FormId", "")
+        fields = [k.strip() for k in str(data.get("FieldKeys", "")).split(",") if k.strip()]
+        total = self.rows.get(form_id, 0)
+        top = int(data.get("TopRowCount") or 0)
+        if top > 0:
+            total = min(total, top)
+        start = int(data.get("StartRow") or 0)
+        limit = int(data.get("Limit") or 0) or total
+        key = (form_id, tuple(fields), start, limit, total)
+
+        with self._lock:
+            body = self._pages.get(key)
+            if body is not None:
+                self._pages.move_to_end(key)
+                return body
+
+        generators = [_column_generator(f, self.text_width, self.cardinality) for f in fields]
+        rows: List[List[Any]] = [[g(i) for g in generators] for i in range(start, min(start + limit, total))]
+        body = json.dumps(rows, ensure_ascii=False).encode("utf-8")
+
+        with self._lock:
+            self._pages[key] = body
+            while len(self._pages) > 256:
+                self._pages.popitem(last=False)
+        return body
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Set-Cookie", f"kdservice-sessionid={SESSION_ID}; path=/")
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                    roll = server._random.random()
+
+                if not self.path.endswith(SERVICE_PREFIX + "ExecuteBillQuery.common.kdsvc"):
+                    self._send(404, b'"unsupported service"')
+                    return
+                if roll < server.http_error_rate:
+                    self._send(500, b'"injected server error"')
+                    return
+                if roll < server.http_error_rate + server.error_rate:
+                    error = [[{"Result": {"ResponseStatus": {
+                        "ErrorCode": 500,
+                        "IsSuccess": False,
+                        "Errors": [{"Message": "injected query error"}],
+                    }}}]]
+                    self._send(200, json.dumps(error).encode("utf-8"))
+                    return
+
+                data = payload.get("data") or {}
+                if isinstance(data, str):
+                    data = json.loads(data)
+                body = server._page(data)
+
+                delay = server.latency_ms / 1000.0
+                if server.latency_per_row_us:
+                    delay += body.count(b"],[") * server.latency_per_row_us / 1e6
+                if delay > 0:
+                    time.sleep(delay)
+                self._send(200, body)
+
+        return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Mock K3Cloud ExecuteBillQuery server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    parser.add_argument("--rows", type=int, default=0, help="Rows per form (default: 50000 each)")
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--latency-per-row-us", type=float, default=0.0)
+    parser.add_argument("--text-width", type=int, default=12)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--http-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = MockK3CloudServer(
+        host=args.host,
+        port=args.port,
+        rows={form: args.rows for form in DEFAULT_FORM_ROWS} if args.rows else None,
+        latency_ms=args.latency_ms,
+        latency_per_row_us=args.latency_per_row_us,
+        text_width=args.text_width,
+        error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate,
+    )
+    print(f"Mock K3Cloud WebAPI listening on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""
+Throughput benchmarks for the K3Cloud CLI against bench/mock_server.py.
+
+Every scenario runs in a fresh child process so peak RSS is measured per
+scenario. Results are printed as a table and written as JSON; pass
+--baseline with an earlier JSON report to fail on regressions.
+
+    python bench/run_bench.py --rows 100000 --latency-ms 20
+    python bench/run_bench.py --baseline bench_baseline.json --max-regression 0.2
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(HERE), "src")
+
+sys.path.insert(0, HERE)
+from mock_server import MockK3CloudServer  # noqa: E402
+
+BENCH_COMMAND = "sales-order"
+BENCH_FORM_ID = "SAL_SaleOrder"
+
+# name -> (kind, extra CLI arguments for the query command)
+SCENARIOS: Dict[str, tuple] = {
+    "paging-serial": ("paging", ["--workers", "1"]),
+    "paging-parallel": ("paging", ["--workers", "4"]),
+    "paging-columnar": ("paging", ["--workers", "1", "--columnar"]),
+    "decode": ("decode", []),
+    "export-excel": ("export", []),
+    "export-excel-columnar": ("export", ["--columnar"]),
+    "export-excel-stream": ("export", ["--stream"]),
+    "export-csv-stream": ("export", ["--stream", "--output-format", "csv"]),
+    "export-parquet-stream": ("export", ["--stream", "--output-format", "parquet"]),
+    "export-parquet-columnar": ("export", ["--columnar", "--output-format", "parquet"]),
+}
+
+CONFIG_TEMPLATE = """[k3cloud]
+server_url={server_url}
+acct_id=bench
+app_id=bench_app
+app_secret=bench_secret
+user_name=bench
+excel_file={excel_file}
+"""
+
+
+def _peak_rss_mb() -> Optional[float]:
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1048576
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes elsewhere
+    return peak / 1048576 if sys.platform == "darwin" else peak / 1024
+
+
+def _run_child(scenario: str, server_url: str, rows: int, page_size: int, repeat: int) -> Dict[str, Any]:
+    """Run one scenario in this process and return its measurements."""
+    sys.path.insert(0, SRC_DIR)
+    import main
+    import pagination
+    from client import K3CloudClient
+    from config import load_config
+
+    kind, extra = SCENARIOS[scenario]
+    workdir = tempfile.mkdtemp(prefix="k3bench_")
+    config_path = os.path.join(workdir, "config.ini")
+    with open(config_path, "w", encoding="utf-8") as f:
+        f.write(CONFIG_TEMPLATE.format(server_url=server_url, excel_file=os.path.join(workdir, "bench.xlsx")))
+
+    # The mock server has no QueryBusinessInfo
+    argv = [BENCH_COMMAND, "--limit", "0", "--page-size", str(page_size), "--no-metadata",
+            "--output", os.path.join(workdir, "bench_out")] + extra
+    args = main.build_parser().parse_args(["--config", config_path] + argv)
+    client = K3CloudClient(load_config(config_path))
+    os.chdir(workdir)
+
+    try:
+        if kind == "decode":
+            # JSON decoding alone, on one real page fetched up front
+            data = pagination.build_query_data(BENCH_FORM_ID, args, 0, page_size)
+            response = client.bill_query(data)
+            started = time.perf_counter()
+            decoded = 0
+            for _ in range(repeat):
+                decoded += len(pagination._decode_rows(response, first=True))
+            seconds = time.perf_counter() - started
+            return {"rows": decoded, "seconds": seconds, "bytes": len(response.encode("utf-8")) * repeat}
+
+        run: Callable[[], Any]
+        if kind == "paging":
+            run = lambda: args.handler(client, args)
+        else:
+            run = lambda: main.run_command(client, args)
+
+        started = time.perf_counter()
+        result = run()
+        seconds = time.perf_counter() - started
+        fetched = len(result) if isinstance(result, list) else rows
+        return {"rows": fetched, "seconds": seconds}
+    finally:
+        client.close()
+
+
+def run_scenario(scenario: str, server: MockK3CloudServer, rows: int, page_size: int, repeat: int) -> Dict[str, Any]:
+    requests_before = server.requests
+    proc = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--child", scenario,
+         "--server-url", server.url, "--rows", str(rows),
+         "--page-size", str(page_size), "--repeat", str(repeat)],
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        return {"scenario": scenario, "error": (proc.stderr or proc.stdout).strip().splitlines()[-1:]}
+
+    result = json.loads(proc.stdout.strip().splitlines()[-1])
+    result["scenario"] = scenario
+    result["requests"] = server.requests - requests_before
+    result["rows_per_sec"] = result["rows"] / result["seconds"] if result["seconds"] > 0 else 0.0
+    return result
+
+
+def format_table(results: List[Dict[str, Any]]) -> str:
+    header = f"{'scenario':<24}{'rows':>10}{'seconds':>10}{'rows/s':>12}{'requests':>10}{'peak MB':>10}"
+    lines = [header, "-" * len(header)]
+    for r in results:
+        if "error" in r:
+            lines.append(f"{r['scenario']:<24} FAILED: {' '.join(r['error'])}")
+            continue
+        peak = f"{r['peak_rss_mb']:.1f}" if r.get("peak_rss_mb") is not None else "n/a"
+        lines.append(
+            f"{r['scenario']:<24}{r['rows']:>10}{r['seconds']:>10.2f}"
+            f"{r['rows_per_sec']:>12.0f}{r['requests']:>10}{peak:>10}"
+        )
+    return "\n".join(lines)
+
+
+def compare_baseline(results: List[Dict[str, Any]], baseline_path: str, max_regression: float) -> List[str]:
+    """Return a message per scenario that got slower or bigger than allowed."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"] if "error" not in r}
+
+    regressions = []
+    for r in results:
+        base = baseline.get(r["scenario"])
+        if base is None:
+            continue
+        if "error" in r:
+            regressions.append(f"{r['scenario']}: failed")
+            continue
+        if r["rows_per_sec"] < base["rows_per_sec"] * (1 - max_regression):
+            regressions.append(
+                f"{r['scenario']}: {r['rows_per_sec']:.0f} rows/s vs baseline {base['rows_per_sec']:.0f}"
+            )
+        if r.get("peak_rss_mb") and base.get("peak_rss_mb") and r["peak_rss_mb"] > base["peak_rss_mb"] * (1 + max_regression):
+            regressions.append(
+                f"{r['scenario']}: peak RSS {r['peak_rss_mb']:.1f} MB vs baseline {base['peak_rss_mb']:.1f} MB"
+            )
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark the K3Cloud CLI against a local mock WebAPI")
+    parser.add_argument("--rows", type=int, default=50000, help="Rows in the benchmarked form")
+    parser.add_argument("--page-size", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Fixed server latency per request")
+    parser.add_argument("--latency-per-row-us", type=float, default=0.0, help="Extra server latency per returned row")
+    parser.add_argument("--text-width", type=int, default=12, help="Width of synthetic text values")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of IsSuccess=false responses")
+    parser.add_argument("--http-error-rate", type=float, default=0.0, help="Fraction of HTTP 500 responses")
+    parser.add_argument("--repeat", type=int, default=20, help="Decode iterations for the decode scenario")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS), help="Run only these scenarios (repeatable)")
+    parser.add_argument("--output", default="bench_output.json", help="JSON report path")
+    parser.add_argument("--baseline", default="", help="Earlier JSON report to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="Allowed slowdown / RSS growth vs baseline (fraction)")
+    parser.add_argument("--child", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--server-url", default="", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = _run_child(args.child, args.server_url, args.rows, args.page_size, args.repeat)
+        result["peak_rss_mb"] = _peak_rss_mb()
+        print(json.dumps(result))
+        return 0
+
+    server = MockK3CloudServer(
+        rows={BENCH_FORM_ID: args.rows},
+        latency_ms=args.latency_ms,
+        latency_per_row_us=args.latency_per_row_us,
+        text_width=args.text_width,
+        error_rate=args.error_rate,
+        http_error_rate=args.http_error_rate,
+    ).start()
+    try:
+        results = [
+            run_scenario(name, server, args.rows, args.page_size, args.repeat)
+            for name in (args.scenario or SCENARIOS)
+        ]
+    finally:
+        server.stop()
+
+    print(format_table(results))
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": sys.version.split()[0],
+        "settings": {k: v for k, v in vars(args).items() if k not in ("child", "server_url", "baseline")},
+        "results": results,
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.baseline:
+        regressions = compare_baseline(results, args.baseline, args.max_regression)
+        for message in regressions:
+            print(f"REGRESSION {message}")
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
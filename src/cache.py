@@ -0,0 +1,131 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CACHE_FILE = os.path.join("data", "query_cache.db")
+
+# Payload fields that determine an ExecuteBillQuery response
+_KEY_FIELDS = ("FormId", "FieldKeys", "FilterString", "OrderString", "TopRowCount", "StartRow", "Limit")
+
+
+class QueryCache:
+    """
+    SQLite-backed response cache for ExecuteBillQuery.
+
+    Entries expire after a per-form TTL (seconds, <= 0 disables caching for
+    that form). Bodies are stored zlib-compressed, and once the stored total
+    exceeds max_bytes the least recently read entries are evicted.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        default_ttl: int = 300,
+        max_bytes: int = 256 * 1024 * 1024,
+        form_ttls: Optional[Dict[str, int]] = None,
+        namespace: str = "",
+        refresh: bool = False,
+    ):
+        self.path = path
+        self.default_ttl = default_ttl
+        self.max_bytes = max_bytes
+        self.form_ttls = {k.lower(): v for k, v in (form_ttls or {}).items()}
+        self.namespace = namespace
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, form_id TEXT, expires_at REAL, "
+            "last_access REAL, size INTEGER, body BLOB)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_access ON entries (last_access)")
+        self._conn.commit()
+
+    def ttl_for(self, form_id: str) -> int:
+        return self.form_ttls.get((form_id or "").lower(), self.default_ttl)
+
+    def make_key(self, data: Dict[str, Any]) -> str:
+        payload = {k: data.get(k) for k in _KEY_FIELDS}
+        raw = json.dumps([self.namespace, payload], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def get(self, data: Dict[str, Any]) -> Optional[str]:
+        if self.refresh or self.ttl_for(data.get("FormId", "")) <= 0:
+            return None
+        key = self.make_key(data)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT expires_at, body FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            if row[0] < now:
+                self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                self._conn.commit()
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+        logger.debug(f"Cache hit for {data.get('FormId')} StartRow={data.get('StartRow')}")
+        return zlib.decompress(row[1]).decode("utf-8")
+
+    def put(self, data: Dict[str, Any], response: str) -> None:
+        ttl = self.ttl_for(data.get("FormId", ""))
+        if ttl <= 0:
+            return
+        body = zlib.compress(response.encode("utf-8"), 1)
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (key, form_id, expires_at, last_access, size, body) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.make_key(data), data.get("FormId"), now + ttl, now, len(body), body),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        self._conn.execute("DELETE FROM entries WHERE expires_at < ?", (time.time(),))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        evicted = 0
+        for key, size in self._conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            evicted += 1
+        logger.debug(f"Evicted {evicted} cache entries")
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def is_cacheable_response(response: Any) -> bool:
+    """Only successful row lists are cached; errors come back as {"Result": ...} (possibly wrapped in lists)."""
+    return isinstance(response, str) and response.startswith("[") and '"ResponseStatus"' not in response[:200]
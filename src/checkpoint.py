@@ -0,0 +1,140 @@
+import argparse
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import closing
+from typing import Any, Dict, Optional, Set
+
+from config import K3CloudConfig
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_CHECKPOINT_FILE = os.path.join("data", "checkpoints.db")
+
+# Resume points older than this are purged, as are those whose output file is gone
+MAX_CHECKPOINT_AGE = 30 * 24 * 3600
+
+# Run keys being resumed in this process (serve/schedule run queries concurrently)
+_ACTIVE: Set[str] = set()
+_ACTIVE_LOCK = threading.Lock()
+
+_COLUMNS = ("next_row", "rows", "last_key", "output", "output_format", "sheet", "output_bytes", "updated_at")
+
+
+class CheckpointBusy(RuntimeError):
+    """The same query is already being resumed by another fetch in this process."""
+
+
+def run_key(config: K3CloudConfig, form_id: str, args: argparse.Namespace) -> str:
+    """Identity of a paginated fetch: the same query against the same account resumes the same run."""
+    payload = [
+        config.server_url,
+        config.acct_id,
+        form_id,
+        args.field_keys,
+        args.filter_string,
+        getattr(args, 'order_string', ''),
+        getattr(args, 'top_row_count', 0),
+        getattr(args, 'start_row', 0),
+    ]
+    raw = json.dumps(payload, ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class Checkpoint:
+    """
+    Resume point of one StartRow-paginated export, kept in SQLite: the row
+    the fetch stopped at (next_row), the rows already written, the order
+    key of the last of them, and the output file with its size at that
+    point. No rows are stored; --resume truncates the output back to that
+    size, appends the rows from next_row on, and checks beforehand that the
+    row before next_row still has the recorded key.
+
+    Each call opens its own short connection, so a Checkpoint can be handed
+    between the fetch and the export. Entries older than
+    MAX_CHECKPOINT_AGE or whose output no longer exists are purged.
+    """
+
+    def __init__(self, path: str, key: str, form_id: str):
+        self.path = path
+        self.key = key
+        self.form_id = form_id
+        self._claimed = False
+
+    def _connect(self) -> sqlite3.Connection:
+        output_dir = os.path.dirname(self.path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        columns = [row[1] for row in conn.execute("PRAGMA table_info(checkpoint_runs)")]
+        if columns and "output_bytes" not in columns:
+            # Checkpoints of the page-storing format cannot be resumed from
+            conn.execute("DROP TABLE checkpoint_runs")
+            conn.execute("DROP TABLE IF EXISTS checkpoint_pages")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoint_runs ("
+            "run_key TEXT PRIMARY KEY, form_id TEXT, next_row INTEGER NOT NULL, rows INTEGER NOT NULL, "
+            "last_key TEXT, output TEXT NOT NULL, output_format TEXT NOT NULL, sheet TEXT, "
+            "output_bytes INTEGER NOT NULL, updated_at REAL NOT NULL)"
+        )
+        conn.commit()
+        return conn
+
+    def load(self) -> Optional[Dict[str, Any]]:
+        """The saved resume point, or None. last_key is decoded from JSON."""
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                f"SELECT {', '.join(_COLUMNS)} FROM checkpoint_runs WHERE run_key = ?", (self.key,)
+            ).fetchone()
+        if row is None:
+            return None
+        state = dict(zip(_COLUMNS, row))
+        state["last_key"] = json.loads(state["last_key"]) if state["last_key"] is not None else None
+        return state
+
+    def save(self, state: Dict[str, Any]) -> None:
+        values = dict(state, updated_at=time.time())
+        values["last_key"] = json.dumps(values.get("last_key"), ensure_ascii=False, default=str)
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO checkpoint_runs (run_key, form_id, {', '.join(_COLUMNS)}) "
+                f"VALUES (?, ?, {', '.join('?' for _ in _COLUMNS)})",
+                (self.key, self.form_id, *(values.get(c) for c in _COLUMNS)),
+            )
+
+    def clear(self) -> None:
+        if not os.path.exists(self.path):
+            return
+        with closing(self._connect()) as conn, conn:
+            conn.execute("DELETE FROM checkpoint_runs WHERE run_key = ?", (self.key,))
+
+    def purge(self) -> int:
+        """Delete stale resume points of any query; returns how many."""
+        if not os.path.exists(self.path):
+            return 0
+        stale = []
+        with closing(self._connect()) as conn, conn:
+            cutoff = time.time() - MAX_CHECKPOINT_AGE
+            for key, output, updated_at in conn.execute("SELECT run_key, output, updated_at FROM checkpoint_runs"):
+                if updated_at < cutoff or not os.path.exists(output):
+                    stale.append((key,))
+            conn.executemany("DELETE FROM checkpoint_runs WHERE run_key = ?", stale)
+        return len(stale)
+
+    def claim(self) -> None:
+        """Mark the run as being resumed in this process; a second claim raises CheckpointBusy."""
+        with _ACTIVE_LOCK:
+            if self.key in _ACTIVE:
+                raise CheckpointBusy(f"同一查询正在由另一个请求续传: {self.form_id}")
+            _ACTIVE.add(self.key)
+        self._claimed = True
+
+    def release(self) -> None:
+        if self._claimed:
+            with _ACTIVE_LOCK:
+                _ACTIVE.discard(self.key)
+            self._claimed = False
@@ -0,0 +1,36 @@
+import argparse
+from typing import Optional
+
+
+class CommandLineExit(Exception):
+    """
+    Raised by StrictArgumentParser where argparse would exit the process:
+    status 2 with the error message for bad arguments, status 0 with the
+    help text for --help.
+    """
+
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class StrictArgumentParser(argparse.ArgumentParser):
+    """
+    ArgumentParser for command lines parsed inside a running process (serve
+    requests, scheduled jobs, batch query specs): it never prints to the
+    process's stdout/stderr or exits, but raises CommandLineExit instead.
+    Subparsers added to it are strict as well.
+    """
+
+    def error(self, message: str):
+        raise CommandLineExit(2, message)
+
+    def exit(self, status: int = 0, message: Optional[str] = None):
+        raise CommandLineExit(status, message or "")
+
+    def print_help(self, file=None):
+        if file is not None:
+            super().print_help(file)
+            return
+        raise CommandLineExit(0, self.format_help())
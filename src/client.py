@@ -1,35 +1,150 @@
+import copy
 import json
 import logging
-from typing import Any, Dict, Optional
+import threading
+from contextlib import contextmanager, nullcontext
+from http.cookiejar import DefaultCookiePolicy
+from typing import Any, Dict, Iterator, Optional
+from urllib.parse import urlparse
 
+import requests
+from requests.adapters import HTTPAdapter
+
+from k3cloud_webapi_sdk.const.const_define import InvokeMethod, QueryMode
+from k3cloud_webapi_sdk.core.webapi_client import ValidResult
 from k3cloud_webapi_sdk.main import K3CloudApiSdk
 
+from cache import QueryCache, is_cacheable_response
 from config import K3CloudConfig
+from ratelimit import RateLimiter
 from utils import decode_app_secret
 
 from logger import get_logger
+from metrics import METRICS
 
 logger = get_logger(__name__)
 
 
+class PooledApiSdk(K3CloudApiSdk):
+    """
+    K3CloudApiSdk that posts through a shared keep-alive requests.Session.
+
+    The stock SDK calls requests.post() for every request, which opens a new
+    TCP/TLS connection each time. Instances created by K3CloudClient also
+    share one cookie store (the K3Cloud session id), guarded by a lock so
+    concurrent threads can read and refresh it safely. An optional shared
+    RateLimiter paces every request they post.
+    """
+
+    http_session: Optional[requests.Session] = None
+    cookie_lock: Optional[threading.Lock] = None
+    rate_limiter: Optional[RateLimiter] = None
+
+    def BuildHeader(self, service_url):
+        with self.cookie_lock:
+            return super().BuildHeader(service_url)
+
+    def FillCookieAndHeader(self, cookies, headers):
+        with self.cookie_lock:
+            super().FillCookieAndHeader(cookies, headers)
+
+    def PostJson(self, service_name, json_data=None, invoke_type=InvokeMethod.SYNC):
+        # Mirrors WebApiClient.PostJson, sending through self.http_session
+        if json_data is None:
+            json_data = {}
+        if self.identify.ServerUrl.endswith('/'):
+            req_url = self.identify.ServerUrl + service_name + '.common.kdsvc'
+        else:
+            req_url = self.identify.ServerUrl + '/' + service_name + '.common.kdsvc'
+
+        proxies = None
+        if self.proxy != '':
+            proxy_url = urlparse(self.proxy)
+            proxies = {proxy_url.scheme: self.proxy}
+
+        if invoke_type == InvokeMethod.QUERY:
+            json_data[QueryMode.BeginMethod_Header.value] = QueryMode.BeginMethod_Method.value
+            json_data[QueryMode.QueryMethod_Header.value] = QueryMode.QueryMethod_Method.value
+
+        with self.rate_limiter.slot() if self.rate_limiter is not None else nullcontext():
+            res = self.http_session.post(
+                url=req_url,
+                headers=self.BuildHeader(req_url),
+                data=json.dumps(json_data),
+                proxies=proxies,
+                timeout=(self.connectTimeout, self.requestTimeout),
+                verify=False,
+            )
+
+        if res.status_code == requests.codes.ok or res.status_code == requests.codes.partial:
+            self.FillCookieAndHeader(res.cookies, res.headers)
+            return ValidResult(res.text)
+        raise RuntimeError(res.text)
+
+
 class K3CloudClient:
-    def __init__(self, config: K3CloudConfig):
+    def __init__(
+        self,
+        config: K3CloudConfig,
+        cache: Optional[QueryCache] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
         self._config = config
-        self._sdk = self._init_sdk()
+        self._cache = cache
+        self._rate_limiter = rate_limiter or RateLimiter.from_values(config.rate_limit, config.max_inflight)
+        self._http = self._init_http_session()
+        self._cookie_lock = threading.Lock()
+        # Each thread works on its own shallow copy of the SDK so per-call
+        # timeouts stay thread-local, while config, connection pool and the
+        # authenticated session cookie are shared.
+        self._base_sdk = self._init_sdk()
+        self._local = threading.local()
+        self._local.sdk = self._base_sdk
 
     @property
     def config(self) -> K3CloudConfig:
         return self._config
 
+    @property
+    def cache(self) -> Optional[QueryCache]:
+        return self._cache
+
+    @property
+    def rate_limiter(self) -> Optional[RateLimiter]:
+        return self._rate_limiter
+
+    @property
+    def _sdk(self) -> K3CloudApiSdk:
+        sdk = getattr(self._local, "sdk", None)
+        if sdk is None:
+            sdk = copy.copy(self._base_sdk)
+            self._local.sdk = sdk
+        return sdk
+
     @property
     def sdk(self) -> K3CloudApiSdk:
         return self._sdk
 
+    def _init_http_session(self) -> requests.Session:
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=self._config.pool_size,
+            pool_maxsize=self._config.pool_size,
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        # The SDK tracks cookies itself and sends them as an explicit header
+        session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+        return session
+
     def _init_sdk(self) -> K3CloudApiSdk:
-        sdk = K3CloudApiSdk(self._config.server_url)
+        sdk = PooledApiSdk(self._config.server_url, timeout=self._config.request_timeout)
+        sdk.http_session = self._http
+        sdk.cookie_lock = self._cookie_lock
+        sdk.rate_limiter = self._rate_limiter
 
         app_secret = decode_app_secret(self._config.app_secret)
-        
+
         try:
             sdk.InitConfig(
                 self._config.acct_id,
@@ -39,6 +154,8 @@ class K3CloudClient:
                 self._config.server_url,
                 self._config.lcid,
                 self._config.org_num,
+                connect_timeout=self._config.connect_timeout,
+                request_timeout=self._config.request_timeout,
             )
         except Exception as e:
             logger.error(f"Failed to initialize SDK config: {e}")
@@ -46,34 +163,82 @@ class K3CloudClient:
 
         return sdk
 
-    def bill_query(self, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.ExecuteBillQuery(data)
+    @contextmanager
+    def _request_timeout(self, timeout_s: Optional[float]) -> Iterator[K3CloudApiSdk]:
+        """Yield this thread's SDK with its read timeout overridden for one call."""
+        sdk = self._sdk
+        if timeout_s is None:
+            yield sdk
+            return
+        previous = sdk.requestTimeout
+        sdk.requestTimeout = timeout_s
+        try:
+            yield sdk
+        finally:
+            sdk.requestTimeout = previous
+
+    def close(self) -> None:
+        self._http.close()
+
+    def bill_query(self, data: Dict[str, Any], timeout_s: Optional[float] = None, use_cache: bool = True) -> Any:
+        # use_cache=False always asks the server and leaves the cache as it is,
+        # for lookups that must see writes made since the response was cached
+        cache = self._cache if use_cache else None
+        if cache is not None:
+            with METRICS.timer("cache", form_id=data.get("FormId"), start_row=data.get("StartRow")) as m:
+                cached = cache.get(data)
+                m["hit"] = cached is not None
+                m["bytes"] = len(cached) if cached is not None else 0
+            if cached is not None:
+                return cached
+
+        with METRICS.timer("request", method="ExecuteBillQuery", form_id=data.get("FormId"), start_row=data.get("StartRow")) as m:
+            with self._request_timeout(timeout_s) as sdk:
+                result = sdk.ExecuteBillQuery(data)
+            m["bytes"] = len(result) if isinstance(result, str) else 0
+
+        if cache is not None and is_cacheable_response(result):
+            cache.put(data, result)
+        return result
 
     def save(self, form_id: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.Save(form_id, data)
+        with METRICS.timer("request", method="Save"), self._request_timeout(timeout_s) as sdk:
+            return sdk.Save(form_id, data)
+
+    def batch_save(self, form_id: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
+        with METRICS.timer("request", method="BatchSave"), self._request_timeout(timeout_s) as sdk:
+            return sdk.BatchSave(form_id, data)
 
     def submit(self, form_id: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.Submit(form_id, data)
+        with METRICS.timer("request", method="Submit"), self._request_timeout(timeout_s) as sdk:
+            return sdk.Submit(form_id, data)
 
     def audit(self, form_id: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.Audit(form_id, data)
+        with METRICS.timer("request", method="Audit"), self._request_timeout(timeout_s) as sdk:
+            return sdk.Audit(form_id, data)
 
     def view(self, form_id: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.View(form_id, data)
+        with METRICS.timer("request", method="View"), self._request_timeout(timeout_s) as sdk:
+            return sdk.View(form_id, data)
 
     def flex_save(self, form_id: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.FlexSave(form_id, data)
-    
+        with METRICS.timer("request", method="FlexSave"), self._request_timeout(timeout_s) as sdk:
+            return sdk.FlexSave(form_id, data)
+
     def get_sys_report_data(self, form_id: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        if hasattr(self._sdk, "getSysReportData"):
-            return self._sdk.getSysReportData(form_id, data)
-        return self._sdk.Execute("Kingdee.BOS.WebApi.ServicesStub.DynamicFormService.GetSysReportData", data)
+        with METRICS.timer("request", method="GetSysReportData"), self._request_timeout(timeout_s) as sdk:
+            if hasattr(sdk, "getSysReportData"):
+                return sdk.getSysReportData(form_id, data)
+            return sdk.Execute("Kingdee.BOS.WebApi.ServicesStub.DynamicFormService.GetSysReportData", data)
 
     def execute_service(self, service_full_name: str, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.Execute(service_full_name, data)
+        with METRICS.timer("request", method="Execute"), self._request_timeout(timeout_s) as sdk:
+            return sdk.Execute(service_full_name, data)
 
     def query_business_info(self, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.QueryBusinessInfo(data)
+        with METRICS.timer("request", method="QueryBusinessInfo"), self._request_timeout(timeout_s) as sdk:
+            return sdk.QueryBusinessInfo(data)
 
     def query_group_info(self, data: Dict[str, Any], timeout_s: Optional[float] = None) -> Any:
-        return self._sdk.QueryGroupInfo(data)
+        with METRICS.timer("request", method="QueryGroupInfo"), self._request_timeout(timeout_s) as sdk:
+            return sdk.QueryGroupInfo(data)
@@ -0,0 +1,300 @@
+import re
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DTYPE_KINDS = ("float", "int", "datetime", "bool", "string")
+
+# Text columns with at most this many distinct values are dictionary encoded
+DEFAULT_DICT_THRESHOLD = 10000
+
+_NULL_CODE = {(type(None), None): -1}
+
+# Field name suffix -> dtype, applied when --dtype gives nothing for a field
+_NAME_HINTS = (
+    (re.compile(r"(qty|price|amount)$", re.IGNORECASE), "float"),
+    (re.compile(r"(date|time)$", re.IGNORECASE), "datetime"),
+)
+
+
+def worth_encoding(distinct: int, rows: int, threshold: int) -> bool:
+    """
+    Whether a text column of `rows` values, `distinct` of them different, is
+    dictionary encoded: at most `threshold` distinct values (0 disables
+    encoding), each repeated on average, else codes only add to the size.
+    """
+    return threshold > 0 and distinct <= threshold and distinct * 2 <= rows
+
+
+def parse_dtype_hints(value: Optional[str]) -> Dict[str, str]:
+    """Parse "FQty:float,FDate:datetime" into {field_lower: kind}."""
+    hints: Dict[str, str] = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        field, sep, kind = item.partition(":")
+        kind = kind.strip().lower()
+        if not sep or kind not in DTYPE_KINDS:
+            raise RuntimeError(f"--dtype 格式错误: {item.strip()} (类型可选: {', '.join(DTYPE_KINDS)})")
+        hints[field.strip().lower()] = kind
+    return hints
+
+
+def hinted_kind(name: str, hints: Dict[str, str]) -> Optional[str]:
+    kind = hints.get(name.lower())
+    if kind:
+        return kind
+    for pattern, kind in _NAME_HINTS:
+        if pattern.search(name):
+            return kind
+    return None
+
+
+def _infer_kind(values: Sequence[Any]) -> str:
+    present = [v for v in values if v is not None]
+    if not present:
+        return "string"
+    if all(isinstance(v, bool) for v in present):
+        return "bool" if len(present) == len(values) else "string"
+    if all(isinstance(v, int) and not isinstance(v, bool) for v in present):
+        return "int" if len(present) == len(values) else "float"
+    if all(isinstance(v, (int, float)) and not isinstance(v, bool) for v in present):
+        return "float"
+    return "string"
+
+
+class _Column:
+    """
+    Typed chunks of one column, one NumPy array per page.
+
+    Text columns are dictionary encoded while they are decoded: each chunk
+    holds int32 codes into one shared list of distinct values (-1 for null),
+    until the column exceeds dict_threshold distinct values and falls back to
+    plain object arrays. Once complete, a column that fails worth_encoding
+    (values barely repeat) is decoded as well. Values are told apart by type
+    too, so 1 and True, or 0 and False, get codes of their own.
+    """
+
+    def __init__(self, name: str, kind: Optional[str], dict_threshold: int = DEFAULT_DICT_THRESHOLD):
+        self.name = name
+        self.kind = kind
+        self.chunks: List[Any] = []
+        self.dict_threshold = dict_threshold
+        self.categories: Optional[List[Any]] = [] if kind == "string" and dict_threshold > 0 else None
+        # (type, value) -> code; None maps to -1 (null) without being a category
+        self._codes: Dict[Tuple[type, Any], int] = dict(_NULL_CODE)
+
+    @property
+    def encoded(self) -> bool:
+        return self.categories is not None
+
+    def append(self, values: Sequence[Any]) -> None:
+        import numpy as np
+
+        if self.kind is None:
+            self.kind = _infer_kind(values)
+            if self.kind == "string" and self.dict_threshold > 0 and not self.chunks:
+                self.categories = []
+        try:
+            chunk = self._convert(np, values)
+        except (ValueError, TypeError, OverflowError) as e:
+            logger.warning(f"Column {self.name} does not fit {self.kind} ({e}); keeping it as text")
+            self._demote()
+            chunk = np.array(values, dtype=object)
+        self.chunks.append(chunk)
+
+    def _convert(self, np, values: Sequence[Any]):
+        if self.kind == "float":
+            return np.array(values, dtype=np.float64)
+        if self.kind == "int":
+            chunk = np.array(values, dtype=np.float64)
+            if np.isnan(chunk).any() or (chunk != np.floor(chunk)).any():
+                # Nulls or fractions: the whole column becomes float
+                self.kind = "float"
+                self.chunks = [c.astype(np.float64) for c in self.chunks]
+                return chunk
+            return np.array(values, dtype=np.int64)
+        if self.kind == "datetime":
+            return np.array(values, dtype="datetime64[ms]")
+        if self.kind == "bool":
+            if any(v is None for v in values):
+                raise ValueError("null in bool column")
+            return np.array(values, dtype=bool)
+        if self.encoded:
+            return self._encode(np, values)
+        return np.array(values, dtype=object)
+
+    def _encode(self, np, values: Sequence[Any]):
+        codes = self._codes
+        categories = self.categories
+        # Keyed with the type: 1 == True and 0 == False would share a code otherwise
+        keys = list(zip(map(type, values), values))
+        # dict.fromkeys: distinct values of the page in order, at C speed
+        for key in dict.fromkeys(keys):
+            if key not in codes:
+                codes[key] = len(categories)
+                categories.append(key[1])
+        chunk = np.fromiter(map(codes.__getitem__, keys), dtype=np.int32, count=len(values))
+        if len(categories) > self.dict_threshold:
+            # High cardinality (bill numbers, notes): codes no longer pay off
+            self.chunks = [self._decode(np, c) for c in self.chunks]
+            decoded = self._decode(np, chunk)
+            self._drop_dictionary()
+            return decoded
+        return chunk
+
+    def _drop_dictionary(self) -> None:
+        self.categories = None
+        self._codes = dict(_NULL_CODE)
+
+    def _decode(self, np, codes):
+        # Index -1 picks the trailing None
+        lookup = np.array(self.categories + [None], dtype=object)
+        return lookup[codes]
+
+    def _demote(self) -> None:
+        import numpy as np
+
+        if self.encoded:
+            self.chunks = [self._decode(np, c) for c in self.chunks]
+            self._drop_dictionary()
+        self.kind = "string"
+        self.chunks = [c.astype(object) for c in self.chunks]
+
+    def _concatenated(self):
+        import numpy as np
+
+        if len(self.chunks) != 1:
+            if self.chunks:
+                self.chunks = [np.concatenate(self.chunks)]
+            else:
+                self.chunks = [np.array([], dtype=np.int32 if self.encoded else object)]
+        if self.encoded and not worth_encoding(len(self.categories), len(self.chunks[0]), self.dict_threshold):
+            self.chunks = [self._decode(np, self.chunks[0])]
+            self._drop_dictionary()
+        return self.chunks[0]
+
+    def array(self):
+        """The column's values (decoded if dictionary encoded)."""
+        import numpy as np
+
+        chunk = self._concatenated()
+        return self._decode(np, chunk) if self.encoded else chunk
+
+    def values(self, start: int, stop: int) -> List[Any]:
+        import numpy as np
+
+        chunk = self._concatenated()[start:stop]
+        return (self._decode(np, chunk) if self.encoded else chunk).tolist()
+
+    def arrow_array(self, pa):
+        chunk = self._concatenated()
+        if self.encoded:
+            try:
+                dictionary = pa.array(self.categories)
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                dictionary = pa.array([str(v) for v in self.categories], type=pa.string())
+            return pa.DictionaryArray.from_arrays(pa.array(chunk, mask=chunk < 0), dictionary)
+        try:
+            # from_pandas: NaN / NaT (nulls in float and date columns) become nulls
+            return pa.array(chunk, from_pandas=True)
+        except (pa.ArrowInvalid, pa.ArrowTypeError):
+            return pa.array([None if v is None else str(v) for v in chunk.tolist()], type=pa.string())
+
+    def series_data(self):
+        """Data for a pandas column: a Categorical when dictionary encoded."""
+        codes = self._concatenated()
+        if not self.encoded:
+            return codes
+        import numpy as np
+        import pandas as pd
+
+        categories = pd.Index(self.categories, dtype=object)
+        if not categories.is_unique:
+            # pandas compares categories by value, so 1 and True would collide
+            return self._decode(np, codes)
+        return pd.Categorical.from_codes(codes, categories=categories)
+
+
+class ColumnarResult:
+    """
+    Query result held as one typed NumPy array per column.
+
+    Each decoded page is transposed into per-column chunks straight away, so
+    only one page of row lists is alive at a time and numeric/date cells are
+    stored unboxed. Chunks are concatenated once, when the result is read.
+    Column types come from explicit hints, then field name suffixes (Qty,
+    Price, Amount -> float; Date, Time -> datetime), then the first page.
+    """
+
+    def __init__(
+        self,
+        columns: Optional[Sequence[str]] = None,
+        hints: Optional[Dict[str, str]] = None,
+        dict_threshold: int = DEFAULT_DICT_THRESHOLD,
+    ):
+        self._names = list(columns) if columns else None
+        self._hints = hints or {}
+        self._dict_threshold = dict_threshold
+        self._columns: Optional[List[_Column]] = None
+        self._rows = 0
+
+    def __len__(self) -> int:
+        return self._rows
+
+    @property
+    def columns(self) -> List[str]:
+        return [c.name for c in self._columns or []]
+
+    @property
+    def kinds(self) -> Dict[str, str]:
+        return {c.name: c.kind for c in self._columns or []}
+
+    def _init_columns(self, width: int) -> None:
+        names = self._names
+        if names and len(names) != width:
+            logger.warning(f"Column count mismatch: Data has {width} columns, but field_keys has {len(names)}. Using default column names.")
+            names = None
+        if names:
+            self._columns = [_Column(name, hinted_kind(name, self._hints), self._dict_threshold) for name in names]
+        else:
+            self._columns = [_Column(str(i), None, self._dict_threshold) for i in range(width)]
+
+    def extend(self, rows: List[List[Any]]) -> None:
+        if not rows:
+            return
+        if self._columns is None:
+            self._init_columns(len(rows[0]))
+        for column, values in zip(self._columns, zip(*rows)):
+            column.append(values)
+        self._rows += len(rows)
+
+    @property
+    def encoded_columns(self) -> List[str]:
+        """Columns kept dictionary encoded; only final once every page is in."""
+        return [c.name for c in self._columns or [] if c.encoded]
+
+    def arrays(self) -> Dict[str, Any]:
+        return {c.name: c.array() for c in self._columns or []}
+
+    def to_dataframe(self):
+        """DataFrame of the columns; dictionary encoded columns become pandas categoricals."""
+        import pandas as pd
+
+        return pd.DataFrame({c.name: c.series_data() for c in self._columns or []}, copy=False)
+
+    def to_arrow(self):
+        """pyarrow Table of the columns; dictionary encoded columns become DictionaryArrays."""
+        import pyarrow as pa
+
+        columns = self._columns or []
+        return pa.Table.from_arrays([c.arrow_array(pa) for c in columns], names=[c.name for c in columns])
+
+    def iter_batches(self, batch_size: int = 10000) -> Iterator[List[List[Any]]]:
+        """Row batches for the row-oriented sinks, decoded one batch at a time."""
+        columns = self._columns or []
+        for start in range(0, self._rows, batch_size):
+            stop = start + batch_size
+            yield [list(row) for row in zip(*(c.values(start, stop) for c in columns))]
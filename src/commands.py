@@ -1,9 +1,22 @@
 import argparse
 import json
+import shlex
 import time
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
+from checkpoint import DEFAULT_CHECKPOINT_FILE
+from cli import CommandLineExit, StrictArgumentParser
 from client import K3CloudClient
-from logger import get_logger
+from columnar import DEFAULT_DICT_THRESHOLD, ColumnarResult, parse_dtype_hints
+import export
+import importer
+import reconcile
+from logger import ContextThreadPoolExecutor, get_logger
+import metadata
+from pagination import BATCH_SIZE, BillQueryError, build_query_data, iter_bill_query_batches, prepare_checkpoint
+import sinks
+import snapshot
+import summarize
+import sync
 
 COMMAND_HELP_MAP = {
     "inventory": "即时库存",
@@ -11,9 +24,154 @@ COMMAND_HELP_MAP = {
     "purchase-in":"采购入库单",
     "sales-order":"销售订单",
     "sales-out":"销售出库单",
+    "summarize": "分组汇总",
+    "fan-out": "多数据中心合并",
+    "reconcile": "订单执行对账",
 }
 
-def register_commands(subparsers) -> None:
+
+def _add_paging_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of pages fetched concurrently when limit=0",
+    )
+    parser.add_argument("--page-size", type=int, default=BATCH_SIZE, help="Rows per ExecuteBillQuery page (initial size when adaptive)")
+    parser.add_argument(
+        "--adaptive-page-size",
+        action="store_true",
+        help="Adjust the page size from observed latency and response size",
+    )
+    parser.add_argument("--min-page-size", type=int, default=100, help="Lower bound for adaptive page size")
+    parser.add_argument(
+        "--max-page-size",
+        type=int,
+        default=0,
+        help="Upper bound for adaptive page size (default: --page-size or 2000); keep within the server's row limit",
+    )
+    parser.add_argument("--target-latency", type=float, default=2.0, help="Target seconds per page for adaptive page size")
+    parser.add_argument("--max-page-bytes", type=int, default=0, help="Upper bound on response bytes per page for adaptive page size, 0 for none")
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="Retries per page on a network error or transient error response (not e.g. an unknown field), with exponential backoff and jitter",
+    )
+    parser.add_argument("--retry-delay", type=float, default=0.5, help="Backoff before the first retry in seconds, doubled on each further retry")
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Continue an interrupted export of the same query from its checkpoint: append the missing rows to its CSV/JSONL file or Excel sheet",
+    )
+    parser.add_argument(
+        "--checkpoint",
+        action="store_true",
+        help="Require a checkpoint (an error if this export cannot keep one). Exports keep one by default when --order-string "
+             "sorts by a unique key (e.g. FID or FEntity_FEntryID) and StartRow pages go to CSV, JSONL or non-streamed Excel",
+    )
+    parser.add_argument("--no-checkpoint", action="store_true", help="Do not keep a checkpoint for --resume")
+    parser.add_argument("--checkpoint-db", default="", help=f"SQLite file for the checkpoints (row offset, last key and output size per query; default: {DEFAULT_CHECKPOINT_FILE})")
+    parser.add_argument(
+        "--seek-key",
+        default="",
+        help="Keyset pagination: order by these comma separated fields (e.g. FID) and seek past the last key instead of using StartRow; "
+             "a key that is not unique needs a unique field (e.g. FEntity_FEntryID) in --order-string or --field-keys",
+    )
+
+
+def _add_split_arguments(parser: argparse.ArgumentParser, key_fields: str) -> None:
+    parser.add_argument(
+        "--split-columns",
+        type=int,
+        default=0,
+        help="Fetch --field-keys as parallel queries of at most this many fields each, joined back by --split-key "
+             "(limit=0 only), 0 to fetch all fields in one query",
+    )
+    parser.add_argument("--split-key", default=key_fields, help="Comma separated fields identifying a row, selected by every column group")
+
+
+def _add_output_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--stream",
+        action="store_true",
+        help="Write each page to the output as it arrives instead of collecting all rows first (limit=0 only)",
+    )
+    parser.add_argument(
+        "--output-format",
+        choices=sorted(sinks.SINK_TYPES),
+        default="excel",
+        help="Output format (excel appends to excel_file unless --stream is given)",
+    )
+    parser.add_argument("--output", default="", help="Output file path for --stream or non-excel formats")
+    parser.add_argument(
+        "--compression",
+        default="",
+        help="Compression codec for parquet (default snappy) / feather (default lz4), 'none' to disable",
+    )
+    parser.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Decode pages straight into typed per-column arrays instead of row lists (limit=0 without --stream)",
+    )
+    parser.add_argument(
+        "--dtype",
+        default="",
+        help="Column types of the exported data, e.g. FQty:float,FDate:datetime (float/int/datetime/bool/string); "
+             "overrides the form metadata. With --columnar, fields ending in Qty/Price/Amount and Date/Time "
+             "are typed by default and others inferred",
+    )
+    parser.add_argument(
+        "--dict-threshold",
+        type=int,
+        default=DEFAULT_DICT_THRESHOLD,
+        help="Dictionary encode text columns (pandas categoricals) with at most this many distinct values, "
+             "each repeated on average; 0 to disable",
+    )
+
+
+def _add_metadata_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument(
+        "--no-metadata",
+        action="store_true",
+        help="Skip the form metadata lookup (field key validation and column types)",
+    )
+    parser.add_argument("--refresh-metadata", action="store_true", help="Refetch the form metadata instead of using the cached copy")
+    parser.add_argument(
+        "--header",
+        choices=["key", "caption"],
+        default="key",
+        help="Column headers: field keys, or field captions from the form metadata",
+    )
+
+
+def _add_sync_arguments(parser: argparse.ArgumentParser, watermark_field: str, key_fields: str) -> None:
+    parser.add_argument(
+        "--sync",
+        action="store_true",
+        help="Incrementally upsert rows modified since the last sync into the local SQLite store",
+    )
+    parser.add_argument("--watermark-field", default=watermark_field, help="Modification time field used as the sync watermark")
+    parser.add_argument("--key-fields", default=key_fields, help="Comma separated primary key fields of the local table")
+    parser.add_argument("--db", default="", help="SQLite file for --sync / --snapshot (default: sqlite_file in config, else data/k3cloud.db)")
+    parser.add_argument("--full", action="store_true", help="Ignore the stored watermark / snapshot and start over")
+
+
+def _add_snapshot_arguments(parser: argparse.ArgumentParser, key_fields: str) -> None:
+    parser.add_argument(
+        "--snapshot",
+        action="store_true",
+        help="Compare the full result with the row hashes stored by the previous run and output only inserted, "
+             "updated and deleted rows (ChangeType column first)",
+    )
+    parser.add_argument("--snapshot-key", default=key_fields, help="Comma separated fields identifying a row across snapshots")
+    parser.add_argument("--snapshot-name", default="", help="Name of the stored snapshot (default: form id and --filter-string)")
+
+
+def register_commands(subparsers, query_parsers: Optional[Dict[str, argparse.ArgumentParser]] = None) -> None:
+    """Add every command; query_parsers, if given, collects the query subcommands by name."""
+    if query_parsers is None:
+        query_parsers = {}
     # Inventory Query
     parser_inventory = subparsers.add_parser("inventory", help=COMMAND_HELP_MAP["inventory"])
     parser_inventory.add_argument("--form-id", default="STK_Inventory")
@@ -26,7 +184,14 @@ def register_commands(subparsers) -> None:
     parser_inventory.add_argument("--top-row-count", type=int, default=0)
     parser_inventory.add_argument("--start-row", type=int, default=0)
     parser_inventory.add_argument("--order-string", default="")
+    _add_paging_arguments(parser_inventory)
+    _add_split_arguments(parser_inventory, "FID")
+    _add_output_arguments(parser_inventory)
+    _add_metadata_arguments(parser_inventory)
+    _add_sync_arguments(parser_inventory, "FUpdateTime", "FID")
+    _add_snapshot_arguments(parser_inventory, "FMaterialid,FStockId,FLot,FOwnerid,FStockStatusId")
     parser_inventory.set_defaults(handler=cmd_bill_query)
+    query_parsers["inventory"] = parser_inventory
 
     # Purchase Order Query
     parser_purchase_order = subparsers.add_parser("purchase-order", help=COMMAND_HELP_MAP["purchase-order"])
@@ -40,7 +205,14 @@ def register_commands(subparsers) -> None:
     parser_purchase_order.add_argument("--top-row-count", type=int, default=0)
     parser_purchase_order.add_argument("--start-row", type=int, default=0)
     parser_purchase_order.add_argument("--order-string", default="")
+    _add_paging_arguments(parser_purchase_order)
+    _add_split_arguments(parser_purchase_order, "FPOOrderEntry_FEntryID")
+    _add_output_arguments(parser_purchase_order)
+    _add_metadata_arguments(parser_purchase_order)
+    _add_sync_arguments(parser_purchase_order, "FModifyDate", "FPOOrderEntry_FEntryID")
+    _add_snapshot_arguments(parser_purchase_order, "FPOOrderEntry_FEntryID")
     parser_purchase_order.set_defaults(handler=cmd_bill_query)
+    query_parsers["purchase-order"] = parser_purchase_order
 
     # Purchase In Query
     parser_purchase_in = subparsers.add_parser("purchase-in", help=COMMAND_HELP_MAP["purchase-in"])
@@ -54,7 +226,14 @@ def register_commands(subparsers) -> None:
     parser_purchase_in.add_argument("--top-row-count", type=int, default=0)
     parser_purchase_in.add_argument("--start-row", type=int, default=0)
     parser_purchase_in.add_argument("--order-string", default="")
+    _add_paging_arguments(parser_purchase_in)
+    _add_split_arguments(parser_purchase_in, "FInStockEntry_FEntryID")
+    _add_output_arguments(parser_purchase_in)
+    _add_metadata_arguments(parser_purchase_in)
+    _add_sync_arguments(parser_purchase_in, "FModifyDate", "FBillNo")
+    _add_snapshot_arguments(parser_purchase_in, "FInStockEntry_FEntryID")
     parser_purchase_in.set_defaults(handler=cmd_bill_query)
+    query_parsers["purchase-in"] = parser_purchase_in
 
     # Sales Order Query
     parser_sales_order = subparsers.add_parser("sales-order", help=COMMAND_HELP_MAP["sales-order"])
@@ -68,7 +247,14 @@ def register_commands(subparsers) -> None:
     parser_sales_order.add_argument("--top-row-count", type=int, default=0)
     parser_sales_order.add_argument("--start-row", type=int, default=0)
     parser_sales_order.add_argument("--order-string", default="")
+    _add_paging_arguments(parser_sales_order)
+    _add_split_arguments(parser_sales_order, "FSaleOrderEntry_FEntryID")
+    _add_output_arguments(parser_sales_order)
+    _add_metadata_arguments(parser_sales_order)
+    _add_sync_arguments(parser_sales_order, "FModifyDate", "FSaleOrderEntry_FEntryID")
+    _add_snapshot_arguments(parser_sales_order, "FSaleOrderEntry_FEntryID")
     parser_sales_order.set_defaults(handler=cmd_bill_query)
+    query_parsers["sales-order"] = parser_sales_order
 
     # Sales out Query
     parser_sales_out = subparsers.add_parser("sales-out", help=COMMAND_HELP_MAP["sales-out"])
@@ -82,17 +268,139 @@ def register_commands(subparsers) -> None:
     parser_sales_out.add_argument("--top-row-count", type=int, default=0)
     parser_sales_out.add_argument("--start-row", type=int, default=0)
     parser_sales_out.add_argument("--order-string", default="")
+    _add_paging_arguments(parser_sales_out)
+    _add_split_arguments(parser_sales_out, "FEntity_FEntryID")
+    _add_output_arguments(parser_sales_out)
+    _add_metadata_arguments(parser_sales_out)
+    _add_sync_arguments(parser_sales_out, "FModifyDate", "FEntity_FEntryID")
+    _add_snapshot_arguments(parser_sales_out, "FEntity_FEntryID")
     parser_sales_out.set_defaults(handler=cmd_bill_query)
+    query_parsers["sales-out"] = parser_sales_out
+
+    # Batch of query commands written to one workbook
+    parser_batch = subparsers.add_parser("batch", help="批量查询并写入同一工作簿")
+    parser_batch.add_argument(
+        "targets",
+        nargs="+",
+        help='Query commands to run, each optionally quoted with its own arguments, e.g. inventory "sales-order --limit 100"',
+    )
+    parser_batch.add_argument("--concurrency", type=int, default=0, help="Number of queries run in parallel, 0 for all at once")
+    parser_batch.set_defaults(handler=cmd_batch)
+
+    # Bulk import
+    parser_import = subparsers.add_parser("import", help="从 CSV / Excel / JSONL 批量导入单据")
+    parser_import.add_argument("source", help="Input file (.csv, .xlsx or .jsonl)")
+    parser_import.add_argument("--form-id", required=True, help="Target form, e.g. SAL_SaleOrder")
+    parser_import.add_argument(
+        "--mapping",
+        default="",
+        help='JSON file mapping source columns to model paths, e.g. {"物料编码": "FSaleOrderEntry[].FMaterialId.FNumber"}; '
+             "without it column names are used as model paths",
+    )
+    parser_import.add_argument("--group-by", default="", help="Source column whose rows form one document (e.g. the bill number column)")
+    parser_import.add_argument("--sheet", default="", help="Excel worksheet to read (default: the first one)")
+    parser_import.add_argument("--chunk-size", type=int, default=100, help="Documents per BatchSave request")
+    parser_import.add_argument("--concurrency", type=int, default=2, help="Number of chunks saved in parallel")
+    parser_import.add_argument("--submit", action="store_true", help="Submit documents after they are saved")
+    parser_import.add_argument("--audit", action="store_true", help="Submit and audit documents after they are saved")
+    parser_import.add_argument("--save-options", default="", help='Extra BatchSave parameters as JSON, e.g. {"IsVerifyBaseDataField": "true"}')
+    parser_import.add_argument("--report", default="", help="Per-record result CSV (default: data/import_<form>_<file>.csv)")
+    parser_import.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip chunks already committed to the report and check uncertain ones by bill number before resending",
+    )
+    parser_import.add_argument(
+        "--number-field",
+        default="FBillNo",
+        help="Model field holding the bill number, used to match save results and to look up uncertain documents",
+    )
+    parser_import.add_argument(
+        "--resend-uncertain",
+        action="store_true",
+        help="With --resume, also resend uncertain documents that have no bill number to check (may create duplicates)",
+    )
+    parser_import.add_argument("--dry-run", action="store_true", help="Build and print the first document without saving")
+    parser_import.set_defaults(handler=cmd_import)
+
+    # Grouped aggregation
+    parser_summarize = subparsers.add_parser("summarize", help=COMMAND_HELP_MAP["summarize"])
+    parser_summarize.add_argument(
+        "target",
+        nargs="?",
+        default="",
+        help='Query command whose rows are aggregated, optionally quoted with its own arguments, e.g. "inventory --workers 4" '
+             "(global --cache reuses pages already fetched)",
+    )
+    parser_summarize.add_argument("--group-by", default="", help="Comma separated group fields, e.g. FStockId,FMaterialId")
+    parser_summarize.add_argument(
+        "--agg",
+        required=True,
+        help=f"Comma separated field:function pairs, e.g. FBaseQty:sum,FAmount:sum ({'/'.join(summarize.AGG_FUNCS)}, default sum)",
+    )
+    parser_summarize.add_argument(
+        "--date-grain",
+        choices=sorted(summarize.DATE_GRAINS),
+        default="",
+        help="Truncate date group fields to this grain before grouping",
+    )
+    parser_summarize.add_argument(
+        "--report-form",
+        default="",
+        help="Push the grouping down to this system report (GetSysReportData), e.g. STK_StockSummaryRpt, instead of querying TARGET",
+    )
+    parser_summarize.add_argument("--report-scheme", default="", help="Filter scheme id of the report")
+    parser_summarize.add_argument("--report-model", default="", help='Report filter model as JSON, e.g. {"FStockOrgId": {"FNumber": "100"}}')
+    parser_summarize.add_argument(
+        "--output-format",
+        choices=sorted(sinks.SINK_TYPES),
+        default="excel",
+        help="Output format (excel appends to excel_file)",
+    )
+    parser_summarize.add_argument("--output", default="", help="Output file path for non-excel formats")
+    parser_summarize.set_defaults(handler=cmd_summarize)
+
+    # Order vs fulfilment reconciliation
+    parser_reconcile = subparsers.add_parser("reconcile", help=COMMAND_HELP_MAP["reconcile"])
+    parser_reconcile.add_argument(
+        "left",
+        help='Source query whose lines are fulfilled, optionally quoted with its own arguments, e.g. "sales-order --filter-string ..."',
+    )
+    parser_reconcile.add_argument("right", help='Query whose lines fulfil LEFT, e.g. sales-out (streamed, never held in memory)')
+    parser_reconcile.add_argument(
+        "--left-key",
+        default="",
+        help="Comma separated join fields of LEFT (default for sales-order/sales-out and purchase-order/purchase-in: the order entry id)",
+    )
+    parser_reconcile.add_argument("--right-key", default="", help="Comma separated join fields of RIGHT, in --left-key order")
+    parser_reconcile.add_argument("--qty", default="", help="Quantity fields as LEFT:RIGHT, e.g. FQty:FRealQty")
+    parser_reconcile.add_argument("--amount", default="", help="Amount fields as LEFT:RIGHT, e.g. FAmount:FAmount (optional)")
+    parser_reconcile.add_argument(
+        "--status",
+        default=reconcile.DEFAULT_STATUSES,
+        help=f"Comma separated statuses to output ({'/'.join(reconcile.STATUSES)} or all)",
+    )
+    parser_reconcile.add_argument("--tolerance", type=float, default=1e-6, help="Quantity difference still counted as fulfilled")
+    parser_reconcile.add_argument(
+        "--key-batch",
+        type=int,
+        default=reconcile.DEFAULT_KEY_BATCH,
+        help="LEFT keys per RIGHT query; RIGHT is fetched only for LEFT's keys unless unmatched is in --status",
+    )
+    parser_reconcile.add_argument(
+        "--output-format",
+        choices=sorted(sinks.SINK_TYPES),
+        default="excel",
+        help="Output format (excel appends to excel_file)",
+    )
+    parser_reconcile.add_argument("--output", default="", help="Output file path for non-excel formats")
+    parser_reconcile.set_defaults(handler=cmd_reconcile)
 
 
 logger = get_logger(__name__)
 
-def cmd_bill_query(client: K3CloudClient, args: argparse.Namespace) -> Any:
-    """
-    Generic bill query handler that supports pagination (when limit=0)
-    and standard single-page query.
-    """
-    
+
+def _resolve_form_id(args: argparse.Namespace) -> str:
     form_id = getattr(args, 'form_id', '')
     
     # Special case: map command names to FormId if not explicitly provided or generic
@@ -105,68 +413,336 @@ def cmd_bill_query(client: K3CloudClient, args: argparse.Namespace) -> Any:
         # For 'inventory', form_id is usually set by default in parser
         pass
 
+    return form_id
+
+
+def _apply_form_metadata(client: K3CloudClient, form_id: str, args: argparse.Namespace) -> None:
+    """
+    Check --field-keys (and the --sync / --snapshot / --split-key fields)
+    against the form metadata before any page is requested, and record the
+    column headers and kinds the export stage should use.
+    """
+    if getattr(args, 'no_metadata', False) or not getattr(args, 'field_keys', ''):
+        return
+    field_keys = sync.split_field_keys(args.field_keys)
+    checked = list(field_keys)
+    if getattr(args, 'sync', False):
+        checked += sync.split_field_keys(args.key_fields) + sync.split_field_keys(args.watermark_field)
+    if getattr(args, 'snapshot', False):
+        checked += sync.split_field_keys(args.snapshot_key)
+    if getattr(args, 'split_columns', 0) > 0:
+        checked += sync.split_field_keys(args.split_key)
+
+    form_metadata = metadata.validated_metadata(client, form_id, checked, refresh=getattr(args, 'refresh_metadata', False))
+    if form_metadata is None:
+        return
+
+    if getattr(args, 'header', 'key') == 'caption':
+        args.column_names = [form_metadata.caption(k) for k in field_keys]
+    columns = getattr(args, 'column_names', None) or field_keys
+    args.column_kinds = {}
+    for key, column in zip(field_keys, columns):
+        kind = form_metadata.kind(key)
+        if kind:
+            args.column_kinds[column] = kind
+
+
+def cmd_bill_query(client: K3CloudClient, args: argparse.Namespace) -> Any:
+    """
+    Generic bill query handler that supports pagination (when limit=0)
+    and standard single-page query.
+
+    With --stream the "fetch all" mode returns the batch generator itself,
+    so run_command can hand each page to a sink as it arrives instead of
+    holding the whole result set in memory. With --columnar the collected
+    result is a ColumnarResult of typed column arrays rather than row lists.
+    --sync always fetches all rows changed since the last run and upserts
+    them into SQLite instead; --snapshot fetches everything and returns a
+    generator of only the rows that changed since the previous snapshot.
+    """
+    form_id = _resolve_form_id(args)
+    # Fail fast on a malformed --dtype rather than after the download
+    parse_dtype_hints(getattr(args, 'dtype', ''))
+    _apply_form_metadata(client, form_id, args)
+
+    if getattr(args, 'sync', False) and getattr(args, 'snapshot', False):
+        raise RuntimeError("--sync 和 --snapshot 不能同时使用")
+    if getattr(args, 'sync', False):
+        return sync.run_sync(client, form_id, args)
+    if getattr(args, 'snapshot', False):
+        return snapshot.run_snapshot(client, form_id, args)
+
     # If limit is 0, we imply "fetch all" (using pagination)
     if args.limit <= 0:
-        all_results = []
-        start_row = args.start_row
-        batch_size = 2000 # K3Cloud standard limit
-        
-        logger.info(f"Fetching all records for {form_id} with filter: {args.filter_string}")
-        
-        while True:
-            data = {
-                "FormId": form_id,
-                "FieldKeys": args.field_keys,
-                "FilterString": args.filter_string,
-                "OrderString": getattr(args, 'order_string', ''),
-                "TopRowCount": getattr(args, 'top_row_count', 0),
-                "StartRow": start_row,
-                "Limit": batch_size
-            }
-            
-            result_str = client.bill_query(data)
-            
-            try:
-                batch_result = json.loads(result_str)
-            except json.JSONDecodeError:
-                logger.error(f"Failed to decode JSON response: {result_str}")
-                if not all_results:
-                    return result_str
-                break
-            
-            # Check for error in response structure
-            if isinstance(batch_result, dict) and not batch_result.get('Result', {}).get('ResponseStatus', {}).get('IsSuccess', True):
-                 if not all_results:
-                     return batch_result
-                 logger.error(f"Error during pagination: {batch_result}")
-                 break
-
-            if isinstance(batch_result, list):
-                if not batch_result:
-                    break
-                all_results.extend(batch_result)
-                
-                if len(batch_result) < batch_size:
-                    break
-                
-                start_row += batch_size
-                logger.info(f"Fetched {len(all_results)} records so far...")
-            else:
-                if not all_results:
-                    return result_str
-                break
-                
-        logger.info(f"Total records fetched: {len(all_results)}")
+        prepare_checkpoint(client, form_id, args)
+        batches = iter_bill_query_batches(client, form_id, args)
+        if getattr(args, 'stream', False):
+            return batches
+
+        all_results: Any = []
+        if getattr(args, 'columnar', False):
+            all_results = ColumnarResult(
+                export.field_key_columns(args), export.column_hints(args), export.dict_threshold(args)
+            )
+        try:
+            for batch in batches:
+                all_results.extend(batch)
+        except BillQueryError as e:
+            return e.response
         return all_results
 
     # Standard behavior if limit is set
-    data = {
-        "FormId": form_id,
-        "FieldKeys": args.field_keys,
-        "FilterString": args.filter_string,
-        "OrderString": getattr(args, 'order_string', ''),
-        "TopRowCount": getattr(args, 'top_row_count', 0),
-        "StartRow": args.start_row,
-        "Limit": args.limit,
-    }
+    data = build_query_data(form_id, args, args.start_row, args.limit)
     return client.bill_query(data)
+
+
+def parse_query_args(spec: str) -> argparse.Namespace:
+    """
+    Parse a query command line such as 'inventory --limit 10' with that
+    command's parser. Bad arguments raise RuntimeError rather than exiting,
+    since specs are also parsed inside serve and schedule; each call builds
+    its own parsers because argparse parsers are not thread safe.
+    """
+    try:
+        tokens = shlex.split(spec)
+    except ValueError as e:
+        raise RuntimeError(f"查询参数错误: {spec} ({e})") from e
+    parsers: Dict[str, argparse.ArgumentParser] = {}
+    register_commands(StrictArgumentParser().add_subparsers(), parsers)
+    if not tokens or tokens[0] not in parsers:
+        raise RuntimeError(f"未知的查询命令: {spec} (可选: {', '.join(parsers)})")
+
+    try:
+        args = parsers[tokens[0]].parse_args(tokens[1:])
+    except CommandLineExit as e:
+        if e.status == 0:
+            raise RuntimeError(f"查询参数不支持 --help: {spec}") from e
+        raise RuntimeError(f"查询参数错误: {spec} ({e.message})") from e
+    args.command = tokens[0]
+    return args
+
+
+def cmd_import(client: K3CloudClient, args: argparse.Namespace) -> Dict[str, int]:
+    """Bulk import documents through BatchSave; see importer.run_import."""
+    return importer.run_import(client, args)
+
+
+def _summary_frame(client: K3CloudClient, args: argparse.Namespace, fields: List[str], aggregations: List[Tuple[str, str]]):
+    """Fetch only the group and aggregated fields, typed, as a DataFrame."""
+    if args.report_form:
+        unsupported = sorted({func for _, func in aggregations if func not in summarize.PUSHDOWN_FUNCS})
+        if unsupported:
+            raise RuntimeError(
+                f"--report-form 只支持 {'/'.join(summarize.PUSHDOWN_FUNCS)} 汇总 (报表行已预先汇总): {', '.join(unsupported)}"
+            )
+        try:
+            model = json.loads(args.report_model) if args.report_model else {}
+        except json.JSONDecodeError as e:
+            raise RuntimeError(f"--report-model 不是合法的 JSON: {e}") from e
+        logger.info(f"Pushing grouping down to report {args.report_form}")
+        return summarize.fetch_report_frame(client, args.report_form, fields, args.report_scheme, model)
+
+    if not args.target:
+        raise RuntimeError("summarize 需要查询命令 (例如 inventory) 或 --report-form")
+    qa = parse_query_args(args.target)
+    qa.stream = False
+    qa.sync = False
+    qa.snapshot = False
+    qa.no_checkpoint = True
+    qa.resume = False
+    qa.columnar = True
+    qa.header = 'key'
+    qa.field_keys = ",".join(fields)
+    # Aggregated quantities and amounts are decoded as numbers unless --dtype says otherwise
+    hints = parse_dtype_hints(qa.dtype)
+    numeric = [f"{f}:float" for f, func in aggregations if func in summarize.NUMERIC_FUNCS and f.lower() not in hints]
+    qa.dtype = ",".join([qa.dtype] + numeric if qa.dtype else numeric)
+
+    result = cmd_bill_query(client, qa)
+    if getattr(qa, 'incomplete', ''):
+        # Aggregates of a partial result: exported, but flagged like the query itself would be
+        logger.warning(f"Summarizing a partial result: {qa.incomplete}")
+        args.incomplete = qa.incomplete
+    rows = export.result_rows(result)
+    if rows is None:
+        if isinstance(result, (list, ColumnarResult)):
+            return None
+        raise RuntimeError(f"查询失败: {str(result)[:500]}")
+    if isinstance(rows, ColumnarResult):
+        return rows.to_dataframe()
+    return export.build_dataframe(rows, qa)
+
+
+def cmd_summarize(client: K3CloudClient, args: argparse.Namespace) -> List[List[Any]]:
+    """
+    Aggregate a query (or a system report) by the --group-by fields and
+    return only the aggregate rows; run_command exports them like any
+    query result, with args.column_names as the headers.
+    """
+    group_by = sync.split_field_keys(args.group_by)
+    aggregations = summarize.parse_aggregations(args.agg)
+    fields = summarize.summary_fields(group_by, aggregations)
+
+    df = _summary_frame(client, args, fields, aggregations)
+    if df is None or len(df) == 0:
+        logger.warning("No rows to summarize")
+        return []
+
+    summary = summarize.aggregate(df, group_by, aggregations, args.date_grain)
+    logger.info(f"Summarized {len(df)} rows into {len(summary)} groups")
+    args.column_names = [str(c) for c in summary.columns]
+    return summary.to_dict("split")["data"]
+
+
+def _reconcile_batches(client: K3CloudClient, qa: argparse.Namespace):
+    form_id = _resolve_form_id(qa)
+    _apply_form_metadata(client, form_id, qa)
+    # strict: a lost page would otherwise show up as open or unmatched lines
+    return iter_bill_query_batches(client, form_id, qa, strict=True)
+
+
+def _reconcile_key_batches(client: K3CloudClient, qa: argparse.Namespace, filters: List[str]):
+    """RIGHT restricted to LEFT's keys: one query per key filter, each ANDed with its own --filter-string."""
+    form_id = _resolve_form_id(qa)
+    _apply_form_metadata(client, form_id, qa)
+    for key_filter in filters:
+        chunk = argparse.Namespace(**vars(qa))
+        chunk.filter_string = f"({qa.filter_string}) AND {key_filter}" if qa.filter_string.strip() else key_filter
+        yield from iter_bill_query_batches(client, form_id, chunk, strict=True)
+
+
+def cmd_reconcile(client: K3CloudClient, args: argparse.Namespace) -> List[List[Any]]:
+    """
+    Match the lines of LEFT (e.g. sales-order) with the lines of RIGHT
+    (e.g. sales-out) on the key fields and report each LEFT line as open,
+    partial, fulfilled or over, plus RIGHT keys with no LEFT line, with the
+    quantity and amount differences. LEFT is hashed by key; RIGHT only
+    fetches its key, quantity and amount fields and is streamed past it.
+
+    Unless unmatched lines are asked for, RIGHT is only fetched for the keys
+    LEFT has (IN filters of --key-batch keys), so fulfilments outside LEFT's
+    window are never read; unmatched needs RIGHT on a filter of its own.
+    """
+    left = parse_query_args(args.left)
+    right = parse_query_args(args.right)
+    preset = reconcile.PRESETS.get((left.command, right.command), {})
+    left_key = sync.split_field_keys(args.left_key or preset.get("left_key", ""))
+    right_key = sync.split_field_keys(args.right_key or preset.get("right_key", "")) or left_key
+    qty = reconcile.parse_field_pair(args.qty or preset.get("qty", ""), "--qty")
+    amount = reconcile.parse_field_pair(args.amount or preset.get("amount", ""), "--amount")
+    if not left_key or qty is None:
+        raise RuntimeError(f"{left.command} 与 {right.command} 没有默认对账字段，请指定 --left-key 和 --qty")
+    statuses = reconcile.parse_statuses(args.status)
+    if "unmatched" in statuses and not right.filter_string.strip():
+        raise RuntimeError(
+            f"输出 unmatched 需要为 {right.command} 指定 --filter-string（如与源单相同的日期范围），"
+            "否则范围外的执行单行都会被报告为 unmatched"
+        )
+
+    for qa in (left, right):
+        qa.stream = True
+        qa.sync = False
+        qa.snapshot = False
+        qa.header = 'key'
+        if qa.limit > 0:
+            logger.warning(f"--limit is ignored by reconcile; all matching {qa.command} rows are compared")
+    left.field_keys = ",".join(sync._with_fields(
+        sync.split_field_keys(left.field_keys), left_key + [qty[0]] + ([amount[0]] if amount else [])
+    ))
+    columns = sync.split_field_keys(left.field_keys)
+    matcher = reconcile.Reconciliation(columns, left_key, right_key, qty, amount)
+    right.field_keys = ",".join(matcher.right_fields)
+
+    try:
+        matcher.build(_reconcile_batches(client, left))
+        if "unmatched" in statuses:
+            logger.info(f"Hashed {matcher.left_rows} {left.command} rows; streaming {right.command}")
+            matcher.probe(_reconcile_batches(client, right), matcher.right_fields)
+        else:
+            filters = list(reconcile.key_filters(right_key[0], matcher.left_key_values(), args.key_batch))
+            logger.info(
+                f"Hashed {matcher.left_rows} {left.command} rows; streaming {right.command} "
+                f"for their keys in {len(filters)} queries"
+            )
+            matcher.probe(_reconcile_key_batches(client, right, filters), matcher.right_fields)
+    except BillQueryError as e:
+        raise RuntimeError(f"对账查询失败: {str(e.response)[:500]}") from e
+
+    headers, rows, counts = matcher.report(statuses, args.tolerance)
+    logger.info(
+        f"Reconciled {matcher.left_rows} {left.command} rows with {matcher.right_rows} {right.command} rows: "
+        + ", ".join(f"{count} {status}" for status, count in counts.items())
+    )
+    args.column_names = headers
+    return rows
+
+
+def _sheet_name(args: argparse.Namespace, used: Dict[str, int]) -> str:
+    name = COMMAND_HELP_MAP.get(args.command, args.command)
+    used[name] = used.get(name, 0) + 1
+    return name if used[name] == 1 else f"{name}_{used[name]}"
+
+
+def cmd_batch(client: K3CloudClient, args: argparse.Namespace) -> Dict[str, int]:
+    """
+    Run several query commands concurrently on one client and write every
+    result as a sheet of the same workbook in a single open/save cycle.
+
+    A query missing pages is still written, its sheet is listed in the
+    workbook's incomplete marker (see export.finish_export) and the batch
+    fails, as a failed query does.
+    """
+    query_args = [parse_query_args(spec) for spec in args.targets]
+    for qa in query_args:
+        # Results are collected and written together below
+        qa.stream = False
+        qa.sync = False
+        qa.snapshot = False
+        qa.no_checkpoint = True
+        qa.resume = False
+
+    concurrency = args.concurrency if args.concurrency > 0 else len(query_args)
+    logger.info(f"Running {len(query_args)} queries (concurrency: {concurrency})")
+
+    results: List[Any] = []
+    failures: List[str] = []
+    with ContextThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(cmd_bill_query, client, qa) for qa in query_args]
+        for qa, future in zip(query_args, futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"Query '{qa.command}' failed: {e}")
+                failures.append(qa.command)
+                results.append(None)
+
+    frames: List[Tuple[str, Any]] = []
+    written: List[Tuple[str, argparse.Namespace]] = []
+    summary: Dict[str, int] = {}
+    used: Dict[str, int] = {}
+    for qa, result in zip(query_args, results):
+        if result is None:
+            continue
+        sheet_name = _sheet_name(qa, used)
+        rows = export.result_rows(result)
+        if rows is None:
+            logger.warning(f"Query '{qa.command}' returned no rows: {str(result)[:200]}")
+            continue
+        frames.append((sheet_name, export.build_dataframe(rows, qa)))
+        written.append((sheet_name, qa))
+        summary[sheet_name] = len(rows)
+
+    incomplete: List[str] = []
+    if frames:
+        filename, append = export.resolve_excel_file(client.config, "batch")
+        export.write_excel_sheets(filename, frames, append)
+        for i, (sheet_name, qa) in enumerate(written):
+            # Later sheets add to the marker the first one (re)started
+            if export.finish_export(qa, filename, sheet_name, append or i > 0):
+                incomplete.append(sheet_name)
+
+    if failures:
+        raise RuntimeError(f"批量查询失败: {', '.join(failures)}")
+    if incomplete:
+        raise RuntimeError(f"批量查询结果不完整 (已写入并标记): {', '.join(incomplete)}")
+    return summary
@@ -1,6 +1,6 @@
 import configparser
 import os
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from typing import Dict, Optional
 
 
@@ -14,6 +14,18 @@ class K3CloudConfig:
     lcid: int = 2052
     org_num: int = 0
     excel_file: Optional[str] = None
+    sqlite_file: Optional[str] = None
+    cache_file: Optional[str] = None
+    cache_ttl: int = 300
+    cache_max_mb: int = 256
+    cache_form_ttl: Dict[str, int] = field(default_factory=dict)
+    metadata_file: Optional[str] = None
+    metadata_ttl: int = 86400
+    connect_timeout: float = 10
+    request_timeout: float = 120
+    pool_size: int = 10
+    rate_limit: float = 0
+    max_inflight: int = 0
 
 
 def default_config_path() -> str:
@@ -29,6 +41,22 @@ def _get_case_insensitive(mapping: Dict[str, str], key: str) -> Optional[str]:
     return None
 
 
+def _parse_form_ttl(value: Optional[str]) -> Dict[str, int]:
+    """Parse "STK_Inventory:600,SAL_OUTSTOCK:60" into {form_id: seconds}."""
+    result: Dict[str, int] = {}
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        form_id, sep, ttl = item.partition(":")
+        if not sep:
+            raise RuntimeError(f"cache_form_ttl 格式错误: {item.strip()}")
+        try:
+            result[form_id.strip()] = int(ttl)
+        except Exception as e:
+            raise RuntimeError(f"cache_form_ttl 必须是整数: {item.strip()}") from e
+    return result
+
+
 def load_config(config_path: str, section: str = "k3cloud") -> K3CloudConfig:
     if not os.path.exists(config_path):
         raise FileNotFoundError(f"配置文件未找到: {config_path}")
@@ -58,6 +86,18 @@ def load_config(config_path: str, section: str = "k3cloud") -> K3CloudConfig:
     lcid_raw = _get_case_insensitive(raw, "lcid") or _get_case_insensitive(raw, "X-KDApi-LCID") or "2052"
     org_num_raw = _get_case_insensitive(raw, "org_num") or _get_case_insensitive(raw, "X-KDApi-OrgNum") or "0"
     excel_file = _get_case_insensitive(raw, "excel_file")
+    sqlite_file = _get_case_insensitive(raw, "sqlite_file")
+    cache_file = _get_case_insensitive(raw, "cache_file")
+    cache_ttl_raw = _get_case_insensitive(raw, "cache_ttl") or "300"
+    cache_max_mb_raw = _get_case_insensitive(raw, "cache_max_mb") or "256"
+    cache_form_ttl = _parse_form_ttl(_get_case_insensitive(raw, "cache_form_ttl"))
+    metadata_file = _get_case_insensitive(raw, "metadata_file")
+    metadata_ttl_raw = _get_case_insensitive(raw, "metadata_ttl") or "86400"
+    connect_timeout_raw = _get_case_insensitive(raw, "connect_timeout") or "10"
+    request_timeout_raw = _get_case_insensitive(raw, "request_timeout") or "120"
+    pool_size_raw = _get_case_insensitive(raw, "pool_size") or "10"
+    rate_limit_raw = _get_case_insensitive(raw, "rate_limit") or "0"
+    max_inflight_raw = _get_case_insensitive(raw, "max_inflight") or "0"
 
     missing = []
     if not server_url: missing.append("server_url")
@@ -79,6 +119,38 @@ def load_config(config_path: str, section: str = "k3cloud") -> K3CloudConfig:
     except Exception as e:
         raise RuntimeError("org_num 必须是整数") from e
 
+    try:
+        cache_ttl = int(cache_ttl_raw)
+        cache_max_mb = int(cache_max_mb_raw)
+    except Exception as e:
+        raise RuntimeError("cache_ttl / cache_max_mb 必须是整数") from e
+
+    try:
+        metadata_ttl = int(metadata_ttl_raw)
+    except Exception as e:
+        raise RuntimeError("metadata_ttl 必须是整数") from e
+
+    try:
+        connect_timeout = float(connect_timeout_raw)
+        request_timeout = float(request_timeout_raw)
+    except Exception as e:
+        raise RuntimeError("connect_timeout / request_timeout 必须是数字") from e
+    if connect_timeout <= 0 or request_timeout <= 0:
+        raise RuntimeError("connect_timeout / request_timeout 必须大于 0")
+
+    try:
+        pool_size = int(pool_size_raw)
+    except Exception as e:
+        raise RuntimeError("pool_size 必须是整数") from e
+
+    try:
+        rate_limit = float(rate_limit_raw)
+        max_inflight = int(max_inflight_raw)
+    except Exception as e:
+        raise RuntimeError("rate_limit 必须是数字，max_inflight 必须是整数") from e
+    if rate_limit < 0 or max_inflight < 0:
+        raise RuntimeError("rate_limit / max_inflight 不能为负数")
+
     return K3CloudConfig(
         server_url=server_url, # type: ignore
         acct_id=acct_id, # type: ignore
@@ -88,4 +160,16 @@ def load_config(config_path: str, section: str = "k3cloud") -> K3CloudConfig:
         lcid=lcid,
         org_num=org_num,
         excel_file=excel_file,
+        sqlite_file=sqlite_file,
+        cache_file=cache_file,
+        cache_ttl=cache_ttl,
+        cache_max_mb=cache_max_mb,
+        cache_form_ttl=cache_form_ttl,
+        metadata_file=metadata_file,
+        metadata_ttl=metadata_ttl,
+        connect_timeout=connect_timeout,
+        request_timeout=request_timeout,
+        pool_size=pool_size,
+        rate_limit=rate_limit,
+        max_inflight=max_inflight,
     )
@@ -0,0 +1,376 @@
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+import sinks
+from columnar import DEFAULT_DICT_THRESHOLD, ColumnarResult, parse_dtype_hints, worth_encoding
+from config import K3CloudConfig
+from logger import get_logger
+from metrics import METRICS
+
+logger = get_logger(__name__)
+
+INCOMPLETE_SUFFIX = ".incomplete"
+
+# Serializes workbook writes, e.g. concurrent requests in serve mode appending to one excel_file
+_EXCEL_WRITE_LOCK = threading.Lock()
+
+
+def field_key_columns(args: argparse.Namespace) -> Optional[List[str]]:
+    # Captions chosen from the form metadata with --header caption
+    if getattr(args, 'column_names', None):
+        return list(args.column_names)
+    if hasattr(args, 'field_keys') and args.field_keys:
+        return [k.strip() for k in args.field_keys.split(',') if k.strip()]
+    return None
+
+
+def column_hints(args: argparse.Namespace) -> Dict[str, str]:
+    """
+    Kinds of the output columns, keyed by lower-cased column name: --dtype
+    (given per field key) first, then the kinds from the form metadata.
+    """
+    hints = parse_dtype_hints(getattr(args, 'dtype', ''))
+    kinds = getattr(args, 'column_kinds', None) or {}
+    field_keys = [k.strip() for k in (getattr(args, 'field_keys', '') or '').split(',') if k.strip()]
+    for key, column in zip(field_keys, field_key_columns(args) or field_keys):
+        kind = hints.get(key.lower()) or kinds.get(column)
+        if kind:
+            hints[column.lower()] = kind
+    return hints
+
+
+def _apply_column_kinds(df, hints: Dict[str, str]):
+    import pandas as pd
+
+    for column in df.columns:
+        kind = hints.get(str(column).lower())
+        try:
+            if kind in ("float", "int"):
+                df[column] = pd.to_numeric(df[column])
+            elif kind == "datetime":
+                df[column] = pd.to_datetime(df[column])
+        except (ValueError, TypeError) as e:
+            logger.warning(f"Column {column} does not fit {kind} ({e}); keeping it as is")
+    return df
+
+
+def dict_threshold(args: argparse.Namespace) -> int:
+    return getattr(args, 'dict_threshold', DEFAULT_DICT_THRESHOLD)
+
+
+def _encode_categoricals(df, threshold: int):
+    """Turn text columns into pandas categoricals by the rule --columnar uses (columnar.worth_encoding)."""
+    import pandas as pd
+
+    if threshold <= 0 or len(df) == 0:
+        return df
+    for column in df.columns:
+        series = df[column]
+        if not (pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series)):
+            continue
+        try:
+            distinct = series.nunique(dropna=True)
+        except TypeError:
+            # Unhashable cells (nested JSON)
+            continue
+        if not worth_encoding(distinct, len(series), threshold):
+            continue
+        present = series.dropna()
+        if len(set(zip(map(type, present), present))) != distinct:
+            # 1 and True (0 and False) would be merged into one category
+            continue
+        df[column] = series.astype("category")
+    return df
+
+
+def default_output_path(command_name: str, extension: str) -> str:
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    return os.path.join("excel", f"{command_name}_{timestamp}.{extension}")
+
+
+def result_rows(result: Any) -> Optional[Union[List[Any], ColumnarResult]]:
+    """
+    Return the rows of a query result if it is a non-empty list of lists or
+    list of dicts (raw JSON strings are decoded first), otherwise None.
+    A non-empty ColumnarResult is returned as is.
+    """
+    if isinstance(result, ColumnarResult):
+        return result if len(result) > 0 else None
+
+    output_data = result
+    if isinstance(result, str):
+        try:
+            output_data = json.loads(result)
+        except json.JSONDecodeError:
+            return None
+
+    if isinstance(output_data, list) and len(output_data) > 0:
+        if isinstance(output_data[0], (dict, list)):
+            return output_data
+    return None
+
+
+def build_dataframe(rows: Union[List[Any], ColumnarResult], args: argparse.Namespace):
+    import pandas as pd
+
+    with METRICS.timer("dataframe", rows=len(rows)):
+        if isinstance(rows, ColumnarResult):
+            return rows.to_dataframe()
+
+        if isinstance(rows[0], dict):
+            return pd.DataFrame(rows)
+
+        # It is list of lists, try to find headers from args
+        columns = field_key_columns(args)
+
+        # Fix: if columns count mismatch, just use default (0, 1, 2...)
+        if columns and len(rows[0]) != len(columns):
+             logger.warning(f"Column count mismatch: Data has {len(rows[0])} columns, but field_keys has {len(columns)}. Using default column names.")
+             columns = None
+
+        df = _apply_column_kinds(pd.DataFrame(rows, columns=columns), column_hints(args))
+        return _encode_categoricals(df, dict_threshold(args))
+
+
+def resolve_excel_file(config: K3CloudConfig, command_name: str) -> Tuple[str, bool]:
+    """Return (filename, append). Appends only to an existing configured excel_file."""
+    if config.excel_file:
+        filename = config.excel_file
+        # Ensure directory exists if path contains directory
+        output_dir = os.path.dirname(filename)
+        if output_dir and not os.path.exists(output_dir):
+            try:
+                os.makedirs(output_dir)
+            except Exception:
+                pass
+        return filename, os.path.exists(filename)
+
+    filename = default_output_path(command_name, "xlsx")
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    return filename, False
+
+
+def write_excel_sheets(filename: str, frames: Sequence[Tuple[str, Any]], append: bool) -> None:
+    """
+    Write every (sheet_name, DataFrame) pair in a single open/save of the
+    workbook. A workbook that cannot be appended to raises; it is never
+    replaced, since its other sheets would be lost.
+    """
+    import pandas as pd
+
+    sheet_names = ', '.join(name for name, _ in frames)
+    with _EXCEL_WRITE_LOCK, METRICS.timer("excel_write", rows=sum(len(df) for _, df in frames), sheets=len(frames)):
+        if append:
+            # Append mode
+            try:
+                with pd.ExcelWriter(filename, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
+                    for sheet_name, df in frames:
+                        df.to_excel(writer, sheet_name=sheet_name, index=False)
+            except Exception as e:
+                raise RuntimeError(f"无法追加到 Excel 文件 {filename} (文件损坏或被占用？): {e}") from e
+            logger.info(f"Result appended to Excel: {filename} (Sheets: {sheet_names})")
+            return
+
+        # Create new file
+        with pd.ExcelWriter(filename, engine='openpyxl') as writer:
+            for sheet_name, df in frames:
+                df.to_excel(writer, sheet_name=sheet_name, index=False)
+        logger.info(f"Result saved to Excel: {filename} (Sheets: {sheet_names})")
+
+
+def resume_excel_sheet(args: argparse.Namespace, df):
+    """
+    With --resume, the (filename, DataFrame) to write: the checkpointed
+    workbook, and its sheet's rows followed by the newly fetched ones.
+    Without, (None, df).
+    """
+    resume_from = getattr(args, 'resume_from', None)
+    if not resume_from:
+        return None, df
+    import pandas as pd
+
+    filename, sheet = resume_from["output"], resume_from["sheet"]
+    try:
+        existing = pd.read_excel(filename, sheet_name=sheet)
+    except Exception as e:
+        raise RuntimeError(f"无法读取要续传的工作表 {filename} ({sheet}): {e}") from e
+    if len(existing) != resume_from["rows"]:
+        raise RuntimeError(
+            f"工作表 {filename} ({sheet}) 有 {len(existing)} 行，与检查点的 {resume_from['rows']} 行不符，无法续传"
+        )
+    if len(df.columns) == len(existing.columns):
+        df.columns = existing.columns
+    return filename, pd.concat([existing, df], ignore_index=True)
+
+
+def _create_sink(args: argparse.Namespace, sheet_name: str, excel_file: Optional[str] = None) -> sinks.BatchSink:
+    command_name = args.command if hasattr(args, 'command') else 'query'
+    output_format = getattr(args, 'output_format', 'excel')
+    sink_cls = sinks.SINK_TYPES[output_format]
+    filename = getattr(args, 'output', '')
+    resume_from = getattr(args, 'resume_from', None)
+    if resume_from:
+        # --resume: continue the earlier export's file (checked in pagination.prepare_checkpoint)
+        filename = resume_from["output"]
+    elif not filename and output_format == 'excel' and excel_file:
+        # The write-only workbook cannot add a sheet to an existing file
+        if os.path.exists(excel_file):
+            raise RuntimeError(
+                f"流式 Excel 输出不能追加到已存在的 excel_file: {excel_file}；"
+                "请去掉 --stream 以追加工作表，或用 --output 指定新文件"
+            )
+        filename = excel_file
+    filename = filename or default_output_path(command_name, sink_cls.extension)
+    return sinks.create_sink(
+        output_format,
+        filename,
+        columns=field_key_columns(args),
+        sheet_name=sheet_name,
+        compression=getattr(args, 'compression', '') or None,
+        kinds=column_hints(args),
+        append_at=resume_from["output_bytes"] if resume_from else None,
+    )
+
+
+def export_batches(
+    args: argparse.Namespace, batches: Iterable[List], sheet_name: str, excel_file: Optional[str] = None
+) -> int:
+    """
+    Write query batches to the sink selected by --output-format, one batch
+    at a time. args.after_export, if a handler set one (e.g. --snapshot
+    saving its index), runs once the sink has been closed successfully.
+
+    Excel output without --output goes to the configured excel_file when
+    there is one; it must not exist yet, as a streamed workbook is always
+    new. This is checked before the first batch is fetched.
+
+    A streamed export with a checkpoint saves its resume point after every
+    batch, so a run that is killed can still be resumed.
+    """
+    output_format = getattr(args, 'output_format', 'excel')
+    live_checkpoint = getattr(args, 'stream', False) and getattr(args, 'checkpoint_store', None) is not None
+    with _create_sink(args, sheet_name, excel_file) as sink:
+        for batch in batches:
+            with METRICS.timer("sink_write", rows=len(batch), format=output_format):
+                sink.write_batch(batch)
+            if live_checkpoint and sink.appendable:
+                sink.flush()
+                live_checkpoint = _save_checkpoint(args, sink.path)
+
+    logger.info(f"Wrote {sink.rows_written} records to {sink.path} ({output_format})")
+    after_export = getattr(args, 'after_export', None)
+    if after_export is not None and not getattr(args, 'incomplete', ''):
+        after_export()
+    return finish_export(args, sink.path)
+
+
+def export_columnar(args: argparse.Namespace, result: ColumnarResult, sheet_name: str) -> int:
+    """
+    Write a ColumnarResult. Parquet / Feather get its column arrays as one
+    Arrow table (dictionary encoded columns stay dictionary arrays); other
+    formats get decoded row batches.
+    """
+    output_format = getattr(args, 'output_format', 'excel')
+    if not issubclass(sinks.SINK_TYPES[output_format], sinks.ArrowSink):
+        return export_batches(args, result.iter_batches(), sheet_name)
+
+    with _create_sink(args, sheet_name) as sink:
+        with METRICS.timer("sink_write", rows=len(result), format=output_format):
+            sink.write_table(result.to_arrow())
+
+    logger.info(f"Wrote {sink.rows_written} records to {sink.path} ({output_format})")
+    return finish_export(args, sink.path)
+
+
+def _incomplete_sheets(marker: str) -> Dict[str, Dict[str, str]]:
+    try:
+        with open(marker, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if "sheets" in data:
+        return dict(data["sheets"])
+    # A marker from a whole-file export: keep it, it is not ours to clear
+    return {"": {"reason": data.get("reason", ""), "written_at": data.get("written_at", "")}}
+
+
+def finish_export(args: argparse.Namespace, path: str, sheet: str = "", append: bool = False) -> int:
+    """
+    Flag an export whose query is missing pages (args.incomplete) with a
+    "<path>.incomplete" marker file next to it and a non-zero exit code;
+    a complete export removes a marker left by an earlier run.
+
+    For a sheet of a shared workbook (the configured excel_file) the marker
+    lists the incomplete sheets, and a complete run only clears its own
+    sheet; the marker stays while any other sheet is still incomplete.
+    """
+    marker = path + INCOMPLETE_SUFFIX
+    reason = getattr(args, 'incomplete', '')
+    written_at = time.strftime("%Y-%m-%d %H:%M:%S")
+
+    if sheet:
+        sheets = _incomplete_sheets(marker) if append else {}
+        sheets.pop(sheet, None)
+        if reason:
+            sheets[sheet] = {"reason": reason, "written_at": written_at}
+        content = {"path": path, "sheets": sheets}
+    else:
+        sheets = {}
+        content = {"path": path, "reason": reason, "written_at": written_at}
+
+    checkpointed = _update_checkpoint(args, path, sheet, reason)
+    if not reason and not sheets:
+        if os.path.exists(marker):
+            os.remove(marker)
+        return 0
+
+    with open(marker, "w", encoding="utf-8") as f:
+        json.dump(content, f, ensure_ascii=False, indent=2)
+    if not reason:
+        logger.warning(f"{marker} kept: sheets {', '.join(s or '?' for s in sheets)} of {path} are still incomplete")
+        return 0
+    where = f"{path} (sheet {sheet})" if sheet else path
+    hint = "rerun with --resume to append the missing rows" if checkpointed else "rerun to fetch the rest"
+    logger.error(f"Export {where} is INCOMPLETE: {reason}. Marked with {marker}; {hint}")
+    return 1
+
+
+def _save_checkpoint(args: argparse.Namespace, path: str, sheet: str = "") -> bool:
+    """Save args.resume_point for the export written to path; False (with a warning) if that failed."""
+    point = getattr(args, 'resume_point', None)
+    if point is None:
+        return False
+    checkpoint = args.checkpoint_store
+    output_format = getattr(args, 'output_format', 'excel')
+    state = dict(
+        point,
+        output=path,
+        output_format=output_format,
+        sheet=sheet,
+        output_bytes=os.path.getsize(path) if output_format != 'excel' else 0,
+    )
+    try:
+        checkpoint.save(state)
+    except sqlite3.Error as e:
+        logger.warning(f"Could not save the checkpoint of {path} to {checkpoint.path}; --resume will not be possible: {e}")
+        return False
+    return True
+
+
+def _update_checkpoint(args: argparse.Namespace, path: str, sheet: str, reason: str) -> bool:
+    """Keep the resume point of an incomplete checkpointed export, drop that of a complete one."""
+    checkpoint = getattr(args, 'checkpoint_store', None)
+    if checkpoint is None:
+        return False
+    if reason:
+        return _save_checkpoint(args, path, sheet)
+    try:
+        checkpoint.clear()
+    except sqlite3.Error as e:
+        logger.warning(f"Could not delete the checkpoint of {path} from {checkpoint.path}: {e}")
+    return False
@@ -0,0 +1,142 @@
+import argparse
+import time
+from typing import Any, Callable, List, Optional, Tuple
+
+from client import K3CloudClient
+from columnar import ColumnarResult
+import commands
+import export
+from logger import ContextThreadPoolExecutor, get_logger
+import sinks
+import sync
+
+logger = get_logger(__name__)
+
+DEFAULT_SOURCE_COLUMN = "Section"
+
+
+def add_fanout_parser(subparsers) -> argparse.ArgumentParser:
+    parser_fanout = subparsers.add_parser("fan-out", help=commands.COMMAND_HELP_MAP["fan-out"])
+    parser_fanout.add_argument(
+        "target",
+        help='Query command run against every section, optionally quoted with its own arguments, e.g. "inventory --workers 2"',
+    )
+    parser_fanout.add_argument(
+        "--sections",
+        required=True,
+        help="Comma separated config sections (one per data center), e.g. k3cloud_sh,k3cloud_bj",
+    )
+    parser_fanout.add_argument("--concurrency", type=int, default=0, help="Number of sections queried in parallel, 0 for all at once")
+    parser_fanout.add_argument(
+        "--workers-per-target",
+        type=int,
+        default=0,
+        help="Pages fetched concurrently from each section (overrides the query's --workers), 0 to keep it",
+    )
+    parser_fanout.add_argument(
+        "--source-column",
+        default=DEFAULT_SOURCE_COLUMN,
+        help="Name of the column holding each row's config section",
+    )
+    parser_fanout.add_argument(
+        "--allow-partial",
+        action="store_true",
+        help="Write the rows of the sections that succeeded even if others failed",
+    )
+    parser_fanout.add_argument(
+        "--output-format",
+        choices=sorted(sinks.SINK_TYPES),
+        default="excel",
+        help="Output format (excel appends to excel_file)",
+    )
+    parser_fanout.add_argument("--output", default="", help="Output file path for non-excel formats")
+    return parser_fanout
+
+
+def split_sections(value: str) -> List[str]:
+    sections = sync.split_field_keys(value)
+    if not sections:
+        raise RuntimeError("--sections 不能为空")
+    duplicates = sorted({s for s in sections if sections.count(s) > 1})
+    if duplicates:
+        raise RuntimeError(f"--sections 中有重复的节点: {', '.join(duplicates)}")
+    return sections
+
+
+def _query_section(
+    section: str,
+    args: argparse.Namespace,
+    make_client: Callable[[str], K3CloudClient],
+) -> Tuple[argparse.Namespace, Any]:
+    # Every section gets its own parsed arguments: metadata lookups write
+    # column names and kinds back onto them
+    qa = commands.parse_query_args(args.target)
+    qa.stream = False
+    qa.sync = False
+    qa.snapshot = False
+    qa.no_checkpoint = True
+    qa.resume = False
+    qa.columnar = False
+    if args.workers_per_target > 0:
+        qa.workers = args.workers_per_target
+
+    started = time.perf_counter()
+    client = make_client(section)
+    try:
+        result = commands.cmd_bill_query(client, qa)
+    finally:
+        client.close()
+        if client.cache is not None:
+            client.cache.close()
+    rows = export.result_rows(result)
+    if rows is None and not isinstance(result, list):
+        raise RuntimeError(f"查询失败: {str(result)[:500]}")
+    if getattr(qa, 'incomplete', ''):
+        raise RuntimeError(f"查询结果不完整: {qa.incomplete}")
+    logger.info(f"[{section}] {len(rows or [])} rows in {time.perf_counter() - started:.2f}s")
+    return qa, rows or []
+
+
+def run_fanout(args: argparse.Namespace, make_client: Callable[[str], K3CloudClient]) -> Optional[ColumnarResult]:
+    """
+    Run args.target against every config section in parallel, one client
+    per section, and merge the rows into one ColumnarResult whose first
+    column names the section each row came from.
+    """
+    sections = split_sections(args.sections)
+    concurrency = args.concurrency if args.concurrency > 0 else len(sections)
+    logger.info(f"Fanning out '{args.target}' to {len(sections)} sections (concurrency: {concurrency})")
+
+    started = time.perf_counter()
+    results: List[Tuple[str, argparse.Namespace, List[Any]]] = []
+    failures: List[str] = []
+    with ContextThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [executor.submit(_query_section, section, args, make_client) for section in sections]
+        for section, future in zip(sections, futures):
+            try:
+                qa, rows = future.result()
+                results.append((section, qa, rows))
+            except Exception as e:
+                logger.error(f"[{section}] Query failed: {e}")
+                failures.append(section)
+    logger.info(f"All sections finished in {time.perf_counter() - started:.2f}s")
+
+    if failures and not args.allow_partial:
+        raise RuntimeError(f"以下数据中心查询失败: {', '.join(failures)} (可使用 --allow-partial 输出其余结果)")
+    if not results:
+        return None
+
+    # Headers and column kinds of the first section; all ran the same query
+    _, first_qa, _ = results[0]
+    columns = export.field_key_columns(first_qa) or []
+    hints = export.column_hints(first_qa)
+    hints[args.source_column.lower()] = "string"
+    merged = ColumnarResult([args.source_column] + columns if columns else None, hints, export.dict_threshold(first_qa))
+    for section, _, rows in results:
+        if rows and isinstance(rows[0], dict):
+            rows = [list(row.values()) for row in rows]
+        merged.extend([[section] + list(row) for row in rows])
+
+    args.column_names = merged.columns or None
+    logger.info(f"Merged {len(merged)} rows from {len(results)} sections")
+    return merged
@@ -0,0 +1,493 @@
+import argparse
+import csv
+import datetime
+import json
+import math
+import os
+import threading
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from client import K3CloudClient
+from logger import ContextThreadPoolExecutor, get_logger
+
+logger = get_logger(__name__)
+
+REPORT_COLUMNS = ["chunk", "document", "lines", "key", "status", "id", "number", "message"]
+UNCERTAIN = "uncertain"
+
+# BatchSave options sent unless overridden by --save-options
+DEFAULT_SAVE_OPTIONS = {"IsDeleteEntry": "true", "ValidateFlag": "true", "NumberSearch": "true"}
+
+
+@dataclass
+class ImportDocument:
+    """One form model built from one or more source rows sharing a group key."""
+
+    index: int
+    key: str
+    lines: List[int] = field(default_factory=list)
+    model: Dict[str, Any] = field(default_factory=dict)
+
+    @property
+    def line_range(self) -> str:
+        """Source data rows (1-based), e.g. "7" or "7-9"."""
+        first, last = self.lines[0], self.lines[-1]
+        if first == last:
+            return str(first)
+        if self.lines == list(range(first, last + 1)):
+            return f"{first}-{last}"
+        return ",".join(map(str, self.lines))
+
+
+def read_source(path: str, sheet: str = "") -> Iterator[Dict[str, Any]]:
+    """Yield the rows of a CSV, Excel (first sheet unless given) or JSONL file as dicts."""
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"导入文件未找到: {path}")
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".csv":
+        with open(path, "r", encoding="utf-8-sig", newline="") as f:
+            yield from csv.DictReader(f)
+    elif extension in (".jsonl", ".ndjson"):
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    elif extension in (".xlsx", ".xlsm"):
+        from openpyxl import load_workbook
+
+        workbook = load_workbook(path, read_only=True, data_only=True)
+        try:
+            worksheet = workbook[sheet] if sheet else workbook.worksheets[0]
+            rows = worksheet.iter_rows(values_only=True)
+            header = [str(h).strip() if h is not None else "" for h in next(rows, [])]
+            for values in rows:
+                if any(v is not None for v in values):
+                    yield {h: v for h, v in zip(header, values) if h}
+        finally:
+            workbook.close()
+    else:
+        raise RuntimeError(f"不支持的导入文件格式: {extension} (可选: .csv / .xlsx / .jsonl)")
+
+
+def load_mapping(path: str) -> Optional[Dict[str, str]]:
+    """{source column: model path}; without a mapping every column name is a model path."""
+    if not path:
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        mapping = json.load(f)
+    if not isinstance(mapping, dict) or not all(isinstance(v, str) for v in mapping.values()):
+        raise RuntimeError(f"映射文件格式错误，应为 {{\"源列名\": \"字段路径\"}}: {path}")
+    return mapping
+
+
+def _is_blank(value: Any) -> bool:
+    return value is None or (isinstance(value, str) and not value.strip()) or (isinstance(value, float) and math.isnan(value))
+
+
+def _model_value(value: Any) -> Any:
+    if isinstance(value, datetime.datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(value, datetime.date):
+        return value.strftime("%Y-%m-%d")
+    return value
+
+
+def _assign(target: Dict[str, Any], path: List[str], value: Any) -> None:
+    for part in path[:-1]:
+        target = target.setdefault(part, {})
+    target[path[-1]] = value
+
+
+def build_documents(
+    rows: Iterator[Dict[str, Any]],
+    mapping: Optional[Dict[str, str]] = None,
+    group_by: str = "",
+) -> List[ImportDocument]:
+    """
+    Turn flat source rows into form models.
+
+    Model paths use "." for nesting and "[]" for entry rows, e.g.
+    "FCustId.FNumber" or "FSaleOrderEntry[].FMaterialId.FNumber". Rows with
+    the same group_by value become one document: header fields come from
+    its first row, and every row adds one entry row to each entity it has
+    values for. Blank cells are left out of the model.
+    """
+    documents: Dict[str, ImportDocument] = {}
+    for line, row in enumerate(rows, start=1):
+        if group_by and group_by not in row:
+            raise RuntimeError(f"导入文件中没有分组列: {group_by}")
+        key = str(row.get(group_by) if group_by and not _is_blank(row.get(group_by)) else f"#{line}")
+        document = documents.get(key)
+        if document is None:
+            document = documents[key] = ImportDocument(len(documents), key)
+        first_row = not document.lines
+        document.lines.append(line)
+
+        entries: Dict[str, Dict[str, Any]] = {}
+        for column, value in row.items():
+            path = mapping.get(column) if mapping is not None else column
+            if not path or _is_blank(value):
+                continue
+            value = _model_value(value)
+            if "[]." in path:
+                entity, _, rest = path.partition("[].")
+                _assign(entries.setdefault(entity, {}), rest.split("."), value)
+            elif first_row:
+                _assign(document.model, path.split("."), value)
+
+        for entity, entry in entries.items():
+            document.model.setdefault(entity, []).append(entry)
+    return list(documents.values())
+
+
+def _response_status(response: Any) -> Dict[str, Any]:
+    data = json.loads(response) if isinstance(response, str) else response
+    if isinstance(data, dict):
+        return (data.get("Result") or {}).get("ResponseStatus") or {}
+    return {}
+
+
+def _error_messages(status: Dict[str, Any]) -> Tuple[Dict[int, List[str]], List[str]]:
+    """Split errors into those tied to a position (DIndex) and general ones."""
+    by_index: Dict[int, List[str]] = {}
+    general: List[str] = []
+    for error in status.get("Errors") or []:
+        message = error.get("Message") or str(error)
+        if error.get("FieldName"):
+            message = f"{error['FieldName']}: {message}"
+        if isinstance(error.get("DIndex"), int):
+            by_index.setdefault(error["DIndex"], []).append(message)
+        else:
+            general.append(message)
+    return by_index, general
+
+
+def document_number(document: ImportDocument, number_field: str) -> str:
+    value = document.model.get(number_field) if number_field else None
+    return "" if _is_blank(value) else str(value).strip()
+
+
+def _succeeded(
+    status: Dict[str, Any], documents: List[ImportDocument], number_field: str = ""
+) -> Tuple[Dict[int, Dict[str, Any]], int]:
+    """
+    Success entities by document position, matched on DIndex or else on the
+    bill number; also returns how many entities matched no document, whose
+    documents' outcome is then unknown.
+    """
+    positions = {}
+    for position, document in enumerate(documents):
+        number = document_number(document, number_field)
+        if number:
+            positions.setdefault(number, position)
+
+    result: Dict[int, Dict[str, Any]] = {}
+    unattributed = 0
+    for entity in status.get("SuccessEntitys") or []:
+        index = entity.get("DIndex")
+        if not (isinstance(index, int) and 0 <= index < len(documents)):
+            index = positions.get(str(entity.get("Number") or ""))
+        if index is None or index in result:
+            unattributed += 1
+        else:
+            result[index] = entity
+    return result, unattributed
+
+
+class ImportReport:
+    """
+    Per-record result CSV, appended one chunk at a time. A chunk is committed
+    once its records are in the report, and --resume skips committed chunks.
+    Chunks whose BatchSave outcome is unknown (e.g. a timeout after the
+    request was sent) are recorded as "uncertain" instead; --resume checks
+    those against the server before sending anything again. A .meta.json
+    next to it pins the source, form and chunk size.
+    """
+
+    def __init__(self, path: str, meta: Dict[str, Any], resume: bool):
+        self.path = path
+        self.meta_path = path + ".meta.json"
+        self.committed: Set[int] = set()
+        # chunk -> documents whose latest record is uncertain
+        self.uncertain: Dict[int, Set[int]] = {}
+        self._lock = threading.Lock()
+
+        if resume and os.path.exists(path):
+            self._load(meta)
+        elif os.path.exists(path):
+            raise RuntimeError(f"导入报告已存在: {path}，使用 --resume 继续上次导入，或使用 --report 指定新文件")
+        else:
+            output_dir = os.path.dirname(path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            with open(self.meta_path, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False, indent=2)
+            with open(path, "w", encoding="utf-8-sig", newline="") as f:
+                csv.writer(f).writerow(REPORT_COLUMNS)
+
+    def _load(self, meta: Dict[str, Any]) -> None:
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, "r", encoding="utf-8") as f:
+                previous = json.load(f)
+            changed = [k for k in ("source", "form_id", "chunk_size", "group_by", "documents") if previous.get(k) != meta.get(k)]
+            if changed:
+                raise RuntimeError(f"无法继续导入: {', '.join(changed)} 与上次导入不一致 ({self.meta_path})")
+        latest: Dict[Tuple[int, int], str] = {}
+        with open(self.path, "r", encoding="utf-8-sig", newline="") as f:
+            for row in csv.DictReader(f):
+                if row.get("chunk"):
+                    # Later rows (a resolved uncertain chunk) supersede earlier ones
+                    latest[(int(row["chunk"]), int(row["document"]))] = row["status"]
+        for (chunk, document), status in latest.items():
+            if status == UNCERTAIN:
+                self.uncertain.setdefault(chunk, set()).add(document)
+        self.committed = {chunk for chunk, _ in latest} - set(self.uncertain)
+
+    def commit(self, records: List[Dict[str, Any]]) -> None:
+        with self._lock, open(self.path, "a", encoding="utf-8-sig", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS)
+            writer.writerows(records)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def _chain(client: K3CloudClient, form_id: str, stage: str, records: List[Dict[str, Any]]) -> None:
+    """Submit or audit the records still in the previous stage's status, updating them in place."""
+    previous, action = {"submitted": ("saved", "submit"), "audited": ("submitted", "audit")}[stage]
+    pending = [r for r in records if r["status"] == previous and r["id"]]
+    if not pending:
+        return
+    try:
+        call = client.submit if stage == "submitted" else client.audit
+        status = _response_status(call(form_id, {"Ids": ",".join(str(r["id"]) for r in pending)}))
+    except Exception as e:
+        for record in pending:
+            record["message"] = f"{action} failed: {e}"
+        return
+
+    done = {str(entity.get("Id")) for entity in status.get("SuccessEntitys") or []}
+    by_index, general = _error_messages(status)
+    for position, record in enumerate(pending):
+        if str(record["id"]) in done:
+            record["status"] = stage
+        else:
+            messages = by_index.get(position) or general or ["no result returned"]
+            record["message"] = f"{action} failed: {'; '.join(messages)}"
+
+
+def _record(chunk_index: int, document: ImportDocument, status: str, message: str = "", entity: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    return {
+        "chunk": chunk_index,
+        "document": document.index,
+        "lines": document.line_range,
+        "key": document.key,
+        "status": status,
+        "id": entity.get("Id", "") if entity else "",
+        "number": entity.get("Number", "") if entity else "",
+        "message": message,
+    }
+
+
+def uncertain_records(chunk_index: int, documents: List[ImportDocument], error: Exception) -> List[Dict[str, Any]]:
+    """Report records for a chunk whose BatchSave may or may not have reached the server."""
+    return [_record(chunk_index, d, UNCERTAIN, f"save result unknown: {error}") for d in documents]
+
+
+def import_chunk(
+    client: K3CloudClient,
+    form_id: str,
+    chunk_index: int,
+    documents: List[ImportDocument],
+    save_options: Dict[str, Any],
+    submit: bool,
+    audit: bool,
+    number_field: str = "",
+) -> List[Dict[str, Any]]:
+    """BatchSave one chunk, optionally submit/audit what was saved, and return its report records."""
+    data = dict(save_options)
+    data["Model"] = [d.model for d in documents]
+    status = _response_status(client.batch_save(form_id, data))
+
+    saved, unattributed = _succeeded(status, documents, number_field)
+    by_index, general = _error_messages(status)
+    records = []
+    for position, document in enumerate(documents):
+        entity = saved.get(position)
+        if entity:
+            records.append(_record(chunk_index, document, "saved", entity=entity))
+        elif unattributed and not by_index.get(position):
+            # A success entity that names no document may well be this one
+            records.append(_record(chunk_index, document, UNCERTAIN, "save result could not be matched to a document"))
+        else:
+            records.append(_record(chunk_index, document, "failed", "; ".join(by_index.get(position) or general or ["no result returned"])))
+
+    if submit or audit:
+        _chain(client, form_id, "submitted", records)
+    if audit:
+        _chain(client, form_id, "audited", records)
+    return records
+
+
+def find_saved(client: K3CloudClient, form_id: str, number_field: str, numbers: List[str]) -> Dict[str, Tuple[Any, str]]:
+    """
+    {bill number: (FID, bill number)} of the given numbers that exist on the
+    server. Always asked of the server: a cached answer from before the
+    save would report saved documents as missing and send them again.
+    """
+    found: Dict[str, Tuple[Any, str]] = {}
+    for i in range(0, len(numbers), 200):
+        batch = numbers[i:i + 200]
+        quoted = ",".join("'" + n.replace("'", "''") + "'" for n in batch)
+        response = client.bill_query({
+            "FormId": form_id,
+            "FieldKeys": f"FID,{number_field}",
+            "FilterString": f"{number_field} IN ({quoted})",
+            "OrderString": "",
+            "TopRowCount": 0,
+            "StartRow": 0,
+            "Limit": 0,
+        }, use_cache=False)
+        rows = json.loads(response) if isinstance(response, str) else response
+        if not isinstance(rows, list) or any(not isinstance(r, list) for r in rows):
+            raise RuntimeError(f"无法确认单据是否已保存: {str(response)[:500]}")
+        for fid, number in rows:
+            found[str(number)] = (fid, str(number))
+    return found
+
+
+def verify_chunk(
+    client: K3CloudClient,
+    form_id: str,
+    chunk_index: int,
+    documents: List[ImportDocument],
+    save_options: Dict[str, Any],
+    submit: bool,
+    audit: bool,
+    number_field: str,
+    resend: bool,
+) -> List[Dict[str, Any]]:
+    """
+    Resolve an uncertain chunk: documents whose bill number already exists
+    are recorded as saved, the rest are saved again. Documents without a
+    number cannot be checked and stay uncertain unless resend is set.
+    """
+    numbers = {d.index: document_number(d, number_field) for d in documents}
+    found = find_saved(client, form_id, number_field, sorted({n for n in numbers.values() if n})) if number_field else {}
+
+    records = []
+    to_send = []
+    for document in documents:
+        number = numbers[document.index]
+        if number and number in found:
+            fid, bill_no = found[number]
+            records.append(_record(chunk_index, document, "saved", "already saved by an earlier run", {"Id": fid, "Number": bill_no}))
+        elif number or resend:
+            to_send.append(document)
+        else:
+            records.append(_record(
+                chunk_index, document, UNCERTAIN,
+                f"no {number_field or 'bill number'} to check whether it was saved; verify in the ERP, then use --resend-uncertain",
+            ))
+    if submit or audit:
+        _chain(client, form_id, "submitted", records)
+    if audit:
+        _chain(client, form_id, "audited", records)
+
+    logger.info(f"Chunk {chunk_index + 1}: {len(found)} uncertain documents found saved, {len(to_send)} to send again")
+    if to_send:
+        records += import_chunk(client, form_id, chunk_index, to_send, save_options, submit, audit, number_field)
+    return records
+
+
+def default_report_path(form_id: str, source: str) -> str:
+    stem = os.path.splitext(os.path.basename(source))[0]
+    return os.path.join("data", f"import_{form_id}_{stem}.csv")
+
+
+def run_import(client: K3CloudClient, args: argparse.Namespace) -> Dict[str, int]:
+    mapping = load_mapping(args.mapping)
+    documents = build_documents(read_source(args.source, args.sheet), mapping, args.group_by)
+    if not documents:
+        raise RuntimeError(f"导入文件中没有数据: {args.source}")
+
+    chunk_size = max(1, args.chunk_size)
+    chunks = [documents[i:i + chunk_size] for i in range(0, len(documents), chunk_size)]
+    logger.info(f"Read {len(documents)} documents for {args.form_id} from {args.source} ({len(chunks)} chunks of up to {chunk_size})")
+
+    if args.dry_run:
+        logger.info("Dry run, first document model:\n" + json.dumps(documents[0].model, ensure_ascii=False, indent=2, default=str))
+        return {"documents": len(documents), "chunks": len(chunks)}
+
+    save_options = dict(DEFAULT_SAVE_OPTIONS)
+    if args.save_options:
+        try:
+            save_options.update(json.loads(args.save_options))
+        except (ValueError, TypeError) as e:
+            raise RuntimeError(f"--save-options 必须是 JSON 对象: {e}") from e
+
+    report_path = args.report or default_report_path(args.form_id, args.source)
+    meta = {
+        "source": os.path.abspath(args.source),
+        "form_id": args.form_id,
+        "chunk_size": chunk_size,
+        "group_by": args.group_by,
+        "documents": len(documents),
+    }
+    report = ImportReport(report_path, meta, args.resume)
+    todo = [i for i in range(len(chunks)) if i not in report.committed]
+    if report.committed or report.uncertain:
+        logger.info(
+            f"Resuming: {len(report.committed)} chunks already committed, {len(report.uncertain)} uncertain to check, "
+            f"{len(todo) - len(report.uncertain)} to go"
+        )
+
+    summary = {"documents": 0, "saved": 0, "submitted": 0, "audited": 0, "failed": 0, UNCERTAIN: 0}
+    incomplete = []
+    concurrency = max(1, args.concurrency)
+    with ContextThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {}
+        for i in todo:
+            if i in report.uncertain:
+                pending = [d for d in chunks[i] if d.index in report.uncertain[i]]
+                future = executor.submit(
+                    verify_chunk, client, args.form_id, i, pending, save_options, args.submit, args.audit,
+                    args.number_field, args.resend_uncertain,
+                )
+            else:
+                future = executor.submit(
+                    import_chunk, client, args.form_id, i, chunks[i], save_options, args.submit, args.audit, args.number_field
+                )
+            futures[future] = i
+        for future in as_completed(futures):
+            chunk_index = futures[future]
+            try:
+                records = future.result()
+            except Exception as e:
+                if chunk_index in report.uncertain:
+                    # Still unknown; the uncertain records already in the report stand
+                    logger.error(f"Chunk {chunk_index + 1}/{len(chunks)} could not be checked: {e}")
+                    incomplete.append(chunk_index)
+                    continue
+                # The request may have been saved before it failed: never resend blindly
+                logger.error(f"Chunk {chunk_index + 1}/{len(chunks)} failed, save result unknown: {e}")
+                records = uncertain_records(chunk_index, chunks[chunk_index], e)
+            report.commit(records)
+            for record in records:
+                summary["documents"] += 1
+                summary[record["status"]] += 1
+            failed = sum(1 for r in records if r["status"] == "failed" or r["message"])
+            logger.info(
+                f"Chunk {chunk_index + 1}/{len(chunks)} committed: {len(records) - failed} ok, {failed} with errors "
+                f"({summary['documents']} documents this run)"
+            )
+
+    logger.info(f"Import report written to {report_path}: {summary}")
+    if incomplete or summary[UNCERTAIN]:
+        raise RuntimeError(
+            f"{summary[UNCERTAIN]} 张单据保存结果未知，{len(incomplete)} 个分块无法确认 (网络或服务错误)；"
+            f"使用 --resume 按 {args.number_field or '单据编号'} 确认后只重发未保存的单据"
+        )
+    return summary
@@ -1,6 +1,14 @@
+import contextvars
 import logging
 import sys
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# capture() 打开的日志列表；None 表示当前上下文不收集
+_captured_lines: contextvars.ContextVar[Optional[List[str]]] = contextvars.ContextVar("captured_lines", default=None)
 
 def setup_logging(debug: bool = False) -> logging.Logger:
     """
@@ -19,7 +27,7 @@ def setup_logging(debug: bool = False) -> logging.Logger:
             
     logging.basicConfig(
         level=level,
-        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        format=LOG_FORMAT,
         handlers=[
             logging.StreamHandler(sys.stdout)
         ]
@@ -37,3 +45,45 @@ def get_logger(name: Optional[str] = None) -> logging.Logger:
     if name:
         return logging.getLogger(f"k3cloud.{name}")
     return logging.getLogger("k3cloud")
+
+class LogCapture(logging.Handler):
+    """
+    把日志行写入当前上下文中 capture() 打开的列表
+
+    按 contextvars 上下文而不是线程区分，因此通过 ContextThreadPoolExecutor
+    交给工作线程的任务所写的日志，也归入提交它们的请求。
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    def emit(self, record: logging.LogRecord) -> None:
+        lines = _captured_lines.get()
+        if lines is not None:
+            lines.append(self.format(record))
+
+@contextmanager
+def capture() -> Iterator[List[str]]:
+    """
+    收集 with 块内当前上下文产生的日志行（需要 logger 上挂有 LogCapture）
+
+    Yields:
+        收集到的日志行列表，块结束后不再增加
+    """
+    lines: List[str] = []
+    token = _captured_lines.set(lines)
+    try:
+        yield lines
+    finally:
+        _captured_lines.reset(token)
+
+class ContextThreadPoolExecutor(ThreadPoolExecutor):
+    """
+    在提交时的 contextvars 上下文中运行任务的线程池
+
+    普通 ThreadPoolExecutor 的工作线程不继承提交者的上下文，capture() 就收不到它们的日志。
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
@@ -2,14 +2,21 @@ import argparse
 import logging
 import os
 import sys
-from typing import List, Optional
+from types import GeneratorType
+from typing import List, Optional, Type
 
-import json
+from cache import DEFAULT_CACHE_FILE, QueryCache
 from client import K3CloudClient
+from columnar import ColumnarResult
 import commands
-from config import default_config_path, load_config
+import export
+import fanout
+import scheduler
+import server
+from config import K3CloudConfig, default_config_path, load_config
 
 from logger import get_logger, setup_logging
+from metrics import METRICS, default_report_path
 
 logger = get_logger(__name__)
 
@@ -17,95 +24,119 @@ logger = get_logger(__name__)
 def run_command(client: K3CloudClient, args: argparse.Namespace) -> int:
     if not hasattr(args, "handler"):
         raise RuntimeError("未选择命令")
-    result = args.handler(client, args)
-    
-    # Parse result data
-    output_data = result
-    if isinstance(result, str):
-        try:
-            output_data = json.loads(result)
-        except json.JSONDecodeError:
-            pass
+    return export_result(client.config, args, args.handler(client, args))
+
+
+def export_result(config: K3CloudConfig, args: argparse.Namespace, result) -> int:
+    # Determine sheet name
+    command_name = args.command if hasattr(args, 'command') else 'query'
+    sheet_name = commands.COMMAND_HELP_MAP.get(command_name, command_name)
+
+    if isinstance(result, GeneratorType):
+        return export.export_batches(args, result, sheet_name, config.excel_file)
 
-    # Automatic Excel Export for List data (Query results)
+    # Automatic Export for List data (Query results)
     # Check if it's a list of dictionaries OR a list of lists (typical query result)
-    if isinstance(output_data, list) and len(output_data) > 0:
-        is_list_of_dicts = isinstance(output_data[0], dict)
-        is_list_of_lists = isinstance(output_data[0], list)
-        
-        if is_list_of_dicts or is_list_of_lists:
-            try:
-                import pandas as pd
-                import time
-                
-                # Determine sheet name
-                command_name = args.command if hasattr(args, 'command') else 'query'
-                sheet_name = commands.COMMAND_HELP_MAP.get(command_name, command_name)
-                
-                # Determine output filename
-                if client.config.excel_file:
-                    filename = client.config.excel_file
-                    # Ensure directory exists if path contains directory
-                    output_dir = os.path.dirname(filename)
-                    if output_dir and not os.path.exists(output_dir):
-                        try:
-                            os.makedirs(output_dir)
-                        except Exception:
-                            pass
-                
-                if is_list_of_dicts:
-                    df = pd.DataFrame(output_data)
-                else:
-                    # It is list of lists, try to find headers from args
-                    columns = None
-                    if hasattr(args, 'field_keys') and args.field_keys:
-                        # Split keys by comma and clean up
-                        columns = [k.strip() for k in args.field_keys.split(',') if k.strip()]
-                        
-                        # Handle case where field_keys might not match column count exactly
-                        # But typically for K3Cloud ExecuteBillQuery, they match.
-                        # If mismatch, pandas handles it (either ignores extra names or creates NaN for missing)
-                        
-                    # Fix: if columns count mismatch, just use default (0, 1, 2...) or truncate/pad
-                    if columns and len(output_data) > 0 and len(output_data[0]) != len(columns):
-                         logger.warning(f"Column count mismatch: Data has {len(output_data[0])} columns, but field_keys has {len(columns)}. Using default column names.")
-                         columns = None
-                         
-                    df = pd.DataFrame(output_data, columns=columns)
-
-                # Write to Excel
-                if client.config.excel_file and os.path.exists(filename):
-                     # Append mode
-                     try:
-                        with pd.ExcelWriter(filename, mode='a', engine='openpyxl', if_sheet_exists='replace') as writer:
-                            df.to_excel(writer, sheet_name=sheet_name, index=False)
-                        logger.info(f"Result appended to Excel: {filename} (Sheet: {sheet_name})")
-                     except Exception as e:
-                        logger.error(f"Failed to append to Excel file (trying overwrite/create): {e}")
-                else:
-                    # Create new file
-                    with pd.ExcelWriter(filename, engine='openpyxl') as writer:
-                        df.to_excel(writer, sheet_name=sheet_name, index=False)
-                    logger.info(f"Result saved to Excel: {filename} (Sheet: {sheet_name})")
-
-            except ImportError:
-                logger.warning("pandas or openpyxl not installed. Skipping automatic Excel export.")
-            except Exception as e:
-                logger.error(f"Failed to save Excel file: {e}")
+    rows = export.result_rows(result)
+    if rows is not None and getattr(args, 'output_format', 'excel') != 'excel':
+        if isinstance(rows, ColumnarResult):
+            return export.export_columnar(args, rows, sheet_name)
+        return export.export_batches(args, [rows], sheet_name)
+
+    if rows is not None:
+        try:
+            df = export.build_dataframe(rows, args)
+            filename, df = export.resume_excel_sheet(args, df)
+            append = True
+            if filename is None:
+                filename, append = export.resolve_excel_file(config, command_name)
+            export.write_excel_sheets(filename, [(sheet_name, df)], append)
+            return export.finish_export(args, filename, sheet_name, append)
+        except ImportError:
+            logger.warning("pandas or openpyxl not installed. Skipping automatic Excel export.")
+        except Exception as e:
+            logger.error(f"Failed to save Excel file: {e}")
+            return 1
 
     return 0
 
 
-def build_parser() -> argparse.ArgumentParser:
-    parser = argparse.ArgumentParser(prog="k3cloud")
+def build_parser(parser_class: Type[argparse.ArgumentParser] = argparse.ArgumentParser) -> argparse.ArgumentParser:
+    # serve and schedule parse their requests with cli.StrictArgumentParser
+    parser = parser_class(prog="k3cloud")
     parser.add_argument("--config", default=os.getenv("K3CLOUD_CONF") or default_config_path())
     parser.add_argument("--section", default=os.getenv("K3CLOUD_SECTION") or "k3cloud")
     parser.add_argument("--debug", action="store_true", help="Enable debug logging")
+    parser.add_argument("--cache", action="store_true", help="Enable the on-disk query cache (also enabled by cache_file in config)")
+    parser.add_argument("--no-cache", action="store_true", help="Disable the query cache even if configured")
+    parser.add_argument("--refresh", action="store_true", help="Bypass cached responses and store fresh ones")
+    parser.add_argument("--profile", action="store_true", help="Record per-request/per-stage timings and print a summary")
+    parser.add_argument("--profile-output", default="", help="Profile report path (default: data/profile_<command>_<timestamp>.json)")
+    parser.add_argument("--profile-format", choices=["json", "prometheus"], default="json", help="Profile report format")
     subparsers = parser.add_subparsers(dest="command", required=True)
     commands.register_commands(subparsers)
+    server.add_serve_parser(subparsers).set_defaults(handler=cmd_serve)
+    fanout.add_fanout_parser(subparsers).set_defaults(handler=cmd_fanout)
+    scheduler.add_schedule_parser(subparsers).set_defaults(handler=cmd_schedule)
     return parser
 
 
+def cmd_serve(client: K3CloudClient, args: argparse.Namespace) -> int:
+    return server.serve(client, args, build_parser, run_command)
+
+
+def cmd_schedule(client: K3CloudClient, args: argparse.Namespace) -> int:
+    return scheduler.schedule(client, args, build_parser, run_command)
+
+
+def cmd_fanout(client: Optional[K3CloudClient], args: argparse.Namespace) -> Optional[ColumnarResult]:
+    # Run from serve/schedule, every section's requests pass the running
+    # client's limiter (--rate/--max-inflight); standalone, each section
+    # uses the limits of its own config
+    rate_limiter = client.rate_limiter if client is not None else None
+
+    def make_client(section: str) -> K3CloudClient:
+        cfg = load_config(args.config, section)
+        return K3CloudClient(cfg, cache=build_cache(cfg, args), rate_limiter=rate_limiter)
+
+    return fanout.run_fanout(args, make_client)
+
+
+def build_cache(cfg: K3CloudConfig, args: argparse.Namespace) -> Optional[QueryCache]:
+    if args.no_cache or not (args.cache or args.refresh or cfg.cache_file):
+        return None
+    return QueryCache(
+        cfg.cache_file or DEFAULT_CACHE_FILE,
+        default_ttl=cfg.cache_ttl,
+        max_bytes=cfg.cache_max_mb * 1024 * 1024,
+        form_ttls=cfg.cache_form_ttl,
+        # Responses depend on who asks, not just on the payload
+        namespace=f"{cfg.server_url}|{cfg.acct_id}|{cfg.user_name}|{cfg.lcid}|{cfg.org_num}",
+        refresh=args.refresh,
+    )
+
+
+def report_profile(args: argparse.Namespace) -> None:
+    logger.info("Profile summary:\n" + METRICS.format_table())
+    path = args.profile_output or default_report_path(args.command, args.profile_format)
+    try:
+        METRICS.write_report(path, args.profile_format)
+    except Exception as e:
+        logger.error(f"Failed to write profile report: {e}")
+
+
+def main_fanout(args: argparse.Namespace) -> int:
+    # Every section gets its own client in run_fanout; the first section
+    # only supplies the output settings (excel_file)
+    cfg = load_config(args.config, fanout.split_sections(args.sections)[0])
+    try:
+        with METRICS.timer("command", command=args.command):
+            return export_result(cfg, args, cmd_fanout(None, args))
+    finally:
+        if args.profile:
+            report_profile(args)
+
+
 def main(argv: Optional[List[str]] = None) -> int:
     parser = build_parser()
     args = parser.parse_args(argv)
@@ -115,10 +146,25 @@ def main(argv: Optional[List[str]] = None) -> int:
     else:
         setup_logging(debug=False)
 
+    if args.profile:
+        METRICS.enable()
+
     try:
+        if args.command == "fan-out":
+            return main_fanout(args)
         cfg = load_config(args.config, args.section)
-        client = K3CloudClient(cfg)
-        return run_command(client, args)
+        cache = build_cache(cfg, args)
+        client = K3CloudClient(cfg, cache=cache)
+        try:
+            with METRICS.timer("command", command=args.command):
+                return run_command(client, args)
+        finally:
+            client.close()
+            if cache is not None:
+                logger.info(f"Query cache: {cache.hits} hits, {cache.misses} misses")
+                cache.close()
+            if args.profile:
+                report_profile(args)
     except Exception as e:
         logger.error(f"Error: {e}")
         if args.debug:
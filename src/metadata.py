@@ -0,0 +1,238 @@
+import difflib
+import json
+import os
+import sqlite3
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Sequence
+
+from client import K3CloudClient
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_METADATA_FILE = os.path.join("data", "metadata.db")
+
+# Substrings of K3Cloud field type names -> column kind (see columnar.DTYPE_KINDS)
+_TYPE_KINDS = (
+    ("checkbox", "bool"),
+    ("datetime", "datetime"),
+    ("date", "datetime"),
+    ("integer", "int"),
+    ("qty", "float"),
+    ("price", "float"),
+    ("amount", "float"),
+    ("decimal", "float"),
+    ("basedata", "string"),
+    ("assistant", "string"),
+    ("combo", "string"),
+    ("text", "string"),
+)
+
+
+@dataclass
+class FieldInfo:
+    key: str
+    caption: str = ""
+    kind: Optional[str] = None
+
+
+@dataclass
+class FormMetadata:
+    """Field list of a form, as returned by QueryBusinessInfo."""
+
+    form_id: str
+    pk_field: str = "FID"
+    entity_keys: List[str] = field(default_factory=list)
+    fields: Dict[str, FieldInfo] = field(default_factory=dict)
+
+    def _lookup(self, field_key: str) -> Optional[FieldInfo]:
+        # Only the root of "FMaterialId.FNumber" is a field of this form
+        return self.fields.get(field_key.split(".", 1)[0].strip().lower())
+
+    def is_known(self, field_key: str) -> bool:
+        root = field_key.split(".", 1)[0].strip().lower()
+        if root in self.fields or root in ("fid", self.pk_field.lower()):
+            return True
+        # Entity primary key / sequence columns such as FSaleOrderEntry_FEntryID
+        return any(root.startswith(entity.lower() + "_") for entity in self.entity_keys)
+
+    def unknown_fields(self, field_keys: Sequence[str]) -> List[str]:
+        return [k for k in field_keys if not self.is_known(k)]
+
+    def suggest(self, field_key: str) -> Optional[str]:
+        root = field_key.split(".", 1)[0].strip().lower()
+        matches = difflib.get_close_matches(root, list(self.fields), n=1, cutoff=0.75)
+        return self.fields[matches[0]].key if matches else None
+
+    def kind(self, field_key: str) -> Optional[str]:
+        info = self._lookup(field_key)
+        # Sub-properties of base data (FMaterialId.FNumber) are not the base data field's type
+        if info is None or "." in field_key:
+            return None
+        return info.kind
+
+    def caption(self, field_key: str) -> str:
+        info = self._lookup(field_key)
+        if info is None or not info.caption:
+            return field_key
+        if "." in field_key:
+            return f"{info.caption}.{field_key.split('.', 1)[1]}"
+        return info.caption
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "form_id": self.form_id,
+            "pk_field": self.pk_field,
+            "entity_keys": self.entity_keys,
+            "fields": [[f.key, f.caption, f.kind] for f in self.fields.values()],
+        }
+
+    @classmethod
+    def from_json(cls, data: Dict[str, Any]) -> "FormMetadata":
+        fields = {key.lower(): FieldInfo(key, caption, kind) for key, caption, kind in data.get("fields", [])}
+        return cls(data["form_id"], data.get("pk_field") or "FID", data.get("entity_keys") or [], fields)
+
+
+def _localized(name: Any, lcid: int) -> str:
+    """Names come back as [{"Key": 2052, "Value": "..."}, ...] or as a plain string."""
+    if isinstance(name, str):
+        return name
+    if isinstance(name, list):
+        values = {item.get("Key"): item.get("Value") for item in name if isinstance(item, dict)}
+        return values.get(lcid) or next((v for v in values.values() if v), "")
+    return ""
+
+
+def _field_kind(field_info: Dict[str, Any]) -> Optional[str]:
+    for attr in ("FieldType", "ElementType", "Type"):
+        type_name = field_info.get(attr)
+        if not isinstance(type_name, str):
+            continue
+        type_name = type_name.lower()
+        for marker, kind in _TYPE_KINDS:
+            if marker in type_name:
+                return kind
+    return None
+
+
+def parse_business_info(form_id: str, response: Any, lcid: int = 2052) -> FormMetadata:
+    data = json.loads(response) if isinstance(response, str) else response
+    result = data.get("Result", data) if isinstance(data, dict) else {}
+    status = result.get("ResponseStatus") or {}
+    if status and not status.get("IsSuccess", True):
+        errors = "; ".join(e.get("Message", "") for e in status.get("Errors") or []) or str(status)
+        raise RuntimeError(f"查询表单元数据失败 ({form_id}): {errors}")
+
+    need = result.get("NeedReturnData") or {}
+    metadata = FormMetadata(form_id, need.get("PkFieldName") or "FID")
+    for entry in need.get("Entrys") or []:
+        if entry.get("Key"):
+            metadata.entity_keys.append(entry["Key"])
+        for f in entry.get("Fields") or []:
+            key = f.get("Key")
+            if key:
+                metadata.fields[key.lower()] = FieldInfo(key, _localized(f.get("Name"), lcid), _field_kind(f))
+    return metadata
+
+
+class MetadataStore:
+    """SQLite cache of FormMetadata, one row per (connection namespace, form)."""
+
+    def __init__(self, path: str, ttl: int, namespace: str):
+        self.ttl = ttl
+        self.namespace = namespace
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS forms ("
+            "namespace TEXT, form_id TEXT, fetched_at REAL, body TEXT, "
+            "PRIMARY KEY (namespace, form_id))"
+        )
+        self._conn.commit()
+
+    def get(self, form_id: str) -> Optional[FormMetadata]:
+        row = self._conn.execute(
+            "SELECT fetched_at, body FROM forms WHERE namespace = ? AND form_id = ?",
+            (self.namespace, form_id.lower()),
+        ).fetchone()
+        if row is None or self.ttl <= 0 or row[0] + self.ttl < time.time():
+            return None
+        return FormMetadata.from_json(json.loads(row[1]))
+
+    def put(self, metadata: FormMetadata) -> None:
+        self._conn.execute(
+            "INSERT OR REPLACE INTO forms (namespace, form_id, fetched_at, body) VALUES (?, ?, ?, ?)",
+            (self.namespace, metadata.form_id.lower(), time.time(), json.dumps(metadata.to_json(), ensure_ascii=False)),
+        )
+        self._conn.commit()
+
+    def invalidate(self, form_id: str) -> None:
+        self._conn.execute("DELETE FROM forms WHERE namespace = ? AND form_id = ?", (self.namespace, form_id.lower()))
+        self._conn.commit()
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def open_store(client: K3CloudClient) -> MetadataStore:
+    cfg = client.config
+    return MetadataStore(
+        cfg.metadata_file or DEFAULT_METADATA_FILE,
+        cfg.metadata_ttl,
+        namespace=f"{cfg.server_url}|{cfg.acct_id}|{cfg.lcid}",
+    )
+
+
+def fetch_form_metadata(client: K3CloudClient, form_id: str) -> FormMetadata:
+    response = client.query_business_info({"FormId": form_id})
+    return parse_business_info(form_id, response, client.config.lcid)
+
+
+def validated_metadata(
+    client: K3CloudClient,
+    form_id: str,
+    field_keys: Sequence[str],
+    refresh: bool = False,
+) -> Optional[FormMetadata]:
+    """
+    Return the form's metadata after checking that every field key exists.
+
+    Cached metadata that rejects a key is refetched once (the form may have
+    gained a field since). Raises RuntimeError naming the unknown keys.
+    Returns None when the metadata cannot be fetched or lists no fields, in
+    which case the query runs unchecked.
+    """
+    store = open_store(client)
+    try:
+        metadata = None if refresh else store.get(form_id)
+        cached = metadata is not None
+        if metadata is None:
+            try:
+                metadata = fetch_form_metadata(client, form_id)
+            except Exception as e:
+                logger.warning(f"Form metadata unavailable for {form_id}, skipping field validation: {e}")
+                return None
+            store.put(metadata)
+
+        if not metadata.fields:
+            logger.warning(f"Form metadata for {form_id} lists no fields, skipping field validation")
+            return None
+
+        unknown = metadata.unknown_fields(field_keys)
+        if unknown and cached:
+            logger.info(f"Cached metadata for {form_id} does not know {', '.join(unknown)}; refreshing")
+            store.invalidate(form_id)
+            return validated_metadata(client, form_id, field_keys, refresh=True)
+    finally:
+        store.close()
+
+    if unknown:
+        details = []
+        for key in unknown:
+            suggestion = metadata.suggest(key)
+            details.append(f"{key} (是否为 {suggestion}?)" if suggestion else key)
+        raise RuntimeError(f"表单 {form_id} 中不存在字段: {', '.join(details)}")
+    return metadata
@@ -0,0 +1,142 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class Metrics:
+    """
+    Collects timing events for the query pipeline.
+
+    Each event has a stage name ("request", "page", "decode", "dataframe",
+    "excel_write", ...), wall time, optional row/byte counts and labels.
+    Recording is a no-op until enabled, so instrumentation costs nothing on
+    normal runs.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started_at = time.time()
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+
+    def enable(self) -> None:
+        self.enabled = True
+        self.started_at = time.time()
+        with self._lock:
+            self._events = []
+
+    def record(self, stage: str, seconds: float, rows: int = 0, nbytes: int = 0, **labels: Any) -> None:
+        if not self.enabled:
+            return
+        event = {"stage": stage, "seconds": seconds, "rows": rows, "bytes": nbytes}
+        event.update(labels)
+        with self._lock:
+            self._events.append(event)
+
+    @contextmanager
+    def timer(self, stage: str, **labels: Any) -> Iterator[Dict[str, Any]]:
+        """
+        Time a block. "rows" and "bytes" may be given up front or set on the
+        yielded dict, along with any extra labels, before the block ends.
+        """
+        info: Dict[str, Any] = {}
+        if not self.enabled:
+            yield info
+            return
+        started = time.perf_counter()
+        try:
+            yield info
+        finally:
+            elapsed = time.perf_counter() - started
+            labels.update(info)
+            rows = labels.pop("rows", 0)
+            nbytes = labels.pop("bytes", 0)
+            self.record(stage, elapsed, rows=rows, nbytes=nbytes, **labels)
+
+    @property
+    def events(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return list(self._events)
+
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        stages: Dict[str, Dict[str, Any]] = {}
+        durations: Dict[str, List[float]] = {}
+        for event in self.events:
+            stat = stages.setdefault(event["stage"], {"count": 0, "seconds": 0.0, "rows": 0, "bytes": 0})
+            stat["count"] += 1
+            stat["seconds"] += event["seconds"]
+            stat["rows"] += event["rows"]
+            stat["bytes"] += event["bytes"]
+            durations.setdefault(event["stage"], []).append(event["seconds"])
+
+        for stage, stat in stages.items():
+            values = sorted(durations[stage])
+            stat["max_seconds"] = values[-1]
+            stat["p95_seconds"] = values[min(len(values) - 1, int(len(values) * 0.95))]
+            stat["rows_per_sec"] = stat["rows"] / stat["seconds"] if stat["seconds"] > 0 else 0.0
+        return stages
+
+    def format_table(self) -> str:
+        header = f"{'stage':<14}{'count':>7}{'total s':>10}{'avg ms':>10}{'p95 ms':>10}{'max ms':>10}{'rows':>11}{'MB':>9}{'rows/s':>12}"
+        lines = [header, "-" * len(header)]
+        for stage, stat in self.summary().items():
+            lines.append(
+                f"{stage:<14}{stat['count']:>7}{stat['seconds']:>10.2f}"
+                f"{stat['seconds'] / stat['count'] * 1000:>10.1f}{stat['p95_seconds'] * 1000:>10.1f}"
+                f"{stat['max_seconds'] * 1000:>10.1f}{stat['rows']:>11}{stat['bytes'] / 1048576:>9.2f}"
+                f"{stat['rows_per_sec']:>12.0f}"
+            )
+        lines.append(f"wall time: {time.time() - self.started_at:.2f}s")
+        return "\n".join(lines)
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "started_at": self.started_at,
+            "wall_seconds": time.time() - self.started_at,
+            "stages": self.summary(),
+            "events": self.events,
+        }
+
+    def to_prometheus(self) -> str:
+        """Prometheus textfile-collector format."""
+        lines = []
+        for name, key, help_text in (
+            ("k3cloud_stage_events_total", "count", "Number of events per pipeline stage"),
+            ("k3cloud_stage_seconds_total", "seconds", "Wall time spent per pipeline stage"),
+            ("k3cloud_stage_rows_total", "rows", "Rows processed per pipeline stage"),
+            ("k3cloud_stage_bytes_total", "bytes", "Response bytes per pipeline stage"),
+            ("k3cloud_stage_seconds_max", "max_seconds", "Slowest single event per pipeline stage"),
+        ):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {'gauge' if key == 'max_seconds' else 'counter'}")
+            for stage, stat in self.summary().items():
+                lines.append(f'{name}{{stage="{stage}"}} {stat[key]}')
+        return "\n".join(lines) + "\n"
+
+    def write_report(self, path: str, report_format: str = "json") -> None:
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            if report_format == "prometheus":
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_json(), f, ensure_ascii=False, indent=2, default=str)
+        logger.info(f"Profile report written to {path}")
+
+
+# Process-wide collector, enabled by --profile
+METRICS = Metrics()
+
+
+def default_report_path(command_name: str, report_format: str) -> str:
+    timestamp = time.strftime("%Y%m%d_%H%M%S")
+    extension = "prom" if report_format == "prometheus" else "json"
+    return os.path.join("data", f"profile_{command_name}_{timestamp}.{extension}")
@@ -0,0 +1,886 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from cache import is_cacheable_response
+from checkpoint import DEFAULT_CHECKPOINT_FILE, Checkpoint, run_key
+from client import K3CloudClient
+from logger import ContextThreadPoolExecutor, get_logger
+from metrics import METRICS
+
+logger = get_logger(__name__)
+
+BATCH_SIZE = 2000 # K3Cloud standard limit
+
+
+def build_query_data(form_id: str, args: argparse.Namespace, start_row: int, limit: int) -> Dict[str, Any]:
+    return {
+        "FormId": form_id,
+        "FieldKeys": args.field_keys,
+        "FilterString": args.filter_string,
+        "OrderString": getattr(args, 'order_string', ''),
+        "TopRowCount": getattr(args, 'top_row_count', 0),
+        "StartRow": start_row,
+        "Limit": limit,
+    }
+
+
+@dataclass
+class PageResponse:
+    start_row: int
+    limit: int
+    response: Any
+    seconds: float
+
+
+class PageSizer:
+    """
+    Chooses the Limit of each ExecuteBillQuery page.
+
+    When adaptive, the size is steered towards target_latency seconds per
+    request (and at most max_bytes of response per page) from what full pages
+    actually cost, changing by at most 2x per page and staying within
+    [min_size, max_size]. Otherwise every page uses the initial size.
+    """
+
+    def __init__(
+        self,
+        initial: int = BATCH_SIZE,
+        min_size: int = 100,
+        max_size: int = BATCH_SIZE,
+        target_latency: float = 2.0,
+        max_bytes: int = 0,
+        adaptive: bool = False,
+    ):
+        self.min_size = max(1, min_size)
+        self.max_size = max(self.min_size, max_size)
+        self.size = max(1, initial)
+        if adaptive:
+            self.size = max(self.min_size, min(self.max_size, self.size))
+        self.target_latency = target_latency
+        self.max_bytes = max_bytes
+        self.adaptive = adaptive
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "PageSizer":
+        page_size = getattr(args, 'page_size', BATCH_SIZE)
+        return cls(
+            initial=page_size,
+            min_size=getattr(args, 'min_page_size', 100),
+            max_size=getattr(args, 'max_page_size', 0) or max(page_size, BATCH_SIZE),
+            target_latency=getattr(args, 'target_latency', 2.0),
+            max_bytes=getattr(args, 'max_page_bytes', 0),
+            adaptive=getattr(args, 'adaptive_page_size', False),
+        )
+
+    def observe(self, limit: int, rows: int, seconds: float, nbytes: int) -> None:
+        # Short pages are dominated by fixed per-request overhead, and the
+        # last page is always short, so only full pages steer the size.
+        if not self.adaptive or rows <= 0 or rows < limit:
+            return
+
+        desired = float(self.max_size)
+        if seconds > 0:
+            desired = self.target_latency * rows / seconds
+        if self.max_bytes and nbytes:
+            desired = min(desired, self.max_bytes * rows / nbytes)
+
+        desired = max(self.size / 2, min(self.size * 2, desired))
+        self.size = int(max(self.min_size, min(self.max_size, desired)))
+
+
+@dataclass
+class RetryPolicy:
+    """
+    How often a failed page request is repeated: up to `retries` more
+    times, waiting base_delay * 2^attempt seconds (capped at max_delay),
+    half of it fixed and half random, so parallel workers that failed
+    together do not retry in lockstep.
+    """
+
+    retries: int = 3
+    base_delay: float = 0.5
+    max_delay: float = 30.0
+
+    @classmethod
+    def from_args(cls, args: argparse.Namespace) -> "RetryPolicy":
+        return cls(
+            retries=max(0, getattr(args, 'retries', 3)),
+            base_delay=max(0.0, getattr(args, 'retry_delay', 0.5)),
+        )
+
+    def delay(self, attempt: int) -> float:
+        ceiling = min(self.max_delay, self.base_delay * (2 ** attempt))
+        return ceiling / 2 + random.uniform(0, ceiling / 2)
+
+
+# ResponseStatus.MsgCode values that repeating the same request cannot fix:
+# no permission, empty operation/form id, licence, bad parameter, missing
+# field or value, not found, validation failed, not operable, admin login
+PERMANENT_MSG_CODES = frozenset({2, 3, 5, 7, 8, 9, 10, 11, 12, 15})
+
+
+def _permanent_failure(response: Any) -> bool:
+    """Whether an error response reports a failure that a retry would only repeat."""
+    try:
+        status = _error_status(json.loads(response))
+    except (json.JSONDecodeError, TypeError):
+        return False
+    return status is not None and status.get('MsgCode') in PERMANENT_MSG_CODES
+
+
+def _timed_bill_query(client: K3CloudClient, data: Dict[str, Any], retry: Optional[RetryPolicy] = None) -> PageResponse:
+    """
+    Request one page, retrying network errors and transient error responses
+    (server exceptions, lost context, call limits, ...) per `retry`. Errors
+    with a PERMANENT_MSG_CODES code, e.g. an unknown field, are returned at
+    once. Once the retries are used up an error response is returned as is
+    and an exception is raised.
+    """
+    retries = retry.retries if retry is not None else 0
+    attempt = 0
+    while True:
+        started = time.perf_counter()
+        try:
+            response = client.bill_query(data)
+            failure = None if is_cacheable_response(response) or _permanent_failure(response) else str(response)[:200]
+        except Exception as e:
+            if attempt >= retries:
+                raise
+            failure = str(e)[:200]
+        if failure is None or attempt >= retries:
+            return PageResponse(data["StartRow"], data["Limit"], response, time.perf_counter() - started)
+
+        delay = retry.delay(attempt)
+        attempt += 1
+        logger.warning(
+            f"{data['FormId']} StartRow={data['StartRow']} failed ({failure}); "
+            f"retry {attempt}/{retries} in {delay:.1f}s"
+        )
+        METRICS.record("retry", delay, start_row=data["StartRow"], attempt=attempt)
+        time.sleep(delay)
+
+
+def _iter_page_responses(
+    client: K3CloudClient,
+    form_id: str,
+    args: argparse.Namespace,
+    start_row: int,
+    sizer: PageSizer,
+    workers: int,
+) -> Iterator[PageResponse]:
+    """
+    Yield ExecuteBillQuery responses for consecutive pages, in page order.
+
+    Each page is requested with the size the sizer holds at dispatch time.
+    With workers > 1 up to `workers` pages are kept in flight. A new page is
+    only dispatched after the consumer asks for the next response, so once
+    the caller stops iterating (short/empty page or error) nothing further
+    is requested and queued pages are cancelled.
+    """
+    retry = RetryPolicy.from_args(args)
+
+    def next_query() -> Dict[str, Any]:
+        nonlocal start_row
+        data = build_query_data(form_id, args, start_row, sizer.size)
+        logger.debug(f"Requesting {form_id} StartRow={start_row} Limit={sizer.size}")
+        start_row += sizer.size
+        return data
+
+    if workers <= 1:
+        while True:
+            yield _timed_bill_query(client, next_query(), retry)
+
+    executor = ContextThreadPoolExecutor(max_workers=workers)
+    pending = deque()
+    try:
+        for _ in range(workers):
+            pending.append(executor.submit(_timed_bill_query, client, next_query(), retry))
+
+        while pending:
+            yield pending.popleft().result()
+            pending.append(executor.submit(_timed_bill_query, client, next_query(), retry))
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+class BillQueryError(RuntimeError):
+    """Raised when the first page of a paginated query is not a row list."""
+
+    def __init__(self, response: Any):
+        super().__init__(f"Bill query failed: {response}")
+        self.response = response
+
+
+def _error_status(batch_result: Any) -> Optional[Dict[str, Any]]:
+    """
+    The ResponseStatus of a K3Cloud error payload, None for anything else.
+    Query errors come back either as a bare {"Result": {"ResponseStatus": ...}}
+    dict or wrapped as [[{...}]].
+    """
+    if isinstance(batch_result, list) and len(batch_result) == 1:
+        row = batch_result[0]
+        if isinstance(row, list) and len(row) == 1 and isinstance(row[0], dict):
+            batch_result = row[0]
+    if not isinstance(batch_result, dict):
+        return None
+    status = batch_result.get('Result', {}).get('ResponseStatus', {})
+    return None if status.get('IsSuccess', True) else status
+
+
+def _is_error_response(batch_result: Any) -> bool:
+    return _error_status(batch_result) is not None
+
+
+def _decode_rows(result_str: Any, first: bool) -> Optional[List[Any]]:
+    """
+    Decode one ExecuteBillQuery page into its rows.
+
+    Returns None when pagination should stop (the error is logged). On the
+    first page a failure raises BillQueryError carrying the raw response.
+    """
+    try:
+        with METRICS.timer("decode") as m:
+            batch_result = json.loads(result_str)
+            m["bytes"] = _page_bytes(result_str)
+            m["rows"] = len(batch_result) if isinstance(batch_result, list) else 0
+    except (json.JSONDecodeError, TypeError):
+        logger.error(f"Failed to decode JSON response: {result_str}")
+        if first:
+            raise BillQueryError(result_str)
+        return None
+    
+    # Check for error in response structure
+    if _is_error_response(batch_result):
+         if first:
+             raise BillQueryError(batch_result)
+         logger.error(f"Error during pagination: {batch_result}")
+         return None
+
+    if not isinstance(batch_result, list):
+        if first:
+            raise BillQueryError(result_str)
+        return None
+
+    return batch_result
+
+
+def _page_bytes(response: Any) -> int:
+    return len(response) if isinstance(response, (str, bytes)) else 0
+
+
+def iter_bill_query_batches(
+    client: K3CloudClient,
+    form_id: str,
+    args: argparse.Namespace,
+    sizer: Optional[PageSizer] = None,
+    strict: bool = False,
+) -> Iterator[List[Any]]:
+    """
+    Paginate an ExecuteBillQuery and yield each non-empty page of rows.
+
+    Every page is retried per --retries before it counts as failed. A
+    failure on the first page raises BillQueryError carrying the raw
+    response (or the request's exception). A failure on a later page is
+    logged and ends the iteration, leaving the rows already yielded as a
+    partial result marked on args.incomplete, unless strict is set, in
+    which case it raises too. When prepare_checkpoint has set up a
+    checkpoint, args.resume_point follows the rows yielded so far, and
+    --resume continues at the saved row instead of args.start_row. With
+    --seek-key the keyset pager (iter_keyset_batches) is used instead of
+    StartRow, and with --split-columns the fields are fetched in parallel
+    column groups (iter_split_batches).
+    """
+    if sizer is None:
+        sizer = PageSizer.from_args(args)
+    if getattr(args, 'split_columns', 0) > 0:
+        if getattr(args, 'seek_key', ''):
+            raise RuntimeError("--split-columns 和 --seek-key 不能同时使用")
+        yield from iter_split_batches(client, form_id, args, sizer, strict)
+        return
+    if getattr(args, 'seek_key', ''):
+        yield from iter_keyset_batches(client, form_id, args, sizer, strict)
+        return
+
+    workers = max(1, getattr(args, 'workers', 1))
+    fetched = 0
+    start_row = args.start_row
+    checkpoint: Optional[Checkpoint] = getattr(args, 'checkpoint_store', None)
+    resume_from = getattr(args, 'resume_from', None)
+    written = 0
+    if resume_from:
+        start_row = resume_from["next_row"]
+        written = resume_from["rows"]
+    key_index = _resume_key(args)[1] if checkpoint is not None else -1
+
+    logger.info(
+        f"Fetching all records for {form_id} with filter: {args.filter_string} "
+        f"(workers: {workers}, page size: {sizer.size}{', adaptive' if sizer.adaptive else ''})"
+    )
+
+    if resume_from:
+        checkpoint.claim()
+    retries = RetryPolicy.from_args(args).retries
+    pages = _iter_page_responses(client, form_id, args, start_row, sizer, workers)
+    try:
+        while True:
+            try:
+                page = next(pages)
+            except Exception as e:
+                # Retries are used up (network error or HTTP error status)
+                if strict or not fetched:
+                    raise
+                logger.error(f"Page at StartRow={start_row} failed after {retries} retries: {e}")
+                _mark_incomplete(args, f"rows of {form_id} from StartRow={start_row} were not fetched")
+                break
+
+            batch_result = _decode_rows(page.response, first=strict or not fetched)
+            if batch_result is None:
+                _mark_incomplete(args, f"rows of {form_id} from StartRow={page.start_row} were not fetched")
+                break
+            if not batch_result:
+                break
+
+            nbytes = _page_bytes(page.response)
+            sizer.observe(page.limit, len(batch_result), page.seconds, nbytes)
+            METRICS.record("page", page.seconds, rows=len(batch_result), nbytes=nbytes, start_row=page.start_row, limit=page.limit)
+            start_row = page.start_row + len(batch_result)
+            fetched += len(batch_result)
+            if checkpoint is not None:
+                last_row = batch_result[-1]
+                args.resume_point = {
+                    "next_row": start_row,
+                    "rows": written + fetched,
+                    "last_key": last_row[key_index] if key_index >= 0 and isinstance(last_row, list) else None,
+                }
+            logger.info(
+                f"Fetched {fetched} records so far... "
+                f"(StartRow={page.start_row}, Limit={page.limit}, {page.seconds:.2f}s, {nbytes / 1024:.0f} KB)"
+            )
+            yield batch_result
+
+            if len(batch_result) < page.limit:
+                break
+    finally:
+        pages.close()
+        if resume_from:
+            checkpoint.release()
+
+    logger.info(f"Total records fetched: {fetched}")
+
+
+# Order fields taken to be unique per row: FID on header queries, the entry id on entry queries
+UNIQUE_KEY_SUFFIXES = ("FID", "ENTRYID", "DETAILID")
+
+
+def has_unique_order(order_string: str) -> bool:
+    """Whether an OrderString sorts by a key that makes the row order stable between runs."""
+    fields = [part.split()[0].upper() for part in (order_string or "").split(",") if part.split()]
+    return any(f.endswith(UNIQUE_KEY_SUFFIXES) for f in fields)
+
+
+def unique_order_field(fields: List[str]) -> str:
+    """The field of `fields` most likely unique per row: a detail id, then an entry id, then FID; "" if none."""
+    for suffix in reversed(UNIQUE_KEY_SUFFIXES):
+        for field in fields:
+            if field.upper().endswith(suffix):
+                return field
+    return ""
+
+
+def prepare_checkpoint(client: K3CloudClient, form_id: str, args: argparse.Namespace) -> None:
+    """
+    Set up the resume point of a StartRow-paginated export before it starts.
+
+    Checkpointing is on by default when the OrderString sorts by a unique
+    key and the output can be appended to (CSV, JSONL, non-streamed Excel);
+    --no-checkpoint turns it off and --checkpoint requires it. The
+    Checkpoint goes to args.checkpoint_store. With --resume the saved point
+    is checked against the output and the server and put on
+    args.resume_from, for the pager to continue from and the export to
+    append to.
+    """
+    args.checkpoint_store = None
+    args.resume_from = None
+    resume = getattr(args, 'resume', False)
+    required = resume or getattr(args, 'checkpoint', False)
+    if getattr(args, 'no_checkpoint', False):
+        if required:
+            raise RuntimeError("--checkpoint / --resume 和 --no-checkpoint 不能同时使用")
+        return
+    unsupported = _checkpoint_unsupported(args)
+    if unsupported:
+        if required:
+            raise RuntimeError(f"--checkpoint / --resume 不可用: {unsupported}")
+        return
+
+    path = getattr(args, 'checkpoint_db', '') or DEFAULT_CHECKPOINT_FILE
+    checkpoint = Checkpoint(path, run_key(client.config, form_id, args), form_id)
+    try:
+        purged = checkpoint.purge()
+        state = checkpoint.load() if resume else None
+    except sqlite3.Error as e:
+        if required:
+            raise RuntimeError(f"无法读取检查点 {path}: {e}") from e
+        logger.warning(f"Exporting {form_id} without a checkpoint: {e}")
+        return
+    if purged:
+        logger.info(f"Purged {purged} stale checkpoints from {path}")
+    args.checkpoint_store = checkpoint
+    if not resume:
+        return
+    if state is None:
+        logger.info(f"No checkpoint to resume for {form_id}; starting at StartRow={args.start_row}")
+        return
+    _check_resume_point(client, form_id, args, state)
+    logger.info(
+        f"Resuming {form_id} from the checkpoint of {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(state['updated_at']))}: "
+        f"{state['rows']} rows already in {state['output']}, continuing at StartRow={state['next_row']}"
+    )
+    args.resume_from = state
+
+
+def _checkpoint_unsupported(args: argparse.Namespace) -> str:
+    """Why this export cannot be checkpointed, or "" if it can."""
+    if getattr(args, 'split_columns', 0) > 0 or getattr(args, 'seek_key', ''):
+        return "只支持 StartRow 分页，不能与 --seek-key / --split-columns 同时使用"
+    order_string = getattr(args, 'order_string', '')
+    if not has_unique_order(order_string):
+        return (
+            f"需要按唯一键排序的 --order-string（如 FID 或分录内码 FEntity_FEntryID），"
+            f"否则两次运行的分页不一致: {order_string or '(未指定)'}"
+        )
+    output_format = getattr(args, 'output_format', 'excel')
+    if output_format in ('parquet', 'feather'):
+        return f"{output_format} 文件不能追加写入"
+    if output_format == 'excel' and getattr(args, 'stream', False):
+        return "流式 Excel 输出不能追加写入"
+    return ""
+
+
+def _resume_key(args: argparse.Namespace) -> Tuple[str, int]:
+    """The unique order field that is also fetched, and its column; ("", -1) if there is none."""
+    columns = [f.upper() for f in split_fields(args.field_keys)]
+    for part in (getattr(args, 'order_string', '') or "").split(","):
+        if not part.split():
+            continue
+        field = part.split()[0]
+        if field.upper().endswith(UNIQUE_KEY_SUFFIXES) and field.upper() in columns:
+            return field, columns.index(field.upper())
+    return "", -1
+
+
+def _check_resume_point(client: K3CloudClient, form_id: str, args: argparse.Namespace, state: Dict[str, Any]) -> None:
+    """Refuse a resume whose output was changed or whose rows have shifted on the server since."""
+    output_format = getattr(args, 'output_format', 'excel')
+    if state["output_format"] != output_format:
+        raise RuntimeError(f"检查点的输出格式是 {state['output_format']}，不能以 {output_format} 续传")
+    output = getattr(args, 'output', '')
+    if output and output_format != 'excel' and os.path.abspath(output) != os.path.abspath(state["output"]):
+        raise RuntimeError(f"--resume 会追加到上次的输出文件 {state['output']}，不能改为 {output}")
+    if not os.path.exists(state["output"]) or os.path.getsize(state["output"]) < state["output_bytes"]:
+        raise RuntimeError(f"上次的输出文件已被删除或截短，无法续传: {state['output']}")
+
+    field, index = _resume_key(args)
+    if index < 0 or state["last_key"] is None or state["next_row"] <= args.start_row:
+        return
+    data = build_query_data(form_id, args, state["next_row"] - 1, 1)
+    rows = _decode_rows(client.bill_query(data, use_cache=False), first=True)
+    if not rows or rows[0][index] != state["last_key"]:
+        raise RuntimeError(
+            f"StartRow={state['next_row'] - 1} 的 {field} 已不是检查点记录的 {state['last_key']}"
+            f"（两次运行之间有单据增删），无法续传，请重新完整导出"
+        )
+
+
+def _mark_incomplete(args: argparse.Namespace, reason: str) -> None:
+    """Record on args that the result is missing rows, for the export to flag."""
+    args.incomplete = reason
+
+
+def split_fields(value: str) -> List[str]:
+    return [k.strip() for k in (value or "").split(",") if k.strip()]
+
+
+def format_filter_value(value: Any) -> str:
+    if value is None:
+        raise RuntimeError("分页键的值不能为空")
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def and_filters(*filters: str) -> str:
+    parts = [f for f in filters if f]
+    if len(parts) <= 1:
+        return parts[0] if parts else ""
+    return " AND ".join(f"({f})" for f in parts)
+
+
+def _seek_predicate(fields: List[str], values: Tuple[Any, ...], inclusive: bool) -> str:
+    """Lexicographic (fields) > values, or >= when inclusive."""
+    clauses = []
+    for i, field in enumerate(fields):
+        last = i == len(fields) - 1
+        op = ">=" if (last and inclusive) else ">"
+        equal = [f"{fields[j]} = {format_filter_value(values[j])}" for j in range(i)]
+        clauses.append(" AND ".join(equal + [f"{field} {op} {format_filter_value(values[i])}"]))
+    if len(clauses) == 1:
+        return clauses[0]
+    return " OR ".join(f"({c})" for c in clauses)
+
+
+def _equal_predicate(fields: List[str], values: Tuple[Any, ...]) -> str:
+    return " AND ".join(f"{f} = {format_filter_value(v)}" for f, v in zip(fields, values))
+
+
+def iter_keyset_batches(
+    client: K3CloudClient,
+    form_id: str,
+    args: argparse.Namespace,
+    sizer: Optional[PageSizer] = None,
+    strict: bool = False,
+) -> Iterator[List[Any]]:
+    """
+    Paginate by seeking on --seek-key instead of growing StartRow offsets.
+
+    Rows are ordered by the key fields and each page asks for keys after the
+    last one seen, so the server never scans and discards earlier rows. The
+    key need not be unique (e.g. FID on an entry-level query): the rows that
+    share the last key of a full page are held back and re-read at the start
+    of the next page (">=" instead of ">"), and a key group larger than a
+    whole page is drained with StartRow paging on "key = value", ordered by
+    a unique tie-break field (unique_order_field of --order-string, else of
+    --field-keys) so its pages do not overlap. A key that does not look
+    unique itself needs such a field. Failures are handled as in
+    iter_bill_query_batches.
+    """
+    if sizer is None:
+        sizer = PageSizer.from_args(args)
+    key_fields = split_fields(args.seek_key)
+    columns = split_fields(args.field_keys)
+
+    # Key fields must be selected to read them; extra ones are stripped again
+    lowered = [c.lower() for c in columns]
+    query_fields = list(columns)
+    for field in key_fields:
+        if field.lower() not in lowered:
+            query_fields.append(field)
+            lowered.append(field.lower())
+    key_index = [lowered.index(f.lower()) for f in key_fields]
+    width = len(columns)
+    strip = len(query_fields) > width
+
+    order_string = getattr(args, 'order_string', '')
+    keys = {k.lower() for k in key_fields}
+    ordered = [part.split()[0] for part in order_string.split(",") if part.split()]
+    tiebreak = unique_order_field([f for f in ordered + columns if f.lower() not in keys])
+    if not tiebreak and not has_unique_order(args.seek_key):
+        raise RuntimeError(
+            f"--seek-key {args.seek_key} 不是唯一键时，需要在 --order-string 或 --field-keys 中提供唯一字段"
+            "（如 FID 或分录内码 FEntity_FEntryID），用于同一键值的行超过一页时稳定分页"
+        )
+
+    if getattr(args, 'workers', 1) > 1:
+        logger.warning("--workers is ignored with --seek-key: each page depends on the previous one")
+    if order_string:
+        logger.warning(f"--order-string is replaced by the seek key order: {args.seek_key}")
+
+    query_args = argparse.Namespace(**vars(args))
+    query_args.field_keys = ",".join(query_fields)
+    key_order = ",".join(f"{k} ASC" for k in key_fields)
+    query_args.top_row_count = 0
+    retry = RetryPolicy.from_args(args)
+
+    # Offset paging within one key needs a total order, or its pages may skip and repeat rows
+    drain_order = key_order + (f",{tiebreak} ASC" if tiebreak else "")
+
+    def fetch(filter_string: str, order: str, start_row: int, where: str) -> Optional[PageResponse]:
+        """One page, or None once it failed after its retries and a partial result is allowed."""
+        query_args.filter_string = and_filters(args.filter_string, filter_string)
+        query_args.order_string = order
+        try:
+            return _timed_bill_query(client, build_query_data(form_id, query_args, start_row, sizer.size), retry)
+        except Exception as e:
+            # Retries are used up (network error or HTTP error status)
+            if strict or not fetched:
+                raise
+            logger.error(f"Page of {form_id} {where} failed after {retry.retries} retries: {e}")
+            return None
+
+    def key_of(row: List[Any]) -> Tuple[Any, ...]:
+        return tuple(row[i] for i in key_index)
+
+    def output(rows: List[Any]) -> List[Any]:
+        return [row[:width] for row in rows] if strip else rows
+
+    logger.info(
+        f"Fetching all records for {form_id} with filter: {args.filter_string} "
+        f"(seek key: {args.seek_key}, page size: {sizer.size}{', adaptive' if sizer.adaptive else ''})"
+    )
+
+    fetched = 0
+    last: Optional[Tuple[Any, ...]] = None
+    inclusive = False
+    while True:
+        predicate = _seek_predicate(key_fields, last, inclusive) if last is not None else ""
+        where = f"after {args.seek_key}={last}" if last is not None else "from the start"
+        page = fetch(predicate, key_order, 0, where)
+        rows = _decode_rows(page.response, first=strict or not fetched) if page is not None else None
+        if rows is None:
+            _mark_incomplete(args, f"rows of {form_id} {where} were not fetched")
+            break
+        if not rows:
+            break
+        nbytes = _page_bytes(page.response)
+        sizer.observe(page.limit, len(rows), page.seconds, nbytes)
+        METRICS.record("page", page.seconds, rows=len(rows), nbytes=nbytes, limit=page.limit)
+
+        if len(rows) < page.limit:
+            fetched += len(rows)
+            yield output(rows)
+            break
+
+        tail = key_of(rows[-1])
+        cut = len(rows)
+        while cut > 0 and key_of(rows[cut - 1]) == tail:
+            cut -= 1
+
+        if cut == 0:
+            # One key spans the whole page: drain that group by offset
+            start_row = 0
+            while True:
+                where = f"at {args.seek_key}={tail} StartRow={start_row}"
+                group_page = fetch(_equal_predicate(key_fields, tail), drain_order, start_row, where)
+                group_rows = _decode_rows(group_page.response, first=strict or not fetched) if group_page is not None else None
+                if group_rows is None:
+                    _mark_incomplete(args, f"rows of {form_id} from {args.seek_key}={tail} were not fetched")
+                    logger.info(f"Total records fetched: {fetched}")
+                    return
+                METRICS.record("page", group_page.seconds, rows=len(group_rows), nbytes=_page_bytes(group_page.response), start_row=start_row, limit=group_page.limit)
+                if group_rows:
+                    fetched += len(group_rows)
+                    yield output(group_rows)
+                if len(group_rows) < group_page.limit:
+                    break
+                start_row += group_page.limit
+            last, inclusive = tail, False
+        else:
+            fetched += cut
+            yield output(rows[:cut])
+            last, inclusive = tail, True
+
+        logger.info(
+            f"Fetched {fetched} records so far... "
+            f"(after {args.seek_key}={last}, Limit={page.limit}, {page.seconds:.2f}s, {nbytes / 1024:.0f} KB)"
+        )
+
+    logger.info(f"Total records fetched: {fetched}")
+
+
+def column_groups(columns: List[str], key_fields: List[str], size: int) -> List[List[str]]:
+    """
+    Split the non-key columns into groups of at most `size` fields, each
+    led by the key fields so its rows can be joined back by key.
+    """
+    keys = {k.lower() for k in key_fields}
+    rest = [c for c in columns if c.lower() not in keys]
+    if not rest:
+        return [list(key_fields)]
+    return [list(key_fields) + rest[i:i + size] for i in range(0, len(rest), size)]
+
+
+def _iter_split_pages(
+    client: K3CloudClient,
+    form_id: str,
+    queries: List[argparse.Namespace],
+    start_row: int,
+    sizer: PageSizer,
+    workers: int,
+) -> Iterator[List[PageResponse]]:
+    """
+    Yield, page by page, the responses of every column group for the same
+    StartRow/Limit window. All groups of a page are requested at once and up
+    to `workers` pages are kept in flight, as in _iter_page_responses.
+    """
+    executor = ContextThreadPoolExecutor(max_workers=len(queries) * workers)
+    pending = deque()
+    retry = RetryPolicy.from_args(queries[0])
+
+    def submit() -> None:
+        nonlocal start_row
+        logger.debug(f"Requesting {form_id} StartRow={start_row} Limit={sizer.size} in {len(queries)} column groups")
+        pending.append([
+            executor.submit(_timed_bill_query, client, build_query_data(form_id, q, start_row, sizer.size), retry)
+            for q in queries
+        ])
+        start_row += sizer.size
+
+    try:
+        for _ in range(workers):
+            submit()
+        while pending:
+            yield [future.result() for future in pending.popleft()]
+            submit()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def iter_split_batches(
+    client: K3CloudClient,
+    form_id: str,
+    args: argparse.Namespace,
+    sizer: Optional[PageSizer] = None,
+    strict: bool = False,
+) -> Iterator[List[Any]]:
+    """
+    Fetch a wide --field-keys list as several narrow queries run in parallel.
+
+    The fields are split into groups of --split-columns, each also selecting
+    the --split-key fields, and every group is paged over the same filter
+    ordered by the key, so page N of each group covers the same rows. Rows
+    are joined back by key into the original column order; a row missing
+    from some group (the data changed between the queries) waits for the
+    next page and is output with empty values in the end. The key must be
+    unique: a group returning the same key twice raises, as rows could no
+    longer be told apart. Failures are handled as in iter_bill_query_batches
+    (error responses and requests failing after --retries alike); rows that
+    only some groups delivered before a failure are left out of the partial
+    result.
+    """
+    if sizer is None:
+        sizer = PageSizer.from_args(args)
+    key_fields = split_fields(args.split_key)
+    if not key_fields:
+        raise RuntimeError("--split-columns 需要 --split-key")
+    columns = split_fields(args.field_keys)
+    groups = column_groups(columns, key_fields, max(1, args.split_columns))
+    if len(groups) == 1:
+        logger.info(f"{len(columns)} fields fit in one column group; fetching them in one query")
+        query_args = argparse.Namespace(**vars(args))
+        query_args.split_columns = 0
+        yield from iter_bill_query_batches(client, form_id, query_args, sizer, strict)
+        return
+
+    # Where each output column is read from: (group, position in the group
+    # row); key fields lead every group, so any group that has the row will do
+    width = len(key_fields)
+    source: Dict[str, Tuple[Optional[int], int]] = {k.lower(): (None, i) for i, k in enumerate(key_fields)}
+    for g, fields in enumerate(groups):
+        for i, field in enumerate(fields[width:], width):
+            source[field.lower()] = (g, i)
+    layout = [source[c.lower()] for c in columns]
+
+    # The key breaks ties in the user's order, so every group sees the same row sequence
+    order = ", ".join(filter(None, [getattr(args, 'order_string', ''), ",".join(f"{k} ASC" for k in key_fields)]))
+    queries = []
+    for fields in groups:
+        query_args = argparse.Namespace(**vars(args))
+        query_args.field_keys = ",".join(fields)
+        query_args.order_string = order
+        queries.append(query_args)
+
+    workers = max(1, getattr(args, 'workers', 1))
+    logger.info(
+        f"Fetching all records for {form_id} with filter: {args.filter_string} "
+        f"({len(columns)} fields in {len(groups)} column groups keyed by {args.split_key}, "
+        f"workers: {workers}, page size: {sizer.size})"
+    )
+
+    # key -> one row (or None) per group, until every group has delivered it
+    waiting: Dict[Tuple[Any, ...], List[Optional[List[Any]]]] = {}
+    # Keys already output, to catch a key repeated on a later page
+    stitched: Set[Tuple[Any, ...]] = set()
+    fetched = 0
+    failed = False
+
+    def stitch(parts: List[Optional[List[Any]]]) -> List[Any]:
+        present = next(p for p in parts if p is not None)
+        return [
+            present[i] if g is None else (parts[g][i] if parts[g] is not None else None)
+            for g, i in layout
+        ]
+
+    start_row = args.start_row
+    retries = RetryPolicy.from_args(args).retries
+    pages = _iter_split_pages(client, form_id, queries, start_row, sizer, workers)
+    try:
+        while True:
+            try:
+                group_pages = next(pages)
+            except Exception as e:
+                # Retries are used up (network error or HTTP error status)
+                if strict or not fetched:
+                    raise
+                logger.error(f"Page at StartRow={start_row} failed after {retries} retries: {e}")
+                failed = True
+                _mark_incomplete(args, f"rows of {form_id} from StartRow={start_row} were not fetched")
+                break
+
+            batches = [_decode_rows(page.response, first=strict or not fetched) for page in group_pages]
+            if any(batch is None for batch in batches):
+                failed = True
+                _mark_incomplete(args, f"rows of {form_id} from StartRow={group_pages[0].start_row} were not fetched")
+                break
+            if not any(batches):
+                break
+
+            seconds = max(page.seconds for page in group_pages)
+            nbytes = sum(_page_bytes(page.response) for page in group_pages)
+            longest = max(len(batch) for batch in batches)
+            limit = group_pages[0].limit
+            sizer.observe(limit, longest, seconds, nbytes)
+            METRICS.record("page", seconds, rows=longest, nbytes=nbytes, start_row=group_pages[0].start_row, limit=limit)
+
+            complete = []
+            for g, batch in enumerate(batches):
+                for row in batch:
+                    key = tuple(row[:width])
+                    parts = waiting.get(key)
+                    if parts is None and key not in stitched:
+                        parts = waiting[key] = [None] * len(groups)
+                    if parts is None or parts[g] is not None:
+                        raise RuntimeError(
+                            f"--split-key {args.split_key} 不唯一（或查询期间数据发生变化）: {list(key)} 出现多次，"
+                            "无法按行键拼接各列组；请使用分录内码等唯一键，或去掉 --split-columns"
+                        )
+                    parts[g] = row
+                    if all(p is not None for p in parts):
+                        complete.append(stitch(waiting.pop(key)))
+                        stitched.add(key)
+
+            fetched += len(complete)
+            logger.info(
+                f"Fetched {fetched} records so far... "
+                f"(StartRow={group_pages[0].start_row}, Limit={limit}, {len(groups)} groups, {seconds:.2f}s, {nbytes / 1024:.0f} KB)"
+            )
+            if complete:
+                yield complete
+
+            start_row = group_pages[0].start_row + limit
+            if longest < limit:
+                break
+    finally:
+        pages.close()
+
+    if waiting and failed:
+        # Part of the range that failed, not rows that changed: leave them to the rerun
+        logger.error(f"{len(waiting)} rows returned by only some column groups before the failure are not output")
+        _mark_incomplete(args, f"{args.incomplete}; {len(waiting)} rows fetched by only some column groups were dropped")
+    elif waiting:
+        logger.warning(
+            f"{len(waiting)} rows were not returned by every column group (changed while fetching?); "
+            "their missing columns are left empty"
+        )
+        fetched += len(waiting)
+        yield [stitch(parts) for parts in waiting.values()]
+
+    logger.info(f"Total records fetched: {fetched}")
@@ -0,0 +1,74 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+
+class RateLimiter:
+    """
+    Token bucket on request starts plus a cap on requests in flight, shared
+    by every thread that posts through one client.
+
+    rate is the sustained requests per second (0 for no limit) and burst
+    how many requests may start back to back after an idle period
+    (default: one second's worth). max_inflight bounds concurrent requests
+    (0 for no limit); a request holds its in-flight slot until the
+    response has been read.
+    """
+
+    def __init__(self, rate: float = 0, max_inflight: int = 0, burst: int = 0):
+        if rate < 0 or max_inflight < 0 or burst < 0:
+            raise RuntimeError("rate_limit / max_inflight 不能为负数")
+        self.rate = rate
+        self.max_inflight = max_inflight
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._inflight = threading.BoundedSemaphore(max_inflight) if max_inflight else None
+        self.requests = 0
+        self.wait_seconds = 0.0
+
+    @classmethod
+    def from_values(cls, rate: Optional[float], max_inflight: Optional[int]) -> Optional["RateLimiter"]:
+        if not rate and not max_inflight:
+            return None
+        return cls(rate or 0, max_inflight or 0)
+
+    def _take_token(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                delay = (1 - self._tokens) / self.rate
+            time.sleep(delay)
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        started = time.perf_counter()
+        # In-flight slot first, so queued requests do not burn tokens while they wait
+        if self._inflight is not None:
+            self._inflight.acquire()
+        try:
+            if self.rate > 0:
+                self._take_token()
+            waited = time.perf_counter() - started
+            with self._lock:
+                self.requests += 1
+                self.wait_seconds += waited
+            yield
+        finally:
+            if self._inflight is not None:
+                self._inflight.release()
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            return {"requests": self.requests, "wait_seconds": round(self.wait_seconds, 3)}
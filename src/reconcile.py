@@ -0,0 +1,207 @@
+import re
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from logger import get_logger
+import sync
+
+logger = get_logger(__name__)
+
+# How the lines of a source document are matched by the lines that fulfil it
+PRESETS: Dict[Tuple[str, str], Dict[str, str]] = {
+    ("sales-order", "sales-out"): {
+        "left_key": "FSaleOrderEntry_FEntryID",
+        "right_key": "FSOEntryId",
+        "qty": "FQty:FRealQty",
+        "amount": "FAmount:FAmount",
+    },
+    ("purchase-order", "purchase-in"): {
+        "left_key": "FPOOrderEntry_FEntryID",
+        "right_key": "FPOORDERENTRYID",
+        "qty": "FQty:FRealQty",
+        "amount": "FAmount:FAmount",
+    },
+}
+
+STATUSES = ("open", "partial", "fulfilled", "over", "unmatched")
+# unmatched needs RIGHT fetched on its own filter rather than on LEFT's keys
+DEFAULT_STATUSES = "open,partial,over"
+# LEFT keys per RIGHT query when RIGHT is restricted to them
+DEFAULT_KEY_BATCH = 500
+STATUS_COLUMN = "Status"
+RESULT_COLUMNS = ["MatchedRows", "MatchedQty", "QtyDiff", "MatchedAmount", "AmountDiff"]
+
+
+def parse_field_pair(value: str, option: str) -> Optional[Tuple[str, str]]:
+    """Parse "FQty:FRealQty" into (left, right); a single name is used on both sides."""
+    if not (value or "").strip():
+        return None
+    left, sep, right = value.partition(":")
+    left, right = left.strip(), (right.strip() if sep else left.strip())
+    if not left or not right:
+        raise RuntimeError(f"{option} 格式错误: {value} (如 FQty:FRealQty)")
+    return left, right
+
+
+def parse_statuses(value: str) -> List[str]:
+    statuses = [s.strip().lower() for s in (value or "").split(",") if s.strip()]
+    if statuses == ["all"]:
+        return list(STATUSES)
+    unknown = [s for s in statuses if s not in STATUSES]
+    if unknown or not statuses:
+        raise RuntimeError(f"--status 不支持: {', '.join(unknown) or value} (可选: {', '.join(STATUSES)} 或 all)")
+    return statuses
+
+
+def _key_value(value: Any) -> str:
+    # Entry ids come back as int on one form and float or text on another
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return "" if value is None else str(value).strip()
+
+
+def _number(value: Any, field: str) -> float:
+    if value is None or value == "":
+        return 0.0
+    try:
+        return float(value)
+    except (TypeError, ValueError) as e:
+        raise RuntimeError(f"字段 {field} 不是数值: {value!r}") from e
+
+
+def key_filters(field: str, values: Sequence[str], batch_size: int = DEFAULT_KEY_BATCH) -> Iterator[str]:
+    """'field IN (...)' filters covering values, batch_size values each; numbers are not quoted."""
+    numeric = all(re.fullmatch(r"-?\d+", v) for v in values)
+    literals = list(values) if numeric else ["'" + v.replace("'", "''") + "'" for v in values]
+    batch_size = max(1, batch_size)
+    for i in range(0, len(literals), batch_size):
+        yield f"{field} IN ({','.join(literals[i:i + batch_size])})"
+
+
+def _indexes(columns: Sequence[str], fields: Sequence[str]) -> List[int]:
+    lowered = [c.lower() for c in columns]
+    return [lowered.index(f.lower()) for f in fields]
+
+
+class Reconciliation:
+    """
+    Hash join of a source query (left, e.g. order lines) with the query
+    that fulfils it (right, e.g. delivery lines).
+
+    The left side is the build side: each key keeps its first row and the
+    summed quantity and amount, so memory grows with the left side and it
+    should be the smaller one (the source lines, not their fulfilments).
+    The right side is only probed, page by page, adding to the matching
+    entry, so it is never held in memory; right keys with no left row are
+    summed separately and reported as unmatched.
+    """
+
+    def __init__(
+        self,
+        columns: Sequence[str],
+        left_key: Sequence[str],
+        right_key: Sequence[str],
+        qty: Tuple[str, str],
+        amount: Optional[Tuple[str, str]] = None,
+    ):
+        if len(left_key) != len(right_key):
+            raise RuntimeError(f"--left-key 和 --right-key 的字段数不一致: {len(left_key)} / {len(right_key)}")
+        self.columns = list(columns)
+        self.left_key = list(left_key)
+        self.right_key = list(right_key)
+        self.qty = qty
+        self.amount = amount
+        self._left_key_index = _indexes(self.columns, self.left_key)
+        self._left_qty_index = _indexes(self.columns, [qty[0]])[0]
+        self._left_amount_index = _indexes(self.columns, [amount[0]])[0] if amount else None
+        # key -> [first row, left qty, left amount, matched rows, matched qty, matched amount]
+        self._lines: Dict[Tuple[str, ...], List[Any]] = {}
+        # key -> [key values, rows, qty, amount] for right rows with no left line
+        self._unmatched: Dict[Tuple[str, ...], List[Any]] = {}
+        self.left_rows = 0
+        self.right_rows = 0
+
+    def left_key_values(self) -> List[str]:
+        """Distinct values of the first key field over the left lines, to restrict the right query to."""
+        return sorted({key[0] for key in self._lines if key and key[0]})
+
+    @property
+    def right_fields(self) -> List[str]:
+        """The only fields the probe side needs."""
+        return sync._with_fields(self.right_key, [self.qty[1]] + ([self.amount[1]] if self.amount else []))
+
+    def build(self, batches: Iterable[List[List[Any]]]) -> None:
+        for batch in batches:
+            for row in batch:
+                key = tuple(_key_value(row[i]) for i in self._left_key_index)
+                qty = _number(row[self._left_qty_index], self.qty[0])
+                amount = _number(row[self._left_amount_index], self.amount[0]) if self.amount else 0.0
+                line = self._lines.get(key)
+                if line is None:
+                    self._lines[key] = [list(row), qty, amount, 0, 0.0, 0.0]
+                else:
+                    line[1] += qty
+                    line[2] += amount
+                self.left_rows += 1
+
+    def probe(self, batches: Iterable[List[List[Any]]], fields: Sequence[str]) -> None:
+        key_index = _indexes(fields, self.right_key)
+        qty_index = _indexes(fields, [self.qty[1]])[0]
+        amount_index = _indexes(fields, [self.amount[1]])[0] if self.amount else None
+        for batch in batches:
+            for row in batch:
+                key = tuple(_key_value(row[i]) for i in key_index)
+                qty = _number(row[qty_index], self.qty[1])
+                amount = _number(row[amount_index], self.amount[1]) if amount_index is not None else 0.0
+                line = self._lines.get(key)
+                if line is not None:
+                    line[3] += 1
+                    line[4] += qty
+                    line[5] += amount
+                else:
+                    unmatched = self._unmatched.get(key)
+                    if unmatched is None:
+                        self._unmatched[key] = [[row[i] for i in key_index], 1, qty, amount]
+                    else:
+                        unmatched[1] += 1
+                        unmatched[2] += qty
+                        unmatched[3] += amount
+                self.right_rows += 1
+
+    @staticmethod
+    def status(ordered: float, matched_rows: int, matched: float, tolerance: float) -> str:
+        diff = ordered - matched
+        if abs(diff) <= tolerance:
+            return "fulfilled"
+        if diff < 0:
+            return "over"
+        if matched_rows == 0 or abs(matched) <= tolerance:
+            return "open"
+        return "partial"
+
+    def report(self, statuses: Sequence[str], tolerance: float = 1e-6) -> Tuple[List[str], List[List[Any]], Dict[str, int]]:
+        """Output headers, rows whose status is in statuses, and the line count of every status."""
+        headers = [STATUS_COLUMN] + self.columns + RESULT_COLUMNS
+        wanted = set(statuses)
+        counts = {status: 0 for status in STATUSES}
+        rows: List[List[Any]] = []
+
+        for row, qty, amount, matched_rows, matched_qty, matched_amount in self._lines.values():
+            status = self.status(qty, matched_rows, matched_qty, tolerance)
+            counts[status] += 1
+            if status in wanted:
+                row[self._left_qty_index] = qty
+                if self._left_amount_index is not None:
+                    row[self._left_amount_index] = amount
+                amounts = [matched_amount, amount - matched_amount] if self.amount else [None, None]
+                rows.append([status] + row + [matched_rows, matched_qty, qty - matched_qty] + amounts)
+
+        for key_values, matched_rows, matched_qty, matched_amount in self._unmatched.values():
+            counts["unmatched"] += 1
+            if "unmatched" in wanted:
+                row: List[Any] = [None] * len(self.columns)
+                for i, value in zip(self._left_key_index, key_values):
+                    row[i] = value
+                amounts = [matched_amount, -matched_amount] if self.amount else [None, None]
+                rows.append(["unmatched"] + row + [matched_rows, matched_qty, -matched_qty] + amounts)
+
+        return headers, rows, counts
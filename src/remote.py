@@ -0,0 +1,79 @@
+"""
+Thin client for `main.py serve`: forwards a command line to the daemon and
+prints its log output. Only uses the standard library, so it starts fast.
+
+    python src/remote.py inventory --limit 10
+    python src/remote.py --socket /tmp/k3cloud.sock sales-order --limit 0 --stream
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import sys
+from typing import List, Optional
+from urllib.parse import urlparse
+
+TOKEN_HEADER = "X-K3Cloud-Token"
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path: str, timeout: Optional[float] = None):
+        super().__init__("localhost", timeout=timeout)
+        self._socket_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self._socket_path)
+
+
+def _connection(args: argparse.Namespace) -> http.client.HTTPConnection:
+    if args.socket:
+        return UnixHTTPConnection(args.socket, timeout=args.timeout)
+    url = urlparse(args.server if "://" in args.server else "http://" + args.server)
+    return http.client.HTTPConnection(url.hostname or "127.0.0.1", url.port or 80, timeout=args.timeout)
+
+
+def forward(args: argparse.Namespace, argv: List[str]) -> int:
+    conn = _connection(args)
+    headers = {"Content-Type": "application/json"}
+    if args.token:
+        headers[TOKEN_HEADER] = args.token
+    try:
+        conn.request("POST", "/run", body=json.dumps({"argv": argv}), headers=headers)
+        response = conn.getresponse()
+        body = json.loads(response.read() or b"{}")
+    except (OSError, ValueError) as e:
+        print(f"无法连接 K3Cloud 服务: {e}", file=sys.stderr)
+        return 1
+    finally:
+        conn.close()
+
+    if response.status != 200:
+        print(f"服务返回错误 ({response.status}): {body.get('error', body)}", file=sys.stderr)
+        return 1
+
+    for line in body.get("log", []):
+        print(line)
+    if body.get("output"):
+        print(body["output"], end="")
+    return int(body.get("exit_code", 1))
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="k3cloud-remote", description="Forward a k3cloud command to a running `main.py serve`")
+    parser.add_argument("--server", default=os.getenv("K3CLOUD_SERVER") or "127.0.0.1:8765", help="Daemon HTTP address")
+    parser.add_argument("--socket", default=os.getenv("K3CLOUD_SOCKET") or "", help="Daemon Unix socket path (instead of --server)")
+    parser.add_argument("--token", default=os.getenv("K3CLOUD_SERVE_TOKEN") or "", help="Shared secret configured on the daemon")
+    parser.add_argument("--timeout", type=float, default=3600, help="Seconds to wait for the command to finish")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="Command and its arguments, as for main.py")
+    args = parser.parse_args(argv)
+    if not args.command:
+        parser.error("缺少要转发的命令")
+    return forward(args, args.command)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
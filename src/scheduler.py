@@ -0,0 +1,290 @@
+import argparse
+import json
+import os
+import re
+import shlex
+import signal
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Sequence, Tuple, Type
+
+from cli import CommandLineExit, StrictArgumentParser
+from client import K3CloudClient
+from logger import get_logger
+from ratelimit import RateLimiter
+import server
+
+logger = get_logger(__name__)
+
+DEFAULT_HISTORY_FILE = os.path.join("data", "schedule.db")
+
+_INTERVAL_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def add_schedule_parser(subparsers) -> argparse.ArgumentParser:
+    parser_schedule = subparsers.add_parser("schedule", help="定时任务：按间隔和优先级运行任务文件中的命令，并全局限制请求速率")
+    parser_schedule.add_argument("jobs_file", help="JSON file listing the jobs (name, command, interval, priority)")
+    parser_schedule.add_argument("--workers", type=int, default=2, help="Number of jobs run at the same time")
+    parser_schedule.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Requests per second started across all jobs (default: rate_limit in config, 0 for no limit)",
+    )
+    parser_schedule.add_argument(
+        "--max-inflight",
+        type=int,
+        default=None,
+        help="Requests in flight across all jobs (default: max_inflight in config, 0 for no limit)",
+    )
+    parser_schedule.add_argument("--history", default="", help=f"SQLite file for the job latency history (default: {DEFAULT_HISTORY_FILE})")
+    parser_schedule.add_argument("--once", action="store_true", help="Run every job once, by priority, then exit")
+    parser_schedule.add_argument("--report", action="store_true", help="Log the latency history of each job and exit")
+    return parser_schedule
+
+
+def parse_interval(value: Any) -> float:
+    """Seconds from 300, "300", "90s", "15m", "1h" or "1d"."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        seconds = float(value)
+    else:
+        match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*", str(value or ""), re.IGNORECASE)
+        if not match:
+            raise RuntimeError(f"任务间隔格式错误: {value} (如 300、15m、1h)")
+        seconds = float(match.group(1)) * _INTERVAL_UNITS[(match.group(2) or "s").lower()]
+    if seconds <= 0:
+        raise RuntimeError(f"任务间隔必须大于 0: {value}")
+    return seconds
+
+
+@dataclass
+class Job:
+    name: str
+    argv: List[str]
+    interval: float
+    priority: int = 0
+    next_run: float = 0.0
+
+
+def load_jobs(path: str) -> List[Job]:
+    """
+    Read a jobs file: {"jobs": [{"name", "command", "interval", "priority"}, ...]}
+    (or the bare list). command is a subcommand line as given to main.py.
+    """
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except FileNotFoundError as e:
+        raise RuntimeError(f"任务文件未找到: {path}") from e
+    except json.JSONDecodeError as e:
+        raise RuntimeError(f"任务文件不是合法的 JSON: {e}") from e
+
+    entries = data.get("jobs") if isinstance(data, dict) else data
+    if not isinstance(entries, list) or not entries:
+        raise RuntimeError("任务文件需要包含非空的 jobs 列表")
+
+    jobs: List[Job] = []
+    for i, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not entry.get("command"):
+            raise RuntimeError(f"第 {i + 1} 个任务缺少 command")
+        command = entry["command"]
+        argv = shlex.split(command) if isinstance(command, str) else [str(a) for a in command]
+        name = str(entry.get("name") or f"{argv[0]}#{i + 1}")
+        try:
+            priority = int(entry.get("priority", 0))
+        except (TypeError, ValueError) as e:
+            raise RuntimeError(f"任务 {name} 的 priority 必须是整数") from e
+        jobs.append(Job(name, argv, parse_interval(entry.get("interval", "1h")), priority))
+
+    names = [job.name for job in jobs]
+    duplicates = sorted({n for n in names if names.count(n) > 1})
+    if duplicates:
+        raise RuntimeError(f"任务名称重复: {', '.join(duplicates)}")
+    return jobs
+
+
+class JobHistory:
+    """Duration and exit code of every job run, in SQLite."""
+
+    def __init__(self, path: str):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_runs ("
+            "job TEXT NOT NULL, started_at REAL NOT NULL, seconds REAL NOT NULL, exit_code INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS job_runs_job ON job_runs (job, started_at)")
+        self._conn.commit()
+
+    def record(self, job: str, started_at: float, seconds: float, exit_code: int) -> None:
+        self._conn.execute(
+            "INSERT INTO job_runs (job, started_at, seconds, exit_code) VALUES (?, ?, ?, ?)",
+            (job, started_at, seconds, exit_code),
+        )
+        self._conn.commit()
+
+    def summary(self) -> List[Dict[str, Any]]:
+        runs: Dict[str, List[Tuple[float, float, int]]] = {}
+        for job, started_at, seconds, exit_code in self._conn.execute(
+            "SELECT job, started_at, seconds, exit_code FROM job_runs ORDER BY job, started_at"
+        ):
+            runs.setdefault(job, []).append((started_at, seconds, exit_code))
+
+        result = []
+        for job, entries in runs.items():
+            durations = sorted(seconds for _, seconds, _ in entries)
+            result.append({
+                "job": job,
+                "runs": len(entries),
+                "failures": sum(1 for _, _, code in entries if code != 0),
+                "p50": _percentile(durations, 0.5),
+                "p95": _percentile(durations, 0.95),
+                "max": durations[-1],
+                "last": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entries[-1][0])),
+            })
+        return result
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def _percentile(sorted_values: Sequence[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def format_summary(rows: List[Dict[str, Any]]) -> str:
+    lines = [f"{'job':<28}{'runs':>6}{'failed':>8}{'p50 s':>10}{'p95 s':>10}{'max s':>10}  last run"]
+    for row in rows:
+        lines.append(
+            f"{row['job']:<28}{row['runs']:>6}{row['failures']:>8}"
+            f"{row['p50']:>10.2f}{row['p95']:>10.2f}{row['max']:>10.2f}  {row['last']}"
+        )
+    return "\n".join(lines)
+
+
+def _validate(
+    jobs: List[Job],
+    build_parser: Callable[[Type[argparse.ArgumentParser]], argparse.ArgumentParser],
+    global_argv: List[str],
+) -> None:
+    """Parse every job's command up front, so a typo fails at start-up rather than at 3 a.m."""
+    for job in jobs:
+        if job.argv[0] in ("schedule", "serve"):
+            raise RuntimeError(f"任务 {job.name} 不能运行 {job.argv[0]}")
+        try:
+            build_parser(StrictArgumentParser).parse_args(global_argv + job.argv)
+        except CommandLineExit as e:
+            if e.status == 0:
+                raise RuntimeError(f"任务 {job.name} 不能使用 --help") from e
+            raise RuntimeError(f"任务 {job.name} 参数错误: {e.message}") from e
+
+
+def schedule(
+    client: K3CloudClient,
+    args: argparse.Namespace,
+    build_parser: Callable[[Type[argparse.ArgumentParser]], argparse.ArgumentParser],
+    run_command: Callable[[K3CloudClient, argparse.Namespace], int],
+) -> int:
+    """
+    Run the jobs of args.jobs_file on a pool of args.workers threads.
+
+    A job becomes due every `interval` seconds after its last start and
+    never overlaps itself; when more jobs are due than workers are free,
+    higher priority goes first. Every request of every job passes one
+    shared RateLimiter, so together they stay within --rate requests/s and
+    --max-inflight concurrent requests.
+    """
+    history = JobHistory(args.history or DEFAULT_HISTORY_FILE)
+    if args.report:
+        try:
+            logger.info("Job history:\n" + format_summary(history.summary()))
+        finally:
+            history.close()
+        return 0
+
+    global_argv = server.global_argv(args)
+    jobs = load_jobs(args.jobs_file)
+    _validate(jobs, build_parser, global_argv)
+
+    cfg = client.config
+    rate = cfg.rate_limit if args.rate is None else args.rate
+    max_inflight = cfg.max_inflight if args.max_inflight is None else args.max_inflight
+    limiter = RateLimiter.from_values(rate, max_inflight)
+    # Jobs share one client, so the limiter covers all of their requests
+    job_client = K3CloudClient(cfg, cache=client.cache, rate_limiter=limiter)
+    workers = max(1, args.workers)
+    service = server.QueryService(job_client, build_parser, run_command, global_argv, workers)
+
+    stop = threading.Event()
+    try:
+        signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    except ValueError:
+        # Not in the main thread
+        pass
+
+    logger.info(
+        f"Scheduling {len(jobs)} jobs (workers: {workers}, rate: {rate or 'unlimited'}/s, "
+        f"max in flight: {max_inflight or 'unlimited'})"
+    )
+    running: Dict[str, Tuple[Job, float, Future]] = {}
+    ran: Dict[str, int] = {}
+    failed = False
+    pool = ThreadPoolExecutor(max_workers=workers)
+
+    def finish(name: str) -> int:
+        job, started_at, future = running.pop(name)
+        try:
+            result = future.result()
+            exit_code, seconds = result["exit_code"], result["seconds"]
+        except (Exception, SystemExit) as e:
+            # SystemExit too: one job must not stop the scheduler
+            logger.error(f"Job {name} crashed: {e!r}")
+            exit_code, seconds = 1, time.time() - started_at
+        history.record(name, started_at, seconds, exit_code)
+        logger.info(f"Job {name} finished in {seconds:.2f}s (exit code {exit_code}); next run in {max(0, job.next_run - time.time()):.0f}s")
+        return exit_code
+
+    try:
+        while True:
+            for name, (_, _, future) in list(running.items()):
+                if future.done():
+                    failed = finish(name) != 0 or failed
+
+            if stop.is_set() or (args.once and len(ran) == len(jobs)):
+                if not running:
+                    break
+            else:
+                now = time.time()
+                due = [j for j in jobs if j.name not in running and j.next_run <= now and not (args.once and j.name in ran)]
+                due.sort(key=lambda j: (-j.priority, j.next_run))
+                for job in due[: workers - len(running)]:
+                    job.next_run = now + job.interval
+                    ran[job.name] = ran.get(job.name, 0) + 1
+                    logger.info(f"Starting job {job.name} (priority {job.priority}): {shlex.join(job.argv)}")
+                    running[job.name] = (job, now, pool.submit(service.run, job.argv))
+            stop.wait(0.2)
+    except KeyboardInterrupt:
+        logger.info("Shutting down; waiting for running jobs")
+        for name, (_, _, future) in list(running.items()):
+            if future.cancel():
+                # Never started: nothing to record
+                del running[name]
+        for name in list(running):
+            finish(name)
+    finally:
+        pool.shutdown(wait=True)
+        service.close()
+        job_client.close()
+        if limiter is not None:
+            stats = limiter.stats()
+            logger.info(f"Rate limiter: {stats['requests']} requests, {stats['wait_seconds']:.1f}s spent waiting")
+        summary = history.summary()
+        history.close()
+
+    logger.info("Job history:\n" + format_summary([row for row in summary if row["job"] in ran]))
+    return 1 if args.once and failed else 0
@@ -0,0 +1,235 @@
+import argparse
+import hmac
+import json
+import logging
+import os
+import shlex
+import signal
+import socketserver
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Set, Tuple, Type
+
+from cli import CommandLineExit, StrictArgumentParser
+from client import K3CloudClient
+from logger import LogCapture, capture, get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_BIND = "127.0.0.1:8765"
+TOKEN_HEADER = "X-K3Cloud-Token"
+
+# Commands that make no sense inside the daemon
+_FORBIDDEN_COMMANDS = {"serve", "schedule"}
+# Commands that write ERP documents; served only with --allow-import
+_WRITE_COMMANDS = {"import"}
+
+
+def add_serve_parser(subparsers) -> argparse.ArgumentParser:
+    parser_serve = subparsers.add_parser("serve", help="常驻服务：保持已初始化的客户端，接收 remote.py 转发的查询")
+    parser_serve.add_argument("--bind", default=DEFAULT_BIND, help="HTTP listen address host:port")
+    parser_serve.add_argument("--socket", default="", help="Listen on this Unix socket path instead of HTTP")
+    parser_serve.add_argument(
+        "--token",
+        default=os.getenv("K3CLOUD_SERVE_TOKEN") or "",
+        help="Shared secret clients must send (default: K3CLOUD_SERVE_TOKEN); required for HTTP",
+    )
+    parser_serve.add_argument("--allow-import", action="store_true", help="Also accept the import command, which writes ERP documents")
+    parser_serve.add_argument("--concurrency", type=int, default=4, help="Number of requests executed at the same time")
+    return parser_serve
+
+
+class QueryService:
+    """
+    Runs forwarded command lines on one shared, already initialized client.
+
+    Global options (--config, --section, --cache, ...) are fixed when the
+    daemon starts; requests carry only the subcommand and its arguments.
+    Each request's log lines are returned with its result, including those
+    written by the worker threads it starts (see logger.capture).
+    """
+
+    def __init__(
+        self,
+        client: K3CloudClient,
+        build_parser: Callable[[Type[argparse.ArgumentParser]], argparse.ArgumentParser],
+        run_command: Callable[[K3CloudClient, argparse.Namespace], int],
+        global_argv: List[str],
+        concurrency: int,
+        forbidden: Set[str] = frozenset(_FORBIDDEN_COMMANDS),
+    ):
+        self._client = client
+        self._forbidden = set(forbidden)
+        self._build_parser = build_parser
+        self._run_command = run_command
+        self._global_argv = global_argv
+        self._slots = threading.BoundedSemaphore(max(1, concurrency))
+        self._capture = LogCapture()
+        logging.getLogger("k3cloud").addHandler(self._capture)
+
+    def close(self) -> None:
+        logging.getLogger("k3cloud").removeHandler(self._capture)
+
+    def run(self, argv: List[str]) -> Dict[str, Any]:
+        started = time.perf_counter()
+        output: List[str] = []
+        with capture() as lines:
+            exit_code = self._run(argv, output)
+        return {
+            "exit_code": exit_code,
+            "log": lines,
+            "output": "".join(output),
+            "seconds": round(time.perf_counter() - started, 3),
+        }
+
+    def _run(self, argv: List[str], output: List[str]) -> int:
+        if not argv or argv[0] in self._forbidden or argv[0].startswith("-"):
+            logger.error(f"Unsupported command: {shlex.join(argv)}")
+            return 2
+        try:
+            # A fresh parser per request: argparse parsers are not thread safe
+            args = self._build_parser(StrictArgumentParser).parse_args(self._global_argv + argv)
+        except CommandLineExit as e:
+            if e.status == 0:
+                # --help
+                output.append(e.message)
+            else:
+                logger.error(f"Invalid arguments: {e.message}")
+            return e.status
+
+        logger.info(f"Running: {shlex.join(argv)}")
+        with self._slots:
+            try:
+                return self._run_command(self._client, args)
+            except (Exception, SystemExit) as e:
+                # SystemExit too: a request must not take the daemon down
+                logger.error(f"Error: {e!r}" if isinstance(e, SystemExit) else f"Error: {e}")
+                return 1
+
+
+def _make_handler(service: QueryService, token: str):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def address_string(self) -> str:
+            # Unix socket peers have no (host, port)
+            return self.client_address[0] if isinstance(self.client_address, tuple) else "unix"
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+        def _send_json(self, status: int, body: Dict[str, Any]) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _authorized(self) -> bool:
+            return not token or hmac.compare_digest(self.headers.get(TOKEN_HEADER, ""), token)
+
+        def do_GET(self):
+            if self.path != "/health":
+                self._send_json(404, {"error": "not found"})
+                return
+            self._send_json(200, {"status": "ok"})
+
+        def do_POST(self):
+            if self.path != "/run":
+                self._send_json(404, {"error": "not found"})
+                return
+            if not self._authorized():
+                self._send_json(403, {"error": "invalid token"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length") or 0)
+                argv = json.loads(self.rfile.read(length) or b"{}").get("argv")
+            except (ValueError, AttributeError):
+                argv = None
+            if not isinstance(argv, list) or not all(isinstance(a, str) for a in argv):
+                self._send_json(400, {"error": "body must be {\"argv\": [\"<command>\", ...]}"})
+                return
+            self._send_json(200, service.run(argv))
+
+    return Handler
+
+
+def _parse_bind(bind: str) -> Tuple[str, int]:
+    host, sep, port = bind.rpartition(":")
+    if not sep:
+        raise RuntimeError(f"--bind 格式错误: {bind} (应为 host:port)")
+    try:
+        return host or "127.0.0.1", int(port)
+    except ValueError as e:
+        raise RuntimeError(f"--bind 端口必须是整数: {bind}") from e
+
+
+def global_argv(args: argparse.Namespace) -> List[str]:
+    """Global options of the serve invocation, replayed for each request."""
+    argv = ["--config", args.config, "--section", args.section]
+    for flag in ("cache", "no_cache", "refresh"):
+        if getattr(args, flag, False):
+            argv.append("--" + flag.replace("_", "-"))
+    return argv
+
+
+def serve(
+    client: K3CloudClient,
+    args: argparse.Namespace,
+    build_parser: Callable[[Type[argparse.ArgumentParser]], argparse.ArgumentParser],
+    run_command: Callable[[K3CloudClient, argparse.Namespace], int],
+) -> int:
+    # Pay for the heavy optional imports once, not on the first request
+    try:
+        import pandas  # noqa: F401
+        import openpyxl  # noqa: F401
+    except ImportError:
+        pass
+
+    if not args.socket and not args.token:
+        # Any local process (or a web page posting to localhost) could run commands otherwise
+        raise RuntimeError("HTTP 服务必须设置 --token 或环境变量 K3CLOUD_SERVE_TOKEN；或使用 --socket")
+
+    forbidden = set(_FORBIDDEN_COMMANDS)
+    if not args.allow_import:
+        forbidden |= _WRITE_COMMANDS
+    service = QueryService(client, build_parser, run_command, global_argv(args), args.concurrency, forbidden)
+    handler = _make_handler(service, args.token)
+
+    if args.socket:
+        if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+            raise RuntimeError("当前系统不支持 Unix socket，请使用 --bind")
+        if os.path.exists(args.socket):
+            os.unlink(args.socket)
+        # Only the owner may connect: the socket is created 0600
+        umask = os.umask(0o177)
+        try:
+            httpd = socketserver.ThreadingUnixStreamServer(args.socket, handler)
+        finally:
+            os.umask(umask)
+        address = args.socket
+    else:
+        httpd = ThreadingHTTPServer(_parse_bind(args.bind), handler)
+        address = "http://%s:%d" % httpd.server_address[:2]
+    httpd.daemon_threads = True
+
+    try:
+        # Let `kill` shut down cleanly (removes the socket file)
+        signal.signal(signal.SIGTERM, lambda signum, frame: threading.Thread(target=httpd.shutdown).start())
+    except ValueError:
+        # Not in the main thread
+        pass
+
+    logger.info(f"Serving K3Cloud queries on {address} (concurrency: {args.concurrency})")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down")
+    finally:
+        httpd.server_close()
+        service.close()
+        if args.socket and os.path.exists(args.socket):
+            os.unlink(args.socket)
+    return 0
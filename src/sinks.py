@@ -0,0 +1,339 @@
+import csv
+import json
+import os
+from typing import Any, Dict, List, Optional, Sequence, Type
+
+from logger import get_logger
+
+logger = get_logger(__name__)
+
+# Hard row limit of a single Excel worksheet (header row included)
+EXCEL_MAX_ROWS = 1048576
+
+
+class BatchSink:
+    """
+    Base class for writers that consume query results page by page.
+
+    Subclasses implement _open/_write/_close. The header is resolved from the
+    first batch, so the file is only created once data (or close) arrives.
+    Appendable sinks can continue an earlier export (append_at): the file
+    is cut back to append_at bytes and rows are added without a header.
+    """
+
+    extension = ""
+    appendable = False
+
+    def __init__(
+        self,
+        path: str,
+        columns: Optional[Sequence[str]] = None,
+        sheet_name: str = "Sheet1",
+        compression: Optional[str] = None,
+        kinds: Optional[Dict[str, str]] = None,
+        append_at: Optional[int] = None,
+    ):
+        if append_at is not None and not self.appendable:
+            raise RuntimeError(f"{self.extension} 文件不能追加写入: {path}")
+        self.path = path
+        self.columns = list(columns) if columns else None
+        self.sheet_name = sheet_name
+        self.compression = compression
+        # Column kinds (see columnar.DTYPE_KINDS) by lower-cased column name
+        self.kinds = kinds or {}
+        self.append_at = append_at
+        self.rows_written = 0
+        self._header: Optional[List[str]] = None
+
+    def __enter__(self) -> "BatchSink":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None and self._header is None:
+            # Never opened (e.g. the output path is not writable): keep the original error
+            return
+        self.close()
+
+    def _resolve_header(self, width: int) -> List[str]:
+        if self.columns and len(self.columns) != width:
+            logger.warning(f"Column count mismatch: Data has {width} columns, but field_keys has {len(self.columns)}. Using default column names.")
+            return [str(i) for i in range(width)]
+        if self.columns:
+            return self.columns
+        return [str(i) for i in range(width)]
+
+    def _ensure_open(self, width: int) -> None:
+        if self._header is not None:
+            return
+        self._header = self._resolve_header(width)
+        try:
+            output_dir = os.path.dirname(self.path)
+            if output_dir:
+                os.makedirs(output_dir, exist_ok=True)
+            self._open(self._header)
+        except Exception:
+            self._header = None
+            raise
+
+    def write_batch(self, rows: List[Any]) -> None:
+        if not rows:
+            return
+        self._ensure_open(len(rows[0]))
+        self._write(rows)
+        self.rows_written += len(rows)
+
+    def flush(self) -> None:
+        """Push the rows written so far to the file (for a checkpoint of its size)."""
+
+    def close(self) -> None:
+        if self._header is None:
+            self._ensure_open(len(self.columns or []))
+        self._close()
+
+    def _open_text(self, encoding: str, newline: Optional[str] = None):
+        if self.append_at is None:
+            return open(self.path, "w", encoding=encoding, newline=newline)
+        os.truncate(self.path, self.append_at)
+        return open(self.path, "a", encoding=encoding, newline=newline)
+
+    def _open(self, header: List[str]) -> None:
+        raise NotImplementedError
+
+    def _write(self, rows: List[Any]) -> None:
+        raise NotImplementedError
+
+    def _close(self) -> None:
+        raise NotImplementedError
+
+
+class ExcelSink(BatchSink):
+    """
+    openpyxl write-only workbook. Rows are flushed to a temp file as they are
+    appended, so memory stays flat. Always creates a new workbook (the export
+    refuses an existing excel_file rather than replace it); sheets that would
+    exceed the Excel row limit roll over into "<sheet>_2", "<sheet>_3"...
+    """
+
+    extension = "xlsx"
+
+    def _open(self, header: List[str]) -> None:
+        from openpyxl import Workbook
+
+        self._workbook = Workbook(write_only=True)
+        self._sheet_index = 0
+        self._new_sheet()
+
+    def _new_sheet(self) -> None:
+        self._sheet_index += 1
+        title = self.sheet_name if self._sheet_index == 1 else f"{self.sheet_name}_{self._sheet_index}"
+        self._sheet = self._workbook.create_sheet(title=title)
+        self._sheet.append(self._header)
+        self._sheet_rows = 1
+
+    def _write(self, rows: List[Any]) -> None:
+        for row in rows:
+            if self._sheet_rows >= EXCEL_MAX_ROWS:
+                self._new_sheet()
+            self._sheet.append(row)
+            self._sheet_rows += 1
+
+    def _close(self) -> None:
+        self._workbook.save(self.path)
+
+
+class CsvSink(BatchSink):
+    extension = "csv"
+    appendable = True
+
+    def _open(self, header: List[str]) -> None:
+        # utf-8-sig so Excel opens Chinese text correctly (no BOM is written when appending)
+        self._file = self._open_text("utf-8-sig", newline="")
+        self._writer = csv.writer(self._file)
+        if self.append_at is None:
+            self._writer.writerow(header)
+
+    def _write(self, rows: List[Any]) -> None:
+        self._writer.writerows(rows)
+
+    def flush(self) -> None:
+        if self._header is not None:
+            self._file.flush()
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+class JsonlSink(BatchSink):
+    """One JSON object per line, keyed by column name."""
+
+    extension = "jsonl"
+    appendable = True
+
+    def _open(self, header: List[str]) -> None:
+        self._file = self._open_text("utf-8")
+
+    def _write(self, rows: List[Any]) -> None:
+        header = self._header
+        self._file.writelines(
+            json.dumps(dict(zip(header, row)), ensure_ascii=False, default=str) + "\n" for row in rows
+        )
+
+    def flush(self) -> None:
+        if self._header is not None:
+            self._file.flush()
+
+    def _close(self) -> None:
+        self._file.close()
+
+
+def _import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError as e:
+        raise RuntimeError("parquet / feather 输出需要安装 pyarrow") from e
+    return pyarrow
+
+
+class ArrowSink(BatchSink):
+    """
+    Base for pyarrow-backed columnar sinks; each batch becomes one record
+    batch / row group. The file schema is fixed when the first batch
+    arrives: columns with a known kind (--dtype or form metadata) get that
+    type, so a page of nulls or integral amounts does not decide it; other
+    columns take the type of the first batch (all-null columns become
+    strings). Later batches are cast to it; a text column accepts any
+    value.
+    """
+
+    def _open(self, header: List[str]) -> None:
+        self._pa = _import_pyarrow()
+        self._schema = None
+        self._writer = None
+
+    def _column_array(self, name: str, values: Sequence[Any]):
+        pa = self._pa
+        try:
+            return pa.array(values)
+        except (pa.ArrowInvalid, pa.ArrowTypeError, TypeError):
+            # Mixed value types within a column: keep them as text
+            return pa.array([None if v is None else str(v) for v in values], type=pa.string())
+
+    def _kind_type(self, kind: Optional[str]):
+        pa = self._pa
+        return {
+            "float": pa.float64(),
+            "int": pa.int64(),
+            "datetime": pa.timestamp("ms"),
+            "bool": pa.bool_(),
+            "string": pa.string(),
+        }.get(kind or "")
+
+    def _field(self, name: str, arr):
+        pa = self._pa
+        kind_type = self._kind_type(self.kinds.get(name.lower()))
+        if kind_type is not None:
+            try:
+                arr.cast(kind_type)
+                return pa.field(name, kind_type)
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+                logger.warning(f"Column {name} does not fit {kind_type} ({e}); using the type of its values")
+        return pa.field(name, pa.string() if arr.type == pa.null() else arr.type)
+
+    def _to_table(self, rows: List[Any]):
+        pa = self._pa
+        arrays = [self._column_array(name, values) for name, values in zip(self._header, zip(*rows))]
+
+        if self._schema is None:
+            self._schema = pa.schema([self._field(name, arr) for name, arr in zip(self._header, arrays)])
+            self._writer = self._new_writer(self._schema)
+
+        cast_arrays = []
+        for field, arr in zip(self._schema, arrays):
+            try:
+                cast_arrays.append(arr.cast(field.type))
+            except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError) as e:
+                raise RuntimeError(
+                    f"列 {field.name} 的数据类型在分页之间不一致 ({field.type} / {arr.type})，"
+                    f"可用 --dtype {field.name}:string 指定类型: {e}"
+                ) from e
+        return pa.Table.from_arrays(cast_arrays, schema=self._schema)
+
+    def _write(self, rows: List[Any]) -> None:
+        table = self._to_table(rows)
+        self._writer.write_table(table)
+
+    def write_table(self, table) -> None:
+        """Write a pyarrow Table directly, skipping the row lists."""
+        if table.num_rows == 0:
+            return
+        self._ensure_open(table.num_columns)
+        table = table.rename_columns(self._header)
+        if self._schema is None:
+            self._schema = table.schema
+            self._writer = self._new_writer(self._schema)
+        try:
+            table = table.cast(self._schema)
+        except (self._pa.ArrowInvalid, self._pa.ArrowNotImplementedError) as e:
+            raise RuntimeError(f"数据类型与已写入的列不一致: {e}") from e
+        self._writer.write_table(table)
+        self.rows_written += table.num_rows
+
+    def _close(self) -> None:
+        if self._writer is None:
+            self._schema = self._pa.schema([(name, self._pa.string()) for name in self._header])
+            self._writer = self._new_writer(self._schema)
+        self._writer.close()
+
+    def _compression(self, default: Optional[str]) -> Optional[str]:
+        if not self.compression:
+            return default
+        if self.compression.lower() == "none":
+            return None
+        return self.compression
+
+    def _new_writer(self, schema):
+        raise NotImplementedError
+
+
+class ParquetSink(ArrowSink):
+    extension = "parquet"
+
+    def _new_writer(self, schema):
+        import pyarrow.parquet as pq
+
+        return pq.ParquetWriter(self.path, schema, compression=self._compression("snappy") or "none")
+
+
+class FeatherSink(ArrowSink):
+    """Arrow IPC file format (Feather V2)."""
+
+    extension = "feather"
+
+    def _new_writer(self, schema):
+        pa = self._pa
+        options = pa.ipc.IpcWriteOptions(compression=self._compression("lz4"))
+        return pa.ipc.new_file(self.path, schema, options=options)
+
+
+SINK_TYPES: Dict[str, Type[BatchSink]] = {
+    "excel": ExcelSink,
+    "csv": CsvSink,
+    "jsonl": JsonlSink,
+    "parquet": ParquetSink,
+    "feather": FeatherSink,
+}
+
+
+def create_sink(
+    output_format: str,
+    path: str,
+    columns: Optional[Sequence[str]] = None,
+    sheet_name: str = "Sheet1",
+    compression: Optional[str] = None,
+    kinds: Optional[Dict[str, str]] = None,
+    append_at: Optional[int] = None,
+) -> BatchSink:
+    sink_cls = SINK_TYPES.get(output_format)
+    if sink_cls is None:
+        raise RuntimeError(f"不支持的输出格式: {output_format}")
+    return sink_cls(path, columns=columns, sheet_name=sheet_name, compression=compression, kinds=kinds, append_at=append_at)
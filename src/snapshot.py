@@ -0,0 +1,204 @@
+import argparse
+import hashlib
+import json
+import sqlite3
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+from client import K3CloudClient
+from logger import get_logger
+from pagination import BATCH_SIZE, BillQueryError, iter_bill_query_batches
+import sync
+
+logger = get_logger(__name__)
+
+INDEX_TABLE = "_snapshot_index"
+STATE_TABLE = "_snapshot_state"
+CHANGE_COLUMN = "ChangeType"
+
+
+def _row_key(values: Sequence[Any]) -> str:
+    return json.dumps(list(values), ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _row_hash(row: Sequence[Any]) -> bytes:
+    # 8 bytes per row is plenty to notice a change and keeps the index compact
+    data = json.dumps(row, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return hashlib.blake2b(data, digest_size=8).digest()
+
+
+def open_store(path: str) -> sqlite3.Connection:
+    conn = sync.open_store(path)
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {INDEX_TABLE} ("
+        "name TEXT NOT NULL, row_key TEXT NOT NULL, row_hash BLOB NOT NULL, "
+        "PRIMARY KEY (name, row_key)) WITHOUT ROWID"
+    )
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+        "name TEXT PRIMARY KEY, form_id TEXT, key_fields TEXT, field_keys TEXT, rows INTEGER, updated_at TEXT)"
+    )
+    conn.commit()
+    return conn
+
+
+def load_index(conn: sqlite3.Connection, name: str) -> Dict[str, bytes]:
+    return dict(conn.execute(f"SELECT row_key, row_hash FROM {INDEX_TABLE} WHERE name = ?", (name,)))
+
+
+def load_state(conn: sqlite3.Connection, name: str) -> Optional[Dict[str, Any]]:
+    row = conn.execute(f"SELECT key_fields, field_keys, rows, updated_at FROM {STATE_TABLE} WHERE name = ?", (name,)).fetchone()
+    if row is None:
+        return None
+    return {"key_fields": row[0], "field_keys": row[1], "rows": row[2], "updated_at": row[3]}
+
+
+def save_index(
+    conn: sqlite3.Connection,
+    name: str,
+    form_id: str,
+    key_fields: Sequence[str],
+    columns: Sequence[str],
+    index: Dict[str, bytes],
+) -> None:
+    """Replace the stored index in one transaction, so a failed run keeps the previous one."""
+    with conn:
+        conn.execute(f"DELETE FROM {INDEX_TABLE} WHERE name = ?", (name,))
+        conn.executemany(
+            f"INSERT INTO {INDEX_TABLE} (name, row_key, row_hash) VALUES (?, ?, ?)",
+            ((name, key, row_hash) for key, row_hash in index.items()),
+        )
+        conn.execute(
+            f"INSERT OR REPLACE INTO {STATE_TABLE} (name, form_id, key_fields, field_keys, rows, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (name, form_id, ",".join(key_fields), ",".join(columns), len(index), time.strftime("%Y-%m-%d %H:%M:%S")),
+        )
+
+
+def _diff_batches(
+    client: K3CloudClient,
+    form_id: str,
+    query_args: argparse.Namespace,
+    name: str,
+    key_fields: List[str],
+    columns: List[str],
+    previous: Dict[str, bytes],
+    current: Dict[str, bytes],
+) -> Iterator[List[List[Any]]]:
+    """Yield delta batches, filling current with the index of this run."""
+    lowered = [c.lower() for c in columns]
+    key_index = [lowered.index(k.lower()) for k in key_fields]
+    counts = {"insert": 0, "update": 0, "delete": 0}
+    # Repeats of a key get an occurrence number, which is stable as long as the row order is
+    occurrences: Dict[str, int] = {}
+    duplicates = 0
+
+    try:
+        # strict: a page lost mid-way must not turn the unread rows into deletes
+        for batch in iter_bill_query_batches(client, form_id, query_args, strict=True):
+            if len(batch[0]) != len(columns):
+                raise RuntimeError(f"Column count mismatch: Data has {len(batch[0])} columns, but expected {len(columns)}")
+            delta = []
+            for row in batch:
+                key_values = [row[i] for i in key_index]
+                key = _row_key(key_values)
+                if key in current:
+                    duplicates += 1
+                    occurrence = occurrences[key] = occurrences.get(key, 1) + 1
+                    key = _row_key(key_values + [f"#{occurrence}"])
+                row_hash = _row_hash(row)
+                current[key] = row_hash
+                old = previous.pop(key, None)
+                if old is None:
+                    change = "insert"
+                elif old != row_hash:
+                    change = "update"
+                else:
+                    continue
+                counts[change] += 1
+                delta.append([change] + list(row))
+            if delta:
+                yield delta
+
+        # Keys left over were not returned this time; only their key values are known
+        deleted = []
+        for key in previous:
+            row: List[Any] = [None] * len(columns)
+            for i, value in zip(key_index, json.loads(key)):
+                row[i] = value
+            deleted.append(["delete"] + row)
+            if len(deleted) >= BATCH_SIZE:
+                yield deleted
+                deleted = []
+        if deleted:
+            yield deleted
+        counts["delete"] = len(previous)
+
+        if duplicates:
+            logger.warning(
+                f"{duplicates} rows share a snapshot key with an earlier row ({', '.join(key_fields)}); "
+                "they are matched by position, so add fields to --snapshot-key or an --order-string to make them stable"
+            )
+    except BillQueryError as e:
+        raise RuntimeError(f"快照查询失败，索引未更新: {str(e.response)[:500]}") from e
+
+    logger.info(
+        f"Snapshot {name}: {len(current)} rows, {counts['insert']} inserted, "
+        f"{counts['update']} updated, {counts['delete']} deleted"
+    )
+
+
+def run_snapshot(client: K3CloudClient, form_id: str, args: argparse.Namespace) -> Iterator[List[List[Any]]]:
+    """
+    Diff the full query result against the row-hash index of the previous run.
+
+    Returns a generator of delta batches (ChangeType column first: insert /
+    update / delete) for run_command to stream into the output; deleted
+    rows carry only their key fields. The stored index is replaced by
+    args.after_export, i.e. only once the delta has been written and the
+    output closed, so a run that fails anywhere before that is simply
+    repeated.
+    """
+    key_fields = sync.split_field_keys(args.snapshot_key)
+    if not key_fields:
+        raise RuntimeError("snapshot 需要 --snapshot-key")
+
+    columns = sync._with_fields(sync.split_field_keys(args.field_keys), key_fields)
+    name = args.snapshot_name or f"{form_id}|{args.filter_string}"
+
+    db_path = getattr(args, "db", "") or client.config.sqlite_file or sync.DEFAULT_SQLITE_FILE
+    conn = open_store(db_path)
+    try:
+        state = None if args.full else load_state(conn, name)
+        if state and state["key_fields"].lower() != ",".join(key_fields).lower():
+            raise RuntimeError(
+                f"快照 {name} 的主键为 {state['key_fields']}，与 --snapshot-key 不一致；请使用 --full 重建或指定 --snapshot-name"
+            )
+        if state and state["field_keys"].lower() != ",".join(columns).lower():
+            logger.warning(f"Field keys changed since snapshot {name} was taken; every row will be reported as updated")
+        previous = load_index(conn, name) if state else {}
+    finally:
+        conn.close()
+
+    if state:
+        logger.info(f"Diffing {form_id} against snapshot {name} ({len(previous)} rows, taken {state['updated_at']})")
+    else:
+        logger.info(f"No snapshot {name} in {db_path} yet; every row is reported as inserted")
+
+    query_args = argparse.Namespace(**vars(args))
+    query_args.field_keys = ",".join(columns)
+    # Headers of the delta output
+    args.column_names = [CHANGE_COLUMN] + columns
+
+    current: Dict[str, bytes] = {}
+
+    def save() -> None:
+        store = open_store(db_path)
+        try:
+            save_index(store, name, form_id, key_fields, columns, current)
+        finally:
+            store.close()
+        logger.info(f"Snapshot {name} saved to {db_path}")
+
+    args.after_export = save
+    return _diff_batches(client, form_id, query_args, name, key_fields, columns, previous, current)
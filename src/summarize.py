@@ -0,0 +1,126 @@
+import json
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from client import K3CloudClient
+from logger import get_logger
+from pagination import BATCH_SIZE
+
+logger = get_logger(__name__)
+
+AGG_FUNCS = ("sum", "count", "mean", "min", "max", "nunique")
+# Functions that give the same answer when re-applied to a report's pre-aggregated rows
+PUSHDOWN_FUNCS = ("sum", "min", "max")
+NUMERIC_FUNCS = ("sum", "mean")
+DATE_GRAINS = {"day": "D", "week": "W", "month": "M", "quarter": "Q", "year": "Y"}
+
+
+def parse_aggregations(value: str) -> List[Tuple[str, str]]:
+    """Parse "FBaseQty:sum,FAmount,FBillNo:count" into [(field, func), ...]; func defaults to sum."""
+    aggregations = []
+    for item in (value or "").split(","):
+        if not item.strip():
+            continue
+        field, _, func = item.partition(":")
+        func = (func or "sum").strip().lower()
+        if func not in AGG_FUNCS:
+            raise RuntimeError(f"--agg 不支持的汇总函数: {item.strip()} (可选: {', '.join(AGG_FUNCS)})")
+        aggregations.append((field.strip(), func))
+    if not aggregations:
+        raise RuntimeError("summarize 需要 --agg，例如 FBaseQty:sum")
+    return aggregations
+
+
+def summary_fields(group_by: Sequence[str], aggregations: Sequence[Tuple[str, str]]) -> List[str]:
+    """Fields to fetch: group keys then aggregated fields, each once (case-insensitive)."""
+    fields: List[str] = []
+    seen = set()
+    for field in list(group_by) + [f for f, _ in aggregations]:
+        if field.lower() not in seen:
+            seen.add(field.lower())
+            fields.append(field)
+    return fields
+
+
+def aggregate(df, group_by: Sequence[str], aggregations: Sequence[Tuple[str, str]], date_grain: str = ""):
+    """
+    Vectorized group-by of df. Group columns holding dates are truncated to
+    date_grain first; output columns are the group keys then "<field>_<func>".
+    """
+    import pandas as pd
+
+    columns = {str(c).lower(): c for c in df.columns}
+
+    def column(name: str):
+        if name.lower() not in columns:
+            raise RuntimeError(f"汇总字段不在查询结果中: {name}")
+        return columns[name.lower()]
+
+    keys = [column(g) for g in group_by]
+    if date_grain:
+        for key in keys:
+            if pd.api.types.is_datetime64_any_dtype(df[key]):
+                df[key] = df[key].dt.to_period(DATE_GRAINS[date_grain]).dt.start_time
+
+    spec: Dict[str, Tuple[Any, str]] = {}
+    for field, func in aggregations:
+        source = column(field)
+        if func in NUMERIC_FUNCS and not pd.api.types.is_numeric_dtype(df[source]):
+            try:
+                # Dictionary encoded text comes in as a categorical
+                df[source] = pd.to_numeric(df[source].astype(object))
+            except (ValueError, TypeError) as e:
+                raise RuntimeError(f"字段 {field} 不是数值，无法 {func}: {e}") from e
+        spec[f"{field}_{func}"] = (source, func)
+
+    if not keys:
+        # Grand totals: a single row
+        return pd.DataFrame([{name: df[source].agg(func) for name, (source, func) in spec.items()}])
+    # observed=True: categorical keys must not expand into every combination of categories
+    return df.groupby(keys, dropna=False, sort=True, observed=True).agg(**spec).reset_index()
+
+
+def _report_rows(response: Any) -> List[List[Any]]:
+    data = json.loads(response) if isinstance(response, str) else response
+    result = data.get("Result", data) if isinstance(data, dict) else {}
+    status = result.get("ResponseStatus") or {}
+    if not result.get("IsSuccess", status.get("IsSuccess", True)):
+        errors = "; ".join(e.get("Message", "") for e in status.get("Errors") or []) or str(result)[:500]
+        raise RuntimeError(f"报表查询失败: {errors}")
+    rows = result.get("Rows")
+    if not isinstance(rows, list):
+        raise RuntimeError(f"报表返回格式无法识别: {str(response)[:500]}")
+    return rows
+
+
+def fetch_report_frame(
+    client: K3CloudClient,
+    form_id: str,
+    fields: Sequence[str],
+    scheme_id: str = "",
+    model: Optional[Dict[str, Any]] = None,
+    page_size: int = BATCH_SIZE,
+):
+    """Page through a system report (GetSysReportData) for just the given fields."""
+    import pandas as pd
+
+    rows: List[List[Any]] = []
+    start_row = 0
+    while True:
+        data = {
+            "FieldKeys": ",".join(fields),
+            "SchemeId": scheme_id,
+            "StartRow": start_row,
+            "Limit": page_size,
+            "IsVerifyBaseDataField": "true",
+            "Model": model or {},
+        }
+        page = _report_rows(client.get_sys_report_data(form_id, data))
+        rows.extend(page)
+        logger.info(f"Fetched {len(rows)} report rows so far... (StartRow={start_row})")
+        if len(page) < page_size:
+            break
+        start_row += page_size
+
+    if rows and len(rows[0]) != len(fields):
+        raise RuntimeError(f"报表返回 {len(rows[0])} 列，但请求了 {len(fields)} 个字段")
+    return pd.DataFrame(rows, columns=list(fields))
@@ -0,0 +1,154 @@
+import argparse
+import os
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from client import K3CloudClient
+from logger import get_logger
+from pagination import BillQueryError, iter_bill_query_batches
+
+logger = get_logger(__name__)
+
+DEFAULT_SQLITE_FILE = os.path.join("data", "k3cloud.db")
+STATE_TABLE = "_sync_state"
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def split_field_keys(value: str) -> List[str]:
+    return [k.strip() for k in (value or "").split(",") if k.strip()]
+
+
+def _with_fields(columns: List[str], extra: Sequence[str]) -> List[str]:
+    """Append the fields in `extra` that are not already selected (K3Cloud keys are case-insensitive)."""
+    present = {c.lower() for c in columns}
+    result = list(columns)
+    for field in extra:
+        if field.lower() not in present:
+            result.append(field)
+            present.add(field.lower())
+    return result
+
+
+def open_store(path: str) -> sqlite3.Connection:
+    output_dir = os.path.dirname(path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute(
+        f"CREATE TABLE IF NOT EXISTS {STATE_TABLE} ("
+        "form_id TEXT NOT NULL, filter_string TEXT NOT NULL, "
+        "watermark_field TEXT NOT NULL, watermark TEXT, updated_at TEXT, "
+        "PRIMARY KEY (form_id, filter_string))"
+    )
+    conn.commit()
+    return conn
+
+
+def load_watermark(conn: sqlite3.Connection, form_id: str, filter_string: str) -> Optional[str]:
+    row = conn.execute(
+        f"SELECT watermark FROM {STATE_TABLE} WHERE form_id = ? AND filter_string = ?",
+        (form_id, filter_string),
+    ).fetchone()
+    return row[0] if row else None
+
+
+def save_watermark(conn: sqlite3.Connection, form_id: str, filter_string: str, field: str, watermark: Optional[str]) -> None:
+    conn.execute(
+        f"INSERT OR REPLACE INTO {STATE_TABLE} (form_id, filter_string, watermark_field, watermark, updated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (form_id, filter_string, field, watermark, time.strftime("%Y-%m-%d %H:%M:%S")),
+    )
+    conn.commit()
+
+
+def ensure_table(conn: sqlite3.Connection, table: str, columns: Sequence[str], key_fields: Sequence[str]) -> None:
+    column_defs = ", ".join(_quote(c) for c in columns)
+    primary_key = ", ".join(_quote(k) for k in key_fields)
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({column_defs}, PRIMARY KEY ({primary_key}))")
+
+    # Field keys may grow between runs; add the new ones as nullable columns
+    existing = {row[1].lower() for row in conn.execute(f"PRAGMA table_info({_quote(table)})")}
+    for column in columns:
+        if column.lower() not in existing:
+            conn.execute(f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(column)}")
+    conn.commit()
+
+
+def upsert_rows(conn: sqlite3.Connection, table: str, columns: Sequence[str], rows: List[Any]) -> int:
+    placeholders = ", ".join("?" for _ in columns)
+    column_list = ", ".join(_quote(c) for c in columns)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {_quote(table)} ({column_list}) VALUES ({placeholders})",
+        rows,
+    )
+    conn.commit()
+    return len(rows)
+
+
+def watermark_filter(filter_string: str, field: str, watermark: Optional[str]) -> str:
+    if not watermark:
+        return filter_string
+    # ">=" rather than ">" so rows sharing the last timestamp are never missed;
+    # the upsert makes re-reading them harmless.
+    predicate = f"{field} >= '{watermark.replace('T', ' ')}'"
+    if filter_string:
+        return f"({filter_string}) AND {predicate}"
+    return predicate
+
+
+def run_sync(client: K3CloudClient, form_id: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """
+    Fetch rows modified since the stored watermark and upsert them into SQLite.
+
+    The watermark is kept per (form_id, filter_string) and only advanced after
+    every page has been written, so an interrupted run simply repeats.
+    """
+    watermark_field = args.watermark_field
+    key_fields = split_field_keys(args.key_fields)
+    if not watermark_field or not key_fields:
+        raise RuntimeError("sync 需要 --watermark-field 和 --key-fields")
+
+    columns = _with_fields(split_field_keys(args.field_keys), key_fields + [watermark_field])
+    watermark_index = [c.lower() for c in columns].index(watermark_field.lower())
+
+    db_path = getattr(args, "db", "") or client.config.sqlite_file or DEFAULT_SQLITE_FILE
+    conn = open_store(db_path)
+    try:
+        previous = None if args.full else load_watermark(conn, form_id, args.filter_string)
+        ensure_table(conn, form_id, columns, key_fields)
+
+        query_args = argparse.Namespace(**vars(args))
+        query_args.field_keys = ",".join(columns)
+        query_args.filter_string = watermark_filter(args.filter_string, watermark_field, previous)
+        # A stable order, so StartRow pages neither skip nor repeat rows
+        if getattr(args, "order_string", ""):
+            logger.warning(f"--order-string is replaced by the sync order: {watermark_field}, {args.key_fields}")
+        query_args.order_string = ",".join(f"{f} ASC" for f in [watermark_field] + key_fields)
+
+        logger.info(f"Syncing {form_id} into {db_path} ({watermark_field} since: {previous or 'beginning'})")
+
+        latest = previous
+        synced = 0
+        try:
+            # strict: a page lost mid-way must not let the watermark move past its rows
+            for batch in iter_bill_query_batches(client, form_id, query_args, strict=True):
+                if len(batch[0]) != len(columns):
+                    raise RuntimeError(f"Column count mismatch: Data has {len(batch[0])} columns, but expected {len(columns)}")
+                synced += upsert_rows(conn, form_id, columns, batch)
+                for row in batch:
+                    value = row[watermark_index]
+                    if value and (latest is None or str(value) > latest):
+                        latest = str(value)
+        except BillQueryError as e:
+            raise RuntimeError(f"同步查询失败，水位线未更新: {str(e.response)[:500]}") from e
+
+        save_watermark(conn, form_id, args.filter_string, watermark_field, latest)
+    finally:
+        conn.close()
+
+    logger.info(f"Synced {synced} records into {db_path} (table: {form_id}, watermark: {latest})")
+    return {"form_id": form_id, "rows": synced, "watermark": latest, "db": db_path}
@@ -0,0 +1,73 @@
+import json
+import os
+import sys
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import commands  # noqa: E402
+from pagination import iter_bill_query_batches  # noqa: E402
+
+
+def error_response(message: str, msg_code: int = 0) -> str:
+    """An ExecuteBillQuery error payload, in the [[{"Result": ...}]] form the server returns."""
+    status = {"IsSuccess": False, "MsgCode": msg_code, "Errors": [{"Message": message}]}
+    return json.dumps([[{"Result": {"ResponseStatus": status}}]])
+
+
+def bill_rows(count: int, key: str = "FEntity_FEntryID", **fields: Callable[[int], Any]) -> List[Dict[str, Any]]:
+    """count rows with key 1..count; every keyword is a column computed from the row's 0-based position."""
+    return [{key: i + 1, **{name: value(i) for name, value in fields.items()}} for i in range(count)]
+
+
+def fetch_all(client: "StubClient", args, form_id: str = "SAL_OUTSTOCK") -> List[List[Any]]:
+    """Every row of a paginated query, flattened."""
+    return [row for batch in iter_bill_query_batches(client, form_id, args) for row in batch]
+
+
+class StubClient:
+    """
+    Answers ExecuteBillQuery from an in-memory table: FieldKeys pick the
+    columns and StartRow/Limit slice the rows. FilterString and OrderString
+    are ignored. fail(data) may return an error message to answer with an
+    error response, or raise to simulate a network error.
+    """
+
+    def __init__(self, rows: List[Dict[str, Any]], fail: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None):
+        self.rows = rows
+        self.fail = fail
+        self.requests: List[Dict[str, Any]] = []
+        self.config = SimpleNamespace(server_url="http://stub/K3Cloud/", acct_id="stub", sqlite_file="", excel_file="")
+        self.cache = None
+        self.rate_limiter = None
+
+    def bill_query(self, data: Dict[str, Any], timeout_s: Optional[float] = None, use_cache: bool = True) -> str:
+        self.requests.append(dict(data))
+        error = self.fail(data) if self.fail else None
+        if error:
+            return error_response(error)
+        fields = data["FieldKeys"].split(",")
+        start, limit = data["StartRow"], data["Limit"]
+        rows = self.rows[start:start + limit] if limit else self.rows[start:]
+        return json.dumps([[row[f] for f in fields] for row in rows])
+
+
+@pytest.fixture
+def query_args():
+    """
+    Parse a query command line as the CLI would, without metadata lookups
+    or retry delays; keyword arguments override the parsed attributes.
+    """
+
+    def parse(spec: str, **overrides: Any):
+        args = commands.parse_query_args(spec)
+        args.no_metadata = True
+        args.retry_delay = 0
+        for name, value in overrides.items():
+            setattr(args, name, value)
+        return args
+
+    return parse
@@ -0,0 +1,80 @@
+import argparse
+
+import pandas as pd
+import pytest
+
+import commands
+import export
+from conftest import StubClient, bill_rows
+
+SALES_OUT = "sales-out --field-keys FEntity_FEntryID,FQty --no-metadata --page-size 2"
+
+
+def _batch(client, *targets):
+    return commands.cmd_batch(client, argparse.Namespace(targets=list(targets), concurrency=0))
+
+
+@pytest.fixture
+def client(tmp_path):
+    stub = StubClient(bill_rows(3, FQty=lambda i: i * 10))
+    stub.config.excel_file = str(tmp_path / "out.xlsx")
+    return stub
+
+
+def test_every_query_becomes_a_sheet_of_one_workbook(client):
+    summary = _batch(client, SALES_OUT, SALES_OUT + " --limit 2")
+
+    assert summary == {"销售出库单": 3, "销售出库单_2": 2}
+    sheets = pd.read_excel(client.config.excel_file, sheet_name=None)
+    assert list(sheets) == ["销售出库单", "销售出库单_2"]
+    assert sheets["销售出库单"]["FQty"].tolist() == [0, 10, 20]
+
+
+def test_failed_query_fails_the_batch_after_writing_the_others(client):
+    with pytest.raises(RuntimeError, match="批量查询失败: inventory"):
+        _batch(client, SALES_OUT, "inventory --field-keys FMissing --no-metadata")
+
+    assert list(pd.read_excel(client.config.excel_file, sheet_name=None)) == ["销售出库单"]
+
+
+def test_query_missing_pages_is_marked_and_fails_the_batch(client):
+    client.fail = lambda data: "server busy" if data["StartRow"] == 2 else None
+
+    with pytest.raises(RuntimeError, match="批量查询结果不完整.*销售出库单"):
+        _batch(client, SALES_OUT + " --retries 0")
+
+    assert pd.read_excel(client.config.excel_file)["FQty"].tolist() == [0, 10]
+    with open(client.config.excel_file + export.INCOMPLETE_SUFFIX, encoding="utf-8") as f:
+        assert "StartRow=2" in f.read()
+
+
+def test_unreadable_workbook_is_not_reported_as_written(client):
+    with open(client.config.excel_file, "wb") as f:
+        f.write(b"not a workbook")
+
+    with pytest.raises(RuntimeError, match="无法追加到 Excel 文件"):
+        _batch(client, SALES_OUT)
+
+    with open(client.config.excel_file, "rb") as f:
+        assert f.read() == b"not a workbook"
+
+
+@pytest.mark.parametrize("spec, message", [
+    ("nonsense --limit 1", "未知的查询命令"),
+    ("sales-out --limit many", "查询参数错误"),
+    ("sales-out --unknown", "查询参数错误"),
+    ("sales-out --help", "不支持 --help"),
+    ("sales-out --filter-string 'open", "查询参数错误"),
+])
+def test_bad_query_specs_raise_instead_of_exiting(spec, message):
+    with pytest.raises(RuntimeError, match=message):
+        commands.parse_query_args(spec)
+
+
+def test_query_specs_are_parsed_with_their_command_defaults():
+    args = commands.parse_query_args("sales-order --limit 5 --filter-string \"FDocumentStatus = 'C'\"")
+
+    assert args.command == "sales-order"
+    assert args.form_id == "SAL_SaleOrder"
+    assert args.limit == 5
+    assert args.filter_string == "FDocumentStatus = 'C'"
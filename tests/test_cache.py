@@ -0,0 +1,89 @@
+import json
+import zlib
+
+import pytest
+
+import cache as cache_module
+from cache import QueryCache, is_cacheable_response
+from conftest import error_response
+
+QUERY = {"FormId": "SAL_OUTSTOCK", "FieldKeys": "FQty", "FilterString": "", "StartRow": 0, "Limit": 2}
+
+
+def _page(start_row, **overrides):
+    return dict(QUERY, StartRow=start_row, **overrides)
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def make_cache(tmp_path):
+    caches = []
+
+    def make(**kwargs):
+        cache = QueryCache(str(tmp_path / "cache.db"), **kwargs)
+        caches.append(cache)
+        return cache
+
+    yield make
+    for cache in caches:
+        cache.close()
+
+
+def test_entries_expire_after_their_form_ttl(make_cache, clock):
+    cache = make_cache(default_ttl=60, form_ttls={"STK_Inventory": 0})
+    cache.put(QUERY, "[[1]]")
+    cache.put(dict(QUERY, FormId="STK_Inventory"), "[[2]]")
+
+    assert cache.get(QUERY) == "[[1]]"
+    # A TTL of 0 keeps the form out of the cache
+    assert cache.get(dict(QUERY, FormId="STK_Inventory")) is None
+
+    clock.now += 61
+    assert cache.get(QUERY) is None
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_read_entries_are_evicted(make_cache, clock):
+    body = json.dumps([[i] for i in range(200)])
+    # Room for two compressed bodies
+    cache = make_cache(max_bytes=2 * len(zlib.compress(body.encode("utf-8"), 1)))
+
+    cache.put(_page(0), body)
+    clock.now += 1
+    cache.put(_page(2), body)
+    clock.now += 1
+    cache.get(_page(0))
+    clock.now += 1
+    cache.put(_page(4), body)
+
+    assert cache.get(_page(0)) == body
+    assert cache.get(_page(2)) is None
+    assert cache.get(_page(4)) == body
+
+
+def test_namespaces_and_refresh_keep_responses_apart(make_cache, clock):
+    make_cache(namespace="acct-a").put(QUERY, "[[1]]")
+
+    assert make_cache(namespace="acct-b").get(QUERY) is None
+    assert make_cache(namespace="acct-a", refresh=True).get(QUERY) is None
+    assert make_cache(namespace="acct-a").get(QUERY) == "[[1]]"
+
+
+def test_only_row_lists_are_cacheable():
+    assert is_cacheable_response("[[1, 2]]")
+    assert not is_cacheable_response(error_response("session lost"))
+    assert not is_cacheable_response('{"Result": {"ResponseStatus": {"IsSuccess": false}}}')
@@ -0,0 +1,75 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+from requests.cookies import RequestsCookieJar
+
+from client import K3CloudClient
+from config import K3CloudConfig
+
+QUERY = {"FormId": "SAL_OUTSTOCK", "FieldKeys": "FQty"}
+
+
+@pytest.fixture
+def posts():
+    """A K3CloudClient whose pooled session records its posts instead of sending them."""
+    client = K3CloudClient(K3CloudConfig("http://stub/K3Cloud/", "acct", "app", "secret", "user", connect_timeout=3, request_timeout=30))
+    calls = []
+    lock = threading.Lock()
+
+    def post(**kwargs):
+        with lock:
+            calls.append(kwargs)
+        cookies = RequestsCookieJar()
+        cookies.set("kdservice-sessionid", "session-1")
+        return SimpleNamespace(status_code=200, text="[[1]]", cookies=cookies, headers={})
+
+    client._http.post = post
+    yield client, calls
+    client.close()
+
+
+def test_requests_go_through_the_pooled_session_with_both_timeouts(posts):
+    client, calls = posts
+
+    assert client.bill_query(QUERY) == "[[1]]"
+
+    assert calls[0]["url"].endswith("ExecuteBillQuery.common.kdsvc")
+    assert calls[0]["timeout"] == (3, 30)
+
+
+def test_timeout_override_stays_in_its_thread(posts):
+    client, calls = posts
+    inside = threading.Event()
+    release = threading.Event()
+    post = client._http.post
+
+    def slow_post(**kwargs):
+        if kwargs["timeout"][1] == 5:
+            inside.set()
+            release.wait(5)
+        return post(**kwargs)
+
+    client._http.post = slow_post
+    worker = threading.Thread(target=client.bill_query, args=(QUERY,), kwargs={"timeout_s": 5})
+    worker.start()
+    inside.wait(5)
+    # While the worker's call with its own timeout is in flight
+    client.bill_query(QUERY)
+    release.set()
+    worker.join()
+    client.bill_query(QUERY, timeout_s=None)
+
+    assert [c["timeout"] for c in calls] == [(3, 30), (3, 5), (3, 30)]
+
+
+def test_session_cookie_is_shared_between_threads(posts):
+    client, calls = posts
+    client.bill_query(QUERY)
+
+    worker = threading.Thread(target=client.bill_query, args=(QUERY,))
+    worker.start()
+    worker.join()
+
+    assert "kdservice-sessionid" not in calls[0]["headers"]
+    assert calls[1]["headers"]["kdservice-sessionid"] == "session-1"
@@ -0,0 +1,71 @@
+import argparse
+
+import pandas as pd
+import pyarrow as pa
+
+import export
+from columnar import ColumnarResult, parse_dtype_hints, worth_encoding
+
+
+def _result(rows, columns, threshold=10, hints=""):
+    result = ColumnarResult(columns, parse_dtype_hints(hints), threshold)
+    for start in range(0, len(rows), 2):
+        result.extend(rows[start:start + 2])
+    return result
+
+
+def test_columns_are_typed_from_hints_names_and_values():
+    rows = [[1, 2.5, "2024-01-02T00:00:00", "A"], [None, 3, "2024-01-03T00:00:00", "B"], [3, 4, None, "A"]]
+
+    result = _result(rows, ["FCount", "FQty", "FDate", "FName"], hints="FCount:int")
+
+    # A null in an int column turns the whole column into float
+    assert result.kinds == {"FCount": "float", "FQty": "float", "FDate": "datetime", "FName": "string"}
+    df = result.to_dataframe()
+    assert df["FQty"].tolist() == [2.5, 3.0, 4.0]
+    assert df["FDate"].isna().tolist() == [False, False, True]
+
+
+def test_repeated_text_is_dictionary_encoded():
+    rows = [[f"S{i % 2}", f"SO{i}"] for i in range(8)]
+
+    result = _result(rows, ["FStockId", "FBillNo"], threshold=5)
+
+    assert result.encoded_columns == ["FStockId"]
+    df = result.to_dataframe()
+    assert df["FStockId"].dtype == "category"
+    assert df["FStockId"].tolist() == [f"S{i % 2}" for i in range(8)]
+    assert pa.types.is_dictionary(result.to_arrow().column("FStockId").type)
+    assert df["FBillNo"].tolist() == [f"SO{i}" for i in range(8)]
+
+
+def test_values_that_barely_repeat_are_not_encoded():
+    result = _result([["S1"], ["S2"], ["S1"]], ["FStockId"])
+
+    assert result.arrays()["FStockId"].tolist() == ["S1", "S2", "S1"]
+    assert result.encoded_columns == []
+
+
+def test_equal_values_of_different_types_keep_their_own_codes():
+    values = [1, True, 0, False, "1", None] * 2
+
+    result = _result([[v] for v in values], ["FFlag"])
+
+    decoded = result.arrays()["FFlag"].tolist()
+    assert [(type(v), v) for v in decoded] == [(type(v), v) for v in values]
+    assert [(type(v), v) for v in result.to_dataframe()["FFlag"]] == [(type(v), v) for v in values]
+
+
+def test_dataframe_export_uses_the_same_encoding_rule():
+    df = pd.DataFrame({
+        "FStockId": ["S1", "S2", "S1", "S2"],
+        "FBillNo": ["SO1", "SO2", "SO3", "SO1"],
+        "FFlag": [1, True, 1, True],
+    }, dtype=object)
+
+    df = export._encode_categoricals(df, export.dict_threshold(argparse.Namespace(dict_threshold=10)))
+
+    assert df["FStockId"].dtype == "category"
+    assert df["FBillNo"].dtype == object
+    assert df["FFlag"].tolist() == [1, True, 1, True] and df["FFlag"].dtype == object
+    assert worth_encoding(2, 4, 10) and not worth_encoding(3, 4, 10) and not worth_encoding(2, 4, 0)
@@ -0,0 +1,56 @@
+import pytest
+
+import fanout
+import main
+from conftest import StubClient, bill_rows
+
+TARGET = "sales-out --field-keys FBillNo,FQty --page-size 2 --retries 0 --retry-delay 0 --no-metadata"
+
+
+class SectionClient(StubClient):
+    def __init__(self, section, count, fail=None):
+        super().__init__(bill_rows(count, FBillNo=lambda i: f"{section}-{i}", FQty=lambda i: i), fail)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def _fanout_args(*extra):
+    return main.build_parser().parse_args(["fan-out", TARGET, "--sections", "sh,bj", *extra])
+
+
+def _rows(merged):
+    return [row for batch in merged.iter_batches() for row in batch]
+
+
+def _run(args, clients):
+    return fanout.run_fanout(args, lambda section: clients[section])
+
+
+def test_sections_are_merged_with_a_source_column():
+    clients = {"sh": SectionClient("sh", 3), "bj": SectionClient("bj", 1)}
+    args = _fanout_args()
+
+    merged = _run(args, clients)
+
+    assert merged.columns == ["Section", "FBillNo", "FQty"]
+    assert _rows(merged) == [["sh", "sh-0", 0], ["sh", "sh-1", 1], ["sh", "sh-2", 2], ["bj", "bj-0", 0]]
+    assert args.column_names == merged.columns
+    assert all(client.closed for client in clients.values())
+
+
+def test_an_incomplete_section_fails_the_fan_out():
+    clients = {"sh": SectionClient("sh", 5, fail=lambda data: "server busy" if data["StartRow"] == 2 else None),
+               "bj": SectionClient("bj", 1)}
+
+    with pytest.raises(RuntimeError, match="以下数据中心查询失败: sh"):
+        _run(_fanout_args(), clients)
+
+    merged = _run(_fanout_args("--allow-partial"), clients)
+    assert [row[0] for row in _rows(merged)] == ["bj"]
+
+
+def test_duplicate_sections_are_refused():
+    with pytest.raises(RuntimeError, match="重复"):
+        fanout.split_sections("sh,bj,sh")
@@ -0,0 +1,111 @@
+import json
+
+import pytest
+
+import importer
+from cache import QueryCache
+from client import K3CloudClient
+from config import K3CloudConfig
+from importer import ImportDocument, ImportReport
+
+META = {"source": "orders.csv", "form_id": "SAL_SaleOrder", "chunk_size": 2, "group_by": "FBillNo", "documents": 3}
+
+
+def _document(index, number):
+    return ImportDocument(index, number, [index + 1], {"FBillNo": number})
+
+
+class SaveClient:
+    """Answers the number lookup of verify_chunk from `saved` and records every BatchSave."""
+
+    def __init__(self, saved):
+        self.saved = saved
+        self.lookups = []
+        self.sent = []
+
+    def bill_query(self, data, timeout_s=None, use_cache=True):
+        self.lookups.append(use_cache)
+        return json.dumps([[fid, number] for number, fid in self.saved.items() if f"'{number}'" in data["FilterString"]])
+
+    def batch_save(self, form_id, data, timeout_s=None):
+        self.sent.append([model["FBillNo"] for model in data["Model"]])
+        entities = [{"DIndex": i, "Id": 100 + i, "Number": model["FBillNo"]} for i, model in enumerate(data["Model"])]
+        return json.dumps({"Result": {"ResponseStatus": {"IsSuccess": True, "SuccessEntitys": entities}}})
+
+
+def test_rows_sharing_a_group_key_become_one_document():
+    rows = [
+        {"FBillNo": "SO1", "FCustId": "C1", "FMaterialId": "M1", "FQty": 2},
+        {"FBillNo": "SO1", "FCustId": "ignored", "FMaterialId": "M2", "FQty": ""},
+        {"FBillNo": "SO2", "FCustId": "C2", "FMaterialId": "M3", "FQty": 1},
+    ]
+    mapping = {
+        "FBillNo": "FBillNo",
+        "FCustId": "FCustId.FNumber",
+        "FMaterialId": "FSaleOrderEntry[].FMaterialId.FNumber",
+        "FQty": "FSaleOrderEntry[].FQty",
+    }
+
+    documents = importer.build_documents(iter(rows), mapping, "FBillNo")
+
+    assert [d.key for d in documents] == ["SO1", "SO2"]
+    assert documents[0].line_range == "1-2"
+    assert documents[0].model == {
+        "FBillNo": "SO1",
+        "FCustId": {"FNumber": "C1"},
+        "FSaleOrderEntry": [{"FMaterialId": {"FNumber": "M1"}, "FQty": 2}, {"FMaterialId": {"FNumber": "M2"}}],
+    }
+
+
+def test_success_entities_are_matched_by_index_then_number():
+    documents = [_document(0, "SO1"), _document(1, "SO2"), _document(2, "SO3")]
+    status = {"SuccessEntitys": [{"DIndex": 0, "Id": 1}, {"Number": "SO3", "Id": 3}, {"Number": "SO9", "Id": 9}]}
+
+    saved, unattributed = importer._succeeded(status, documents, "FBillNo")
+
+    assert {position: entity["Id"] for position, entity in saved.items()} == {0: 1, 2: 3}
+    assert unattributed == 1
+
+
+def test_resumed_report_skips_committed_chunks_and_checks_uncertain_ones(tmp_path):
+    path = str(tmp_path / "report.csv")
+    documents = [_document(0, "SO1"), _document(1, "SO2"), _document(2, "SO3")]
+    report = ImportReport(path, META, resume=False)
+    report.commit([importer._record(0, documents[0], "saved"), importer._record(0, documents[1], "saved")])
+    report.commit(importer.uncertain_records(1, documents[2:], TimeoutError("read timed out")))
+
+    resumed = ImportReport(path, META, resume=True)
+
+    assert resumed.committed == {0}
+    assert resumed.uncertain == {1: {2}}
+    with pytest.raises(RuntimeError, match="导入报告已存在"):
+        ImportReport(path, META, resume=False)
+    with pytest.raises(RuntimeError, match="chunk_size"):
+        ImportReport(path, dict(META, chunk_size=5), resume=True)
+
+
+def test_uncertain_documents_found_saved_are_not_sent_again():
+    client = SaveClient({"SO1": 11})
+    documents = [_document(0, "SO1"), _document(1, "SO2"), ImportDocument(2, "#3", [3], {})]
+
+    records = importer.verify_chunk(client, "SAL_SaleOrder", 0, documents, {}, False, False, "FBillNo", resend=False)
+
+    assert client.sent == [["SO2"]]
+    assert client.lookups == [False]
+    assert {r["key"]: r["status"] for r in records} == {"SO1": "saved", "SO2": "saved", "#3": importer.UNCERTAIN}
+
+
+def test_saved_check_does_not_trust_the_query_cache(tmp_path, monkeypatch):
+    cache = QueryCache(str(tmp_path / "cache.db"))
+    client = K3CloudClient(K3CloudConfig("http://stub/K3Cloud/", "acct", "app", "secret", "user"), cache=cache)
+    answers = iter(["[]", '[[11, "SO1"]]'])
+    monkeypatch.setattr(type(client.sdk), "ExecuteBillQuery", lambda self, data: next(answers), raising=False)
+
+    # A lookup made before the save was cached as "not found"
+    lookup = {"FormId": "SAL_SaleOrder", "FieldKeys": "FID,FBillNo", "FilterString": "FBillNo IN ('SO1')",
+              "OrderString": "", "TopRowCount": 0, "StartRow": 0, "Limit": 0}
+    assert client.bill_query(lookup) == "[]"
+
+    assert importer.find_saved(client, "SAL_SaleOrder", "FBillNo", ["SO1"]) == {"SO1": (11, "SO1")}
+    # The bypassing lookup leaves the cache as it was
+    assert cache.get(lookup) == "[]"
@@ -0,0 +1,63 @@
+import re
+
+import pytest
+
+from conftest import StubClient, bill_rows, fetch_all
+
+KEYSET_SPEC = "sales-out --field-keys FID,FEntity_FEntryID,FQty --seek-key FID --page-size 2 --retries 0"
+FIDS = [1, 1, 2, 2, 2, 3, 4]
+
+
+class SeekingClient(StubClient):
+    """StubClient that also applies the seek FilterString and sorts by the OrderString fields."""
+
+    def bill_query(self, data, **kwargs):
+        condition = re.sub(r"\b(F\w+)\b", r"row['\1']", data["FilterString"] or "True")
+        condition = condition.replace(" = ", " == ").replace(" AND ", " and ").replace(" OR ", " or ")
+        order = [part.split()[0] for part in data["OrderString"].split(",")]
+        table = self.rows
+        self.rows = sorted((row for row in table if eval(condition)), key=lambda row: [row[f] for f in order])
+        try:
+            return super().bill_query(data, **kwargs)
+        finally:
+            self.rows = table
+
+
+def _rows():
+    # Entry ids out of order within each FID, so only the tie-break makes the order total
+    return bill_rows(len(FIDS), FID=lambda i: FIDS[i], FQty=lambda i: i)[::-1]
+
+
+def test_key_groups_larger_than_a_page_are_drained_in_a_total_order(query_args):
+    client = SeekingClient(_rows())
+
+    fetched = fetch_all(client, query_args(KEYSET_SPEC))
+
+    assert [(fid, entry) for fid, entry, _ in fetched] == [(FIDS[i], i + 1) for i in range(len(FIDS))]
+    drains = [r for r in client.requests if "FID = " in r["FilterString"]]
+    assert {r["OrderString"] for r in drains} == {"FID ASC,FEntity_FEntryID ASC"}
+    assert {r["StartRow"] for r in drains} == {0, 2}
+
+
+def test_key_that_is_not_unique_needs_a_tie_break(query_args):
+    with pytest.raises(RuntimeError, match="唯一字段"):
+        fetch_all(SeekingClient(_rows()), query_args("sales-out --field-keys FDate,FQty --seek-key FDate"))
+
+
+def test_request_failing_after_retries_ends_with_a_partial_result(query_args):
+    def fail(data):
+        if "FID > 2" in data["FilterString"]:
+            raise ConnectionError("connection reset")
+
+    args = query_args(KEYSET_SPEC)
+    fetched = fetch_all(SeekingClient(_rows(), fail=fail), args)
+
+    assert [fid for fid, _, _ in fetched] == [1, 1, 2, 2, 2]
+    assert "FID=(2,)" in args.incomplete
+
+
+def test_error_on_the_first_page_raises(query_args):
+    client = SeekingClient(_rows(), fail=lambda data: "no permission")
+
+    with pytest.raises(RuntimeError, match="no permission"):
+        fetch_all(client, query_args(KEYSET_SPEC))
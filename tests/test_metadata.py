@@ -0,0 +1,75 @@
+import json
+
+import pytest
+
+import commands
+import metadata
+from conftest import StubClient, bill_rows
+
+
+def _business_info(*fields):
+    """A QueryBusinessInfo response for SAL_OUTSTOCK with (key, caption, type) fields in one entity."""
+    return json.dumps({"Result": {"ResponseStatus": {"IsSuccess": True}, "NeedReturnData": {
+        "PkFieldName": "FID",
+        "Entrys": [{"Key": "FEntity", "Fields": [
+            {"Key": key, "Name": [{"Key": 2052, "Value": caption}], "ElementType": type_name} for key, caption, type_name in fields
+        ]}],
+    }}})
+
+
+class MetadataClient(StubClient):
+    """StubClient that also answers QueryBusinessInfo, one queued response per call."""
+
+    def __init__(self, tmp_path, *responses):
+        super().__init__(bill_rows(2, FQty=lambda i: i, FDate=lambda i: "2024-01-01T00:00:00"))
+        self.config.metadata_file = str(tmp_path / "metadata.db")
+        self.config.metadata_ttl = 3600
+        self.config.lcid = 2052
+        self.responses = list(responses)
+        self.info_requests = 0
+
+    def query_business_info(self, data, timeout_s=None):
+        self.info_requests += 1
+        return self.responses.pop(0)
+
+
+FIELDS = [("FQty", "实发数量", "QtyField"), ("FDate", "日期", "DateField"), ("FMaterialId", "物料编码", "BaseDataField")]
+
+
+def test_business_info_gives_captions_and_kinds():
+    form = metadata.parse_business_info("SAL_OUTSTOCK", _business_info(*FIELDS))
+
+    assert form.kind("FQty") == "float" and form.kind("FDate") == "datetime"
+    assert form.kind("FMaterialId.FNumber") is None
+    assert form.caption("FMaterialId.FNumber") == "物料编码.FNumber"
+    assert form.unknown_fields(["FID", "FEntity_FEntryID", "fqty", "FQtty"]) == ["FQtty"]
+
+
+def test_unknown_field_is_reported_with_a_suggestion(tmp_path):
+    client = MetadataClient(tmp_path, _business_info(*FIELDS))
+
+    with pytest.raises(RuntimeError, match=r"FQtty \(是否为 FQty\?\)"):
+        metadata.validated_metadata(client, "SAL_OUTSTOCK", ["FQtty"])
+
+
+def test_cached_metadata_is_refetched_once_for_a_new_field(tmp_path):
+    client = MetadataClient(tmp_path, _business_info(*FIELDS), _business_info(*FIELDS, ("FNote", "备注", "TextField")))
+    metadata.validated_metadata(client, "SAL_OUTSTOCK", ["FQty"])
+    assert metadata.validated_metadata(client, "SAL_OUTSTOCK", ["FQty"]) is not None
+    assert client.info_requests == 1
+
+    form = metadata.validated_metadata(client, "SAL_OUTSTOCK", ["FNote"])
+
+    assert form.kind("FNote") == "string"
+    assert client.info_requests == 2
+
+
+def test_query_takes_captions_and_kinds_from_metadata(tmp_path, query_args):
+    client = MetadataClient(tmp_path, _business_info(*FIELDS))
+    args = query_args("sales-out --field-keys FQty,FDate --header caption", no_metadata=False)
+
+    rows = commands.cmd_bill_query(client, args)
+
+    assert rows == [[0, "2024-01-01T00:00:00"], [1, "2024-01-01T00:00:00"]]
+    assert args.column_names == ["实发数量", "日期"]
+    assert args.column_kinds == {"实发数量": "float", "日期": "datetime"}
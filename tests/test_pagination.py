@@ -0,0 +1,196 @@
+import os
+import sqlite3
+import time
+
+import pandas as pd
+import pytest
+
+import commands
+import main
+import pagination
+from conftest import StubClient, bill_rows, error_response, fetch_all
+from pagination import PageSizer, RetryPolicy
+
+CHECKPOINT_SPEC = "sales-out --field-keys FEntity_FEntryID,FQty --order-string FEntity_FEntryID --page-size 2 --retries 0"
+QUERY = {"FormId": "SAL_OUTSTOCK", "FieldKeys": "FQty", "StartRow": 0, "Limit": 2}
+
+
+def _rows(count):
+    return bill_rows(count, FQty=lambda i: i)
+
+
+@pytest.fixture
+def no_sleep(monkeypatch):
+    monkeypatch.setattr(pagination.time, "sleep", lambda seconds: None)
+
+
+def test_parallel_pages_are_yielded_in_page_order(query_args):
+    # Later pages answer first
+    client = StubClient(_rows(9), fail=lambda data: time.sleep(0.02 / (1 + data["StartRow"])))
+
+    rows = fetch_all(client, query_args("sales-out --field-keys FQty --page-size 2 --workers 4"))
+
+    assert rows == [[i] for i in range(9)]
+
+
+def test_parallel_fetch_stops_requesting_after_the_last_page(query_args):
+    client = StubClient(_rows(9))
+
+    fetch_all(client, query_args("sales-out --field-keys FQty --page-size 2 --workers 3"))
+
+    # Five pages hold the rows; at most `workers` more were in flight when the short page arrived
+    starts = sorted(r["StartRow"] for r in client.requests)
+    assert starts[:5] == [0, 2, 4, 6, 8]
+    assert len(starts) <= 5 + 3
+
+
+def test_page_size_follows_latency_within_bounds():
+    sizer = PageSizer(initial=1000, min_size=100, max_size=3000, target_latency=2.0, adaptive=True)
+
+    sizer.observe(1000, 1000, 8.0, 0)  # wants 250 rows, but halves at most
+    assert sizer.size == 500
+    sizer.observe(500, 500, 0.1, 0)  # wants 10000 rows, but doubles at most
+    assert sizer.size == 1000
+    for _ in range(3):
+        sizer.observe(sizer.size, sizer.size, 0.1, 0)
+    assert sizer.size == 3000
+
+
+def test_page_size_ignores_short_pages_and_respects_max_bytes():
+    sizer = PageSizer(initial=1000, min_size=100, max_size=2000, max_bytes=400_000, adaptive=True)
+
+    sizer.observe(1000, 10, 30.0, 0)  # the last page says nothing about cost
+    assert sizer.size == 1000
+    sizer.observe(1000, 1000, 0.5, 500_000)  # fast, but 500 bytes a row
+    assert sizer.size == 800
+
+    fixed = PageSizer(initial=1000)
+    fixed.observe(1000, 1000, 60.0, 0)
+    assert fixed.size == 1000
+
+
+def test_retry_delay_is_jittered_and_capped():
+    policy = RetryPolicy(retries=5, base_delay=1.0, max_delay=4.0)
+
+    for attempt, ceiling in [(0, 1.0), (1, 2.0), (2, 4.0), (5, 4.0)]:
+        for _ in range(20):
+            assert ceiling / 2 <= policy.delay(attempt) <= ceiling
+
+
+def test_failed_request_is_retried(no_sleep):
+    failures = iter(["server busy", "server busy"])
+    client = StubClient(_rows(3), fail=lambda data: next(failures, None))
+
+    page = pagination._timed_bill_query(client, dict(QUERY), RetryPolicy(retries=2, base_delay=0))
+
+    assert page.response == "[[0], [1]]"
+    assert len(client.requests) == 3
+
+
+def test_error_response_is_returned_once_retries_are_used_up(no_sleep):
+    client = StubClient(_rows(3), fail=lambda data: "server busy")
+
+    page = pagination._timed_bill_query(client, dict(QUERY), RetryPolicy(retries=1, base_delay=0))
+
+    assert "server busy" in page.response
+    assert len(client.requests) == 2
+
+
+@pytest.mark.parametrize("msg_code, requests", [(9, 1), (11, 1), (4, 3), (14, 3)])
+def test_only_transient_errors_are_retried(no_sleep, msg_code, requests):
+    client = StubClient(_rows(3))
+    client.bill_query = lambda data, **kwargs: client.requests.append(data) or error_response("failed", msg_code)
+
+    page = pagination._timed_bill_query(client, dict(QUERY), RetryPolicy(retries=2, base_delay=0))
+
+    assert "failed" in page.response
+    assert len(client.requests) == requests
+
+
+def _export(client, args):
+    return main.export_result(client.config, args, commands.cmd_bill_query(client, args))
+
+
+def _fails_at(start_row):
+    return lambda data: "server busy" if data["StartRow"] == start_row else None
+
+
+@pytest.mark.parametrize("mode", ["--stream", ""])
+def test_resume_appends_the_missing_rows(query_args, tmp_path, mode):
+    rows = _rows(7)
+    output = tmp_path / "out.csv"
+    spec = f"{CHECKPOINT_SPEC} --output-format csv --output {output} {mode}"
+    db = str(tmp_path / "checkpoint.db")
+    assert _export(StubClient(rows, fail=_fails_at(4)), query_args(spec, checkpoint_db=db)) == 1
+    # Rows written after the last saved point (a killed run) are cut off again
+    with open(output, "a", encoding="utf-8") as f:
+        f.write("4,half a row")
+
+    client = StubClient(rows)
+    assert _export(client, query_args(spec + " --resume", checkpoint_db=db)) == 0
+
+    assert output.read_text(encoding="utf-8-sig").splitlines() == ["FEntity_FEntryID,FQty"] + [f"{i + 1},{i}" for i in range(7)]
+    # One row to check the last key, then only the missing pages
+    assert [(r["StartRow"], r["Limit"]) for r in client.requests] == [(3, 1), (4, 2), (6, 2)]
+    assert not (tmp_path / "out.csv.incomplete").exists()
+    assert not _saved(db)
+
+
+def test_resume_appends_to_the_excel_sheet(query_args, tmp_path):
+    rows = _rows(5)
+    db = str(tmp_path / "checkpoint.db")
+    failing = StubClient(rows, fail=_fails_at(2))
+    failing.config.excel_file = str(tmp_path / "out.xlsx")
+    assert _export(failing, query_args(CHECKPOINT_SPEC, checkpoint_db=db)) == 1
+
+    client = StubClient(rows)
+    client.config.excel_file = str(tmp_path / "other.xlsx")
+    assert _export(client, query_args(CHECKPOINT_SPEC + " --resume", checkpoint_db=db)) == 0
+
+    assert pd.read_excel(failing.config.excel_file)["FQty"].tolist() == list(range(5))
+    assert not os.path.exists(client.config.excel_file)
+
+
+def test_resume_refuses_rows_that_have_shifted(query_args, tmp_path):
+    spec = f"{CHECKPOINT_SPEC} --output-format csv --output {tmp_path / 'out.csv'}"
+    db = str(tmp_path / "checkpoint.db")
+    assert _export(StubClient(_rows(7), fail=_fails_at(4)), query_args(spec, checkpoint_db=db)) == 1
+
+    # A document inserted before the checkpoint moves every later row down by one
+    shifted = [{"FEntity_FEntryID": 0, "FQty": -1}] + _rows(7)
+    with pytest.raises(RuntimeError, match="无法续传"):
+        _export(StubClient(shifted), query_args(spec + " --resume", checkpoint_db=db))
+
+
+def test_checkpoint_needs_a_unique_order(query_args, tmp_path):
+    db = str(tmp_path / "c.db")
+    spec = f"sales-out --field-keys FQty --order-string FDate --page-size 2 --retries 0 --output-format csv --output {tmp_path / 'out.csv'}"
+
+    with pytest.raises(RuntimeError, match="唯一键"):
+        _export(StubClient(_rows(3)), query_args(spec + " --checkpoint", checkpoint_db=db))
+    # Without --checkpoint the export just runs without one
+    args = query_args(spec, checkpoint_db=db)
+    assert _export(StubClient(_rows(3), fail=_fails_at(2)), args) == 1
+    assert args.checkpoint_store is None and not os.path.exists(db)
+
+
+def test_unappendable_output_cannot_be_checkpointed(query_args, tmp_path):
+    args = query_args(f"{CHECKPOINT_SPEC} --output-format parquet --checkpoint", checkpoint_db=str(tmp_path / "c.db"))
+
+    with pytest.raises(RuntimeError, match="parquet 文件不能追加"):
+        commands.cmd_bill_query(StubClient(_rows(3)), args)
+
+
+def _saved(db):
+    with sqlite3.connect(db) as conn:
+        return conn.execute("SELECT * FROM checkpoint_runs").fetchall()
+
+
+def test_wrapped_error_response_is_not_taken_for_rows():
+    response = error_response("field FMissing does not exist")
+
+    with pytest.raises(pagination.BillQueryError, match="FMissing"):
+        pagination._decode_rows(response, first=True)
+    assert pagination._decode_rows(response, first=False) is None
+    # A one-row, one-column page is still rows
+    assert pagination._decode_rows('[[{"FNumber": "M1"}]]', first=True) == [[{"FNumber": "M1"}]]
@@ -0,0 +1,74 @@
+import argparse
+import logging
+import threading
+import time
+
+import pytest
+
+import scheduler
+from ratelimit import RateLimiter
+
+
+def test_no_limits_means_no_limiter():
+    assert RateLimiter.from_values(0, 0) is None
+    assert RateLimiter.from_values(None, None) is None
+    assert RateLimiter.from_values(0, 2).max_inflight == 2
+
+
+def test_negative_limits_are_rejected():
+    with pytest.raises(RuntimeError):
+        RateLimiter(rate=-1)
+    with pytest.raises(RuntimeError):
+        RateLimiter(max_inflight=-1)
+
+
+def test_max_inflight_caps_concurrent_requests():
+    limiter = RateLimiter(max_inflight=2)
+    lock = threading.Lock()
+    inflight = []
+    peak = []
+
+    def request():
+        with limiter.slot():
+            with lock:
+                inflight.append(1)
+                peak.append(len(inflight))
+            time.sleep(0.02)
+            with lock:
+                inflight.pop()
+
+    threads = [threading.Thread(target=request) for _ in range(6)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert max(peak) == 2
+    assert limiter.stats()["requests"] == 6
+
+
+def test_rate_paces_requests_after_the_burst():
+    limiter = RateLimiter(rate=50, burst=2)
+
+    started = time.monotonic()
+    for _ in range(6):
+        with limiter.slot():
+            pass
+    elapsed = time.monotonic() - started
+
+    # Two start at once, the other four wait 1/50 s each
+    assert elapsed >= 4 / 50 * 0.9
+    assert limiter.stats()["wait_seconds"] > 0
+
+
+def test_schedule_report_goes_to_the_log(tmp_path, caplog, capsys):
+    history = scheduler.JobHistory(str(tmp_path / "history.db"))
+    history.record("stock", time.time(), 1.5, 0)
+    history.close()
+    caplog.set_level(logging.INFO, logger="k3cloud")
+
+    args = argparse.Namespace(report=True, history=str(tmp_path / "history.db"))
+    assert scheduler.schedule(None, args, None, None) == 0
+
+    assert "stock" in caplog.text
+    assert capsys.readouterr().out == ""
@@ -0,0 +1,74 @@
+import pytest
+
+import reconcile
+
+COLUMNS = ["FBillNo", "FSaleOrderEntry_FEntryID", "FQty", "FAmount"]
+RIGHT_FIELDS = ["FSOEntryId", "FRealQty", "FAmount"]
+
+
+def _matcher():
+    return reconcile.Reconciliation(
+        COLUMNS, ["FSaleOrderEntry_FEntryID"], ["FSOEntryId"], ("FQty", "FRealQty"), ("FAmount", "FAmount")
+    )
+
+
+def _reconciled(left, right, statuses="all"):
+    matcher = _matcher()
+    matcher.build([left])
+    matcher.probe([right], RIGHT_FIELDS)
+    return matcher.report(reconcile.parse_statuses(statuses))
+
+
+def test_statuses_of_left_lines():
+    left = [
+        ["SO1", 1, 10, 100.0],
+        ["SO1", 2, 10, 100.0],
+        ["SO2", 3, 10, 100.0],
+        ["SO2", 4, 10, 100.0],
+    ]
+    right = [
+        [1, 4, 40.0],
+        [1, 6, 60.0],  # two deliveries complete line 1
+        [2, 3, 30.0],
+        [3, 12, 120.0],
+        [9, 1, 10.0],
+    ]
+    headers, rows, counts = _reconciled(left, right)
+
+    assert headers[0] == reconcile.STATUS_COLUMN
+    by_line = {row[2]: row for row in rows if row[0] != "unmatched"}
+    assert by_line[1][0] == "fulfilled" and by_line[1][5] == 2
+    assert by_line[2][0] == "partial" and by_line[2][7] == 7
+    assert by_line[3][0] == "over" and by_line[3][7] == -2
+    assert by_line[4][0] == "open"
+    assert counts == {"open": 1, "partial": 1, "fulfilled": 1, "over": 1, "unmatched": 1}
+
+
+def test_unmatched_right_keys_carry_their_key_only():
+    _, rows, _ = _reconciled([["SO1", 1, 10, 100.0]], [["9", 2, 20.0]], "unmatched")
+
+    assert rows == [["unmatched", None, "9", None, None, 1, 2.0, -2.0, 20.0, -20.0]]
+
+
+def test_keys_match_across_number_types():
+    # Entry ids can come back as int on one form and float on the other
+    _, _, counts = _reconciled([["SO1", 1, 10, 100.0]], [[1.0, 10, 100.0]])
+
+    assert counts["fulfilled"] == 1 and counts["unmatched"] == 0
+
+
+def test_default_statuses_leave_out_fulfilled_and_unmatched():
+    assert reconcile.parse_statuses(reconcile.DEFAULT_STATUSES) == ["open", "partial", "over"]
+    with pytest.raises(RuntimeError):
+        reconcile.parse_statuses("open,closed")
+
+
+def test_right_is_restricted_to_left_keys():
+    matcher = _matcher()
+    matcher.build([[["SO1", 3, 1, 1.0], ["SO1", 1, 1, 1.0], ["SO2", 2, 1, 1.0]]])
+
+    assert list(reconcile.key_filters("FSOEntryId", matcher.left_key_values(), 2)) == [
+        "FSOEntryId IN (1,2)",
+        "FSOEntryId IN (3)",
+    ]
+    assert list(reconcile.key_filters("FBillNo", ["A'1", "B"])) == ["FBillNo IN ('A''1','B')"]
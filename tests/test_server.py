@@ -0,0 +1,74 @@
+import logging
+import threading
+
+import pytest
+
+import main
+import scheduler
+from logger import ContextThreadPoolExecutor, get_logger
+from server import QueryService
+
+logger = get_logger("test_server")
+
+GLOBAL_ARGV = ["--config", "config.ini", "--section", "k3cloud"]
+
+
+def _log_from_workers(client, args):
+    """A command whose log lines come from pool threads, as paged queries' do."""
+    with ContextThreadPoolExecutor(max_workers=2) as executor:
+        for future in [executor.submit(logger.info, f"page of {args.filter_string}") for _ in range(2)]:
+            future.result()
+    return 0
+
+
+@pytest.fixture
+def service(caplog):
+    caplog.set_level(logging.INFO, logger="k3cloud")
+    service = QueryService(None, main.build_parser, _log_from_workers, GLOBAL_ARGV, concurrency=4)
+    yield service
+    service.close()
+
+
+def test_bad_arguments_are_reported_without_exiting(service):
+    result = service.run(["inventory", "--limit", "many"])
+
+    assert result["exit_code"] == 2
+    assert any("Invalid arguments: argument --limit" in line for line in result["log"])
+
+
+def test_help_is_returned_as_output(service):
+    result = service.run(["inventory", "--help"])
+
+    assert result["exit_code"] == 0
+    assert result["output"].startswith("usage: k3cloud inventory")
+
+
+def test_forbidden_commands_are_refused(service):
+    assert service.run(["serve"])["exit_code"] == 2
+
+
+def test_worker_thread_logs_stay_with_their_request(service):
+    results = {}
+    barrier = threading.Barrier(2)
+
+    def request(name):
+        barrier.wait()
+        results[name] = service.run(["inventory", "--filter-string", name])
+
+    threads = [threading.Thread(target=request, args=(name,)) for name in ("A", "B")]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for name in ("A", "B"):
+        pages = [line for line in results[name]["log"] if "page of" in line]
+        assert len(pages) == 2
+        assert all(line.endswith(f"page of {name}") for line in pages)
+
+
+def test_scheduled_jobs_are_validated_up_front():
+    jobs = [scheduler.Job("stock", ["inventory", "--limit", "many"], 60)]
+
+    with pytest.raises(RuntimeError, match="任务 stock 参数错误"):
+        scheduler._validate(jobs, main.build_parser, GLOBAL_ARGV)
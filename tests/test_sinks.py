@@ -0,0 +1,84 @@
+import argparse
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+from openpyxl import load_workbook
+
+import export
+import sinks
+
+
+def _args(output_format, output="", **overrides):
+    args = argparse.Namespace(command="sales-out", output_format=output_format, output=output, field_keys="FBillNo,FAmount")
+    vars(args).update(overrides)
+    return args
+
+
+def test_streamed_excel_goes_to_a_new_excel_file(tmp_path):
+    excel_file = str(tmp_path / "out.xlsx")
+
+    assert export.export_batches(_args("excel"), iter([[["SO1", 1]], [["SO2", 2]]]), "销售出库单", excel_file) == 0
+
+    rows = list(load_workbook(excel_file)["销售出库单"].values)
+    assert rows == [("FBillNo", "FAmount"), ("SO1", 1), ("SO2", 2)]
+
+
+def test_streamed_excel_refuses_an_existing_excel_file_before_fetching(tmp_path):
+    excel_file = tmp_path / "out.xlsx"
+    excel_file.write_bytes(b"other sheets")
+    fetched = []
+
+    def batches():
+        fetched.append(True)
+        yield [["SO1", 1]]
+
+    with pytest.raises(RuntimeError, match="流式 Excel 输出不能追加"):
+        export.export_batches(_args("excel"), batches(), "销售出库单", str(excel_file))
+
+    assert excel_file.read_bytes() == b"other sheets"
+    assert not fetched
+
+
+def test_full_sheets_roll_over(tmp_path, monkeypatch):
+    monkeypatch.setattr(sinks, "EXCEL_MAX_ROWS", 3)
+    path = str(tmp_path / "out.xlsx")
+
+    with sinks.ExcelSink(path, ["FBillNo"], sheet_name="Data") as sink:
+        sink.write_batch([[f"SO{i}"] for i in range(5)])
+
+    assert [(ws.title, ws.max_row) for ws in load_workbook(path)] == [("Data", 3), ("Data_2", 3), ("Data_3", 2)]
+
+
+@pytest.mark.parametrize("output_format", ["csv", "jsonl"])
+def test_row_sinks_write_every_batch(tmp_path, output_format):
+    path = tmp_path / f"out.{output_format}"
+
+    export.export_batches(_args(output_format, str(path)), iter([[["SO1", 1]], [["SO2", None]]]), "Sheet1")
+
+    lines = path.read_text(encoding="utf-8-sig").splitlines()
+    if output_format == "csv":
+        assert lines == ["FBillNo,FAmount", "SO1,1", "SO2,"]
+    else:
+        assert lines == ['{"FBillNo": "SO1", "FAmount": 1}', '{"FBillNo": "SO2", "FAmount": null}']
+
+
+def test_arrow_schema_follows_the_known_kinds(tmp_path):
+    path = str(tmp_path / "out.parquet")
+
+    # Integral amounts on the first page, a null-only column: the kinds decide, not the first page
+    with sinks.ParquetSink(path, ["FAmount", "FNote"], kinds={"famount": "float"}) as sink:
+        sink.write_batch([[1, None], [2, None]])
+        sink.write_batch([[2.5, "late note"]])
+
+    table = pq.read_table(path)
+    assert table.schema.field("FAmount").type == pa.float64()
+    assert table.schema.field("FNote").type == pa.string()
+    assert table.column("FAmount").to_pylist() == [1.0, 2.0, 2.5]
+
+
+def test_arrow_type_change_between_pages_is_reported(tmp_path):
+    with pytest.raises(RuntimeError, match="--dtype FAmount:string"):
+        with sinks.ParquetSink(str(tmp_path / "out.parquet"), ["FAmount"]) as sink:
+            sink.write_batch([[1], [2]])
+            sink.write_batch([["n/a"]])
@@ -0,0 +1,59 @@
+import pytest
+
+import snapshot
+from conftest import StubClient
+
+SNAPSHOT_SPEC = "sales-order --snapshot --field-keys FQty --page-size 2 --retries 0"
+
+
+def _rows(qty):
+    return [{"FSaleOrderEntry_FEntryID": key, "FQty": value} for key, value in qty.items()]
+
+
+def _run(args, rows, export=True):
+    batches = snapshot.run_snapshot(StubClient(rows), "SAL_SaleOrder", args)
+    delta = [row for batch in batches for row in batch]
+    if export:
+        args.after_export()
+    return sorted(delta, key=lambda row: (row[0], row[1]))
+
+
+@pytest.fixture
+def snapshot_args(query_args, tmp_path):
+    return lambda: query_args(SNAPSHOT_SPEC, db=str(tmp_path / "snapshot.db"))
+
+
+def test_first_snapshot_reports_every_row_as_inserted(snapshot_args):
+    args = snapshot_args()
+    delta = _run(args, _rows({1: 5, 2: 7}))
+
+    assert args.column_names == [snapshot.CHANGE_COLUMN, "FQty", "FSaleOrderEntry_FEntryID"]
+    assert delta == [["insert", 5, 1], ["insert", 7, 2]]
+
+
+def test_diff_reports_inserts_updates_and_deletes(snapshot_args):
+    _run(snapshot_args(), _rows({1: 5, 2: 7, 3: 9}))
+
+    delta = _run(snapshot_args(), _rows({1: 5, 2: 8, 4: 1}))
+
+    assert delta == [["delete", None, 3], ["insert", 1, 4], ["update", 8, 2]]
+
+
+def test_index_is_only_saved_after_the_export(snapshot_args):
+    _run(snapshot_args(), _rows({1: 5}))
+
+    # The output was never written: the next run must report the same change again
+    _run(snapshot_args(), _rows({1: 6}), export=False)
+    delta = _run(snapshot_args(), _rows({1: 6}))
+
+    assert delta == [["update", 6, 1]]
+
+
+def test_failed_page_keeps_the_index(snapshot_args):
+    _run(snapshot_args(), _rows({1: 5, 2: 7, 3: 9}))
+
+    client = StubClient(_rows({1: 5, 2: 7, 3: 9}), fail=lambda data: "server busy" if data["StartRow"] == 2 else None)
+    with pytest.raises(RuntimeError, match="索引未更新"):
+        list(snapshot.run_snapshot(client, "SAL_SaleOrder", snapshot_args()))
+
+    assert _run(snapshot_args(), _rows({1: 5, 2: 7, 3: 9})) == []
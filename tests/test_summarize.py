@@ -0,0 +1,99 @@
+import argparse
+import json
+
+import pandas as pd
+import pytest
+
+import commands
+import main
+import summarize
+from conftest import StubClient, bill_rows
+
+
+def _summarize_args(target="inventory --no-metadata --page-size 2", **overrides):
+    args = argparse.Namespace(
+        target=target, group_by="FStockId", agg="FBaseQty:sum", date_grain="",
+        report_form="", report_scheme="", report_model="",
+    )
+    vars(args).update(overrides)
+    return args
+
+
+def _stock_rows(count):
+    return bill_rows(
+        count,
+        FID=lambda i: i,
+        FStockId=lambda i: f"S{i % 2}",
+        FMaterialId=lambda i: f"M{i % 3}",
+        FBaseQty=lambda i: i + 0.5,
+        FDate=lambda i: f"2024-0{i % 3 + 1}-15T00:00:00",
+    )
+
+
+def test_parse_aggregations_defaults_to_sum():
+    assert summarize.parse_aggregations("FBaseQty, FBillNo:count ,FAmount:MEAN") == [
+        ("FBaseQty", "sum"), ("FBillNo", "count"), ("FAmount", "mean"),
+    ]
+    with pytest.raises(RuntimeError, match="不支持的汇总函数"):
+        summarize.parse_aggregations("FBaseQty:median")
+
+
+def test_summary_fields_are_fetched_once():
+    assert summarize.summary_fields(["FStockId", "fstockid"], [("FBaseQty", "sum"), ("FStockId", "count")]) == [
+        "FStockId", "FBaseQty",
+    ]
+
+
+def test_aggregate_groups_and_truncates_dates():
+    df = pd.DataFrame({
+        "FDate": pd.to_datetime(["2024-01-03", "2024-01-20", "2024-02-01"]),
+        "FQty": [1.0, 2.0, 4.0],
+    })
+
+    summary = summarize.aggregate(df, ["FDate"], [("FQty", "sum"), ("FQty", "count")], "month")
+
+    assert summary["FDate"].dt.month.tolist() == [1, 2]
+    assert summary["FQty_sum"].tolist() == [3.0, 4.0]
+    assert summary["FQty_count"].tolist() == [2, 1]
+
+
+def test_aggregate_without_groups_returns_grand_totals():
+    summary = summarize.aggregate(pd.DataFrame({"FQty": [1, 2, 3]}), [], [("FQty", "max")])
+
+    assert summary.to_dict("records") == [{"FQty_max": 3}]
+
+
+def test_summarize_fetches_only_the_needed_fields():
+    client = StubClient(_stock_rows(5))
+    args = _summarize_args()
+
+    rows = commands.cmd_summarize(client, args)
+
+    assert args.column_names == ["FStockId", "FBaseQty_sum"]
+    assert rows == [["S0", 0.5 + 2.5 + 4.5], ["S1", 1.5 + 3.5]]
+    assert {r["FieldKeys"] for r in client.requests} == {"FStockId,FBaseQty"}
+
+
+def test_summary_of_a_partial_result_is_flagged(tmp_path):
+    client = StubClient(_stock_rows(5), fail=lambda data: "server busy" if data["StartRow"] == 4 else None)
+    client.config.excel_file = str(tmp_path / "summary.xlsx")
+    args = _summarize_args(target="inventory --no-metadata --page-size 2 --retries 0", command="summarize")
+
+    rows = commands.cmd_summarize(client, args)
+
+    assert rows == [["S0", 0.5 + 2.5], ["S1", 1.5 + 3.5]]
+    assert "StartRow=4" in args.incomplete
+    assert main.export_result(client.config, args, rows) == 1
+    assert (tmp_path / "summary.xlsx.incomplete").exists()
+
+
+def test_report_rows_push_down_only_re_aggregatable_functions():
+    with pytest.raises(RuntimeError, match="--report-form 只支持"):
+        commands.cmd_summarize(StubClient([]), _summarize_args(report_form="STK_StockSummaryRpt", agg="FBaseQty:mean"))
+
+
+def test_report_errors_are_raised():
+    error = json.dumps({"Result": {"IsSuccess": False, "ResponseStatus": {"Errors": [{"Message": "no permission"}]}}})
+
+    with pytest.raises(RuntimeError, match="no permission"):
+        summarize._report_rows(error)
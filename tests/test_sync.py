@@ -0,0 +1,56 @@
+import sqlite3
+
+import pytest
+
+import sync
+from conftest import StubClient, bill_rows
+
+SYNC_SPEC = "sales-order --sync --field-keys FQty --page-size 2 --retries 0"
+
+
+def _rows(count):
+    return bill_rows(
+        count,
+        "FSaleOrderEntry_FEntryID",
+        FID=lambda i: i // 2 + 1,
+        FQty=lambda i: i,
+        FModifyDate=lambda i: f"2024-01-01T00:{i:02d}:00",
+    )
+
+
+def _watermark(args, form_id="SAL_SaleOrder"):
+    conn = sync.open_store(args.db)
+    try:
+        return sync.load_watermark(conn, form_id, args.filter_string)
+    finally:
+        conn.close()
+
+
+def test_sync_saves_the_latest_watermark(query_args, tmp_path):
+    args = query_args(SYNC_SPEC, db=str(tmp_path / "sync.db"))
+    result = sync.run_sync(StubClient(_rows(5)), "SAL_SaleOrder", args)
+
+    assert result["rows"] == 5
+    assert _watermark(args) == "2024-01-01T00:04:00"
+
+
+def test_sync_orders_by_watermark_and_key(query_args, tmp_path):
+    client = StubClient(_rows(3))
+    sync.run_sync(client, "SAL_SaleOrder", query_args(SYNC_SPEC, db=str(tmp_path / "sync.db")))
+
+    assert client.requests[0]["OrderString"] == "FModifyDate ASC,FSaleOrderEntry_FEntryID ASC"
+
+
+def test_failed_later_page_keeps_the_watermark(query_args, tmp_path):
+    args = query_args(SYNC_SPEC, db=str(tmp_path / "sync.db"))
+    sync.run_sync(StubClient(_rows(2)), "SAL_SaleOrder", args)
+
+    # The second page fails: the rows of the first page must not move the watermark past it
+    client = StubClient(_rows(6), fail=lambda data: "server busy" if data["StartRow"] == 2 else None)
+    with pytest.raises(RuntimeError, match="水位线未更新"):
+        sync.run_sync(client, "SAL_SaleOrder", args)
+
+    assert _watermark(args) == "2024-01-01T00:01:00"
+    with sqlite3.connect(args.db) as conn:
+        # Rows already upserted stay; the next run fetches them again and overwrites
+        assert conn.execute('SELECT COUNT(*) FROM "SAL_SaleOrder"').fetchone()[0] >= 2